@@ -1,8 +1,22 @@
+import io
+import random
+import time
 from typing import Optional
 
-from sqlmodel import Session
+import pytest
+from sqlalchemy import event, text
+from sqlmodel import Session, create_engine
 
-from braid_db import BraidDB, BraidRecord, InvalidationActionType
+from braid_db import BraidDB, BraidRecord, BraidTagType, InvalidationActionType
+from braid_db.jsonl_transfer import (
+    export_entries,
+    import_entries,
+    read_jsonl,
+    write_jsonl,
+)
+from braid_db.models import BraidTagsModel, interner_for
+from braid_db.reachability import BraidReachabilityIndex
+from braid_db.record_cache import BraidRecordCache
 
 
 def test_create_db(braid_db: BraidDB):
@@ -107,7 +121,8 @@ def test_tag_create_and_invalidate(braid_db: BraidDB):
 def test_invalidate_action(braid_db: BraidDB, monkeypatch):
     with braid_db.get_session() as session:
         irec = BraidRecord(braid_db, name="To Be Invalidated")
-        assert irec.record_id is not None
+        record_id = irec.record_id
+        assert record_id is not None
         invalidation_action = irec.add_invalidation_action(
             InvalidationActionType.SHELL_COMMAND,
             "invalidation shell command",
@@ -118,3 +133,1237 @@ def test_invalidate_action(braid_db: BraidDB, monkeypatch):
         session.commit()
         assert invalidation_action is not None
         irec.invalidate("Cause this is a test", session=session)
+        # Actions are only run once the invalidation is committed
+        assert braid_db.invalidation_action_results() == []
+        session.commit()
+    (result,) = braid_db.invalidation_action_results()
+    assert result.ok
+    assert result.action.record_id == record_id
+    assert result.stdout == "Hello To Be Invalidated\n"
+
+
+def test_invalidate_action_cascade(tmp_path):
+    db = BraidDB(str(tmp_path / "actions.db"), action_timeout=1)
+    db.create()
+    root_id, *dep_ids = db.add_records_bulk(
+        [{"name": "root"}]
+        + [{"name": f"dep{i}", "batch_predecessors": [0]} for i in range(3)]
+    )
+    with db.get_session() as session:
+        for dep_id, cmd, args in [
+            (dep_ids[0], "echo", ["{name}", "{uri}"]),
+            (dep_ids[1], "sleep", ["5"]),
+            (dep_ids[2], "/no/such/command", []),
+        ]:
+            BraidRecord.by_record_id(
+                db, dep_id, session=session
+            ).add_invalidation_action(
+                InvalidationActionType.SHELL_COMMAND,
+                cmd,
+                cmd,
+                {"args": args},
+                session=session,
+            )
+        session.commit()
+
+    with db.get_session() as session:
+        root = BraidRecord.by_record_id(db, root_id, session=session)
+        root.invalidate("rolled back", session=session)
+        session.rollback()
+    assert db.invalidation_action_results() == []
+
+    with db.get_session() as session:
+        root = BraidRecord.by_record_id(db, root_id, session=session)
+        root.invalidate("bad root", session=session)
+        session.commit()
+    results = {r.action.record_id: r for r in db.invalidation_action_results()}
+    assert results[dep_ids[0]].ok
+    assert results[dep_ids[0]].stdout == "dep0 \n"
+    assert results[dep_ids[1]].timed_out
+    assert results[dep_ids[2]].error is not None
+
+
+def test_invalidate_action_cascade_without_session(tmp_path):
+    db = BraidDB(str(tmp_path / "actions.db"), action_timeout=5)
+    db.create()
+    root = BraidRecord(db, "root")
+    root.add_invalidation_action(
+        InvalidationActionType.SHELL_COMMAND, "root", "echo", {"args": ["r"]}
+    )
+    deps = []
+    for i in range(2):
+        dep = BraidRecord(db, f"dep{i}")
+        root.add_derivation(dep)
+        dep.add_invalidation_action(
+            InvalidationActionType.SHELL_COMMAND,
+            f"dep{i}",
+            "echo",
+            {"args": ["{name}"]},
+        )
+        deps.append(dep)
+
+    root.invalidate("no session")
+    for record in [root] + deps:
+        assert not BraidRecord.by_record_id(db, record.record_id).is_valid()
+    results = {r.action.record_id: r for r in db.invalidation_action_results()}
+    assert results[root.record_id].stdout == "r\n"
+    for i, dep in enumerate(deps):
+        assert results[dep.record_id].stdout == f"dep{i}\n"
+
+
+def test_add_records_bulk(braid_db: BraidDB):
+    existing = BraidRecord(braid_db, name="Existing")
+    record_ids = braid_db.add_records_bulk(
+        [
+            {
+                "name": "Bulk1",
+                "uris": ["file:///bulk1"],
+                "tags": {"string_tag": "val", "int_tag": 3},
+                "predecessors": [existing.record_id],
+            },
+            {"name": "Bulk2", "batch_predecessors": [0]},
+        ]
+    )
+    assert len(record_ids) == 2
+    bulk1_id, bulk2_id = record_ids
+    assert bulk2_id == bulk1_id + 1
+
+    with braid_db.get_session() as session:
+        assert braid_db.get_uris(bulk1_id, session) == ["file:///bulk1"]
+        tags = braid_db.get_tags(bulk1_id, session)
+        assert tags["string_tag"].type_ is BraidTagType.STRING
+        assert tags["int_tag"].type_ is BraidTagType.INTEGER
+
+        preds = braid_db.get_predecessors(bulk1_id, session)
+        assert [p.record_id for p in preds] == [existing.record_id]
+        derivs = braid_db.get_derivations(bulk1_id, session)
+        assert [d.record_id for d in derivs] == [bulk2_id]
+
+
+def test_batch(braid_db: BraidDB):
+    with braid_db.batch(flush_every=3):
+        parent = BraidRecord(braid_db, name="BatchParent")
+        parent.add_uri("file:///batch_parent")
+        parent.add_tag("batch_tag", "batch_value")
+        child = BraidRecord(braid_db, name="BatchChild")
+        parent.add_derivation(child)
+        assert parent.record_id is not None
+        assert child.record_id is not None
+        parent_id = parent.record_id
+        child_id = child.record_id
+
+    with braid_db.get_session() as session:
+        assert braid_db.get_uris(parent_id, session) == [
+            "file:///batch_parent"
+        ]
+        assert "batch_tag" in braid_db.get_tags(parent_id, session)
+        derivs = braid_db.get_derivations(parent_id, session)
+        assert [d.record_id for d in derivs] == [child_id]
+
+
+def test_batch_rollback(braid_db: BraidDB):
+    try:
+        with braid_db.batch(flush_every=100):
+            rec = BraidRecord(braid_db, name="RolledBack")
+            record_id = rec.record_id
+            raise RuntimeError("Abort the batch")
+    except RuntimeError:
+        pass
+    assert BraidRecord.by_record_id(braid_db, record_id) is None
+
+
+def test_id_allocator(braid_db: BraidDB):
+    existing = BraidRecord(braid_db, name="Existing")
+
+    alloc_db = BraidDB(braid_db.db_url, id_block_size=5)
+    other_db = BraidDB(braid_db.db_url, id_block_size=5)
+    with alloc_db.batch():
+        rec1 = BraidRecord(alloc_db, name="Allocated1")
+        # The id is known before anything is written to the DB
+        assert rec1.model.record_id is not None
+        assert rec1.model.record_id > existing.record_id
+        rec2 = BraidRecord(alloc_db, name="Allocated2")
+        assert rec2.record_id == rec1.record_id + 1
+        rec1.add_derivation(rec2)
+
+    # Bulk adds without an allocator skip the ids left in alloc_db's block,
+    # which are reserved but not yet written
+    plain_ids = braid_db.add_records_bulk([{"name": "Plain"}] * 3)
+    assert min(plain_ids) >= rec1.record_id + 5
+
+    other_ids = other_db.add_records_bulk([{"name": "Other"}] * 7)
+    assert len(set(other_ids) & {rec1.record_id, rec2.record_id}) == 0
+    assert min(other_ids) >= rec1.record_id + 5
+
+    rec3 = BraidRecord(alloc_db, name="Allocated3")
+    assert rec3.record_id == rec2.record_id + 1
+    assert BraidRecord.by_record_id(braid_db, rec3.record_id) is not None
+
+
+def test_sqlite_profile(tmp_path):
+    db = BraidDB(str(tmp_path / "profile.db"), sqlite_profile="performance")
+    db.create()
+    with db.engine.connect() as conn:
+        journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+    assert journal_mode == "wal"
+    # 1 is NORMAL
+    assert synchronous == 1
+
+    with pytest.raises(ValueError):
+        BraidDB(str(tmp_path / "bad.db"), sqlite_profile="no_such_profile")
+
+
+def test_derivation_lookups_single_query(braid_db: BraidDB):
+    parent_id, *child_ids = braid_db.add_records_bulk(
+        [{"name": "Parent"}]
+        + [{"name": f"Child{i}", "batch_predecessors": [0]} for i in range(5)]
+    )
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(braid_db.engine, "before_cursor_execute", count_statements)
+    try:
+        with braid_db.get_session() as session:
+            derivs = braid_db.get_derivations(parent_id, session)
+            assert len(statements) == 1
+            preds = braid_db.get_predecessors(child_ids[0], session)
+            assert len(statements) == 2
+    finally:
+        event.remove(
+            braid_db.engine, "before_cursor_execute", count_statements
+        )
+
+    assert sorted(d.record_id for d in derivs) == child_ids
+    assert [p.record_id for p in preds] == [parent_id]
+
+
+def test_ancestors_and_descendants(braid_db: BraidDB):
+    # a -> b -> c -> d and a -> c
+    a, b, c, d = braid_db.add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [0, 1]},
+            {"name": "d", "batch_predecessors": [2]},
+        ]
+    )
+    assert braid_db.get_ancestors(d) == [(c, 1), (a, 2), (b, 2)]
+    assert braid_db.get_ancestors(d, max_depth=1) == [(c, 1)]
+    assert braid_db.get_ancestors(a) == []
+    assert braid_db.get_descendants(a) == [(b, 1), (c, 1), (d, 2)]
+    assert braid_db.get_descendants(b, max_depth=2) == [(c, 1), (d, 2)]
+    assert braid_db.get_descendants(a, max_depth=0) == []
+
+
+def test_lineage_with_cycle(braid_db: BraidDB):
+    a, b = braid_db.add_records_bulk(
+        [
+            {"name": "a", "batch_predecessors": [1]},
+            {"name": "b", "batch_predecessors": [0]},
+        ]
+    )
+    assert braid_db.get_descendants(a) == [(b, 1)]
+    assert braid_db.get_ancestors(a, max_depth=5) == [(b, 1), (a, 2)]
+
+
+def test_action_step_reuses_record_cache(tmp_path, monkeypatch):
+    from braid_db.globus_compute import add_record_for_action_step
+    from braid_db.globus_compute.entry_points import get_worker_db
+
+    db_file = str(tmp_path / "worker.db")
+    monkeypatch.setenv("BRAID_DB_FILE", db_file)
+    monkeypatch.setenv("BRAID_LOG_FILE", str(tmp_path / "worker.log"))
+    monkeypatch.setenv("BRAID_RECORD_CACHE_SIZE", "100")
+    monkeypatch.setenv("BRAID_RECORD_CACHE_TTL", "60")
+    db = get_worker_db(db_file, "performance", 100, 60.0)
+    source = BraidRecord(db, "source").record_id
+
+    for step in ("first", "second"):
+        result = add_record_for_action_step(
+            step_name=step, other_predecessor_record_ids=[source]
+        )
+        assert db.get_predecessors(result["flow_state_record_id"])
+    # The second step found the source in the cache kept by the first
+    assert db.record_cache.stats()["hits"] >= 1
+
+
+def test_lineage_closure(tmp_path):
+    db = BraidDB(str(tmp_path / "closure.db"), lineage_closure=True)
+    db.create()
+    # a -> b -> c -> d and a -> c from the bulk path, then d -> e and the
+    # cycle e -> b through add_derivation
+    a, b, c, d = db.add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [0, 1]},
+            {"name": "d", "batch_predecessors": [2]},
+        ]
+    )
+    with db.get_session() as session:
+        rec_d = BraidRecord.by_record_id(db, d, session=session)
+        rec_e = BraidRecord(db, "e")
+        rec_d.add_derivation(rec_e, session=session)
+        rec_b = BraidRecord.by_record_id(db, b, session=session)
+        rec_e.add_derivation(rec_b, session=session)
+        session.commit()
+    e = rec_e.record_id
+
+    def lineages(db):
+        return [
+            (
+                db.get_ancestors(r),
+                db.get_descendants(r),
+                db.get_ancestors(r, max_depth=2),
+                db.get_descendants(r, max_depth=5),
+            )
+            for r in (a, b, c, d, e)
+        ]
+
+    assert db.get_descendants(a) == [(b, 1), (c, 1), (d, 2), (e, 3)]
+    assert db.get_ancestors(b, max_depth=5) == [
+        (a, 1),
+        (e, 1),
+        (d, 2),
+        (c, 3),
+        (b, 4),
+    ]
+    expected = lineages(BraidDB(db.db_url))
+    assert lineages(db) == expected
+
+    # A rebuild reproduces the incrementally maintained table
+    with db.get_session() as session:
+        rows = session.execute(text("SELECT * FROM lineage_closure")).all()
+    assert db.rebuild_lineage_closure() == len(rows)
+    with db.get_session() as session:
+        rebuilt = session.execute(text("SELECT * FROM lineage_closure")).all()
+    assert sorted(rebuilt) == sorted(rows)
+    assert lineages(db) == expected
+
+    # Derivations added in a batch reach the closure when the batch is
+    # written, without a flush for each of them
+    flushes = []
+    with db.batch(flush_every=100) as session:
+        event.listen(session, "after_flush", lambda *args: flushes.append(1))
+        f = BraidRecord(db, "f")
+        g = BraidRecord(db, "g")
+        # Flushes the new records to give them ids
+        assert f.record_id < g.record_id
+        flushes.clear()
+        f.add_derivation(g)
+        rec_e.add_derivation(f)
+    assert len(flushes) == 1
+    assert db.get_descendants(e, max_depth=2) == [
+        (b, 1),
+        (f.record_id, 1),
+        (c, 2),
+        (g.record_id, 2),
+    ]
+
+
+def test_graph_snapshot(braid_db: BraidDB):
+    np = pytest.importorskip("numpy")
+    # a -> b -> c -> d and a -> c, the cycle e <-> f and the lone record g
+    a, b, c, d, e, f, g = braid_db.add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [0, 1]},
+            {"name": "d", "batch_predecessors": [2]},
+            {"name": "e", "batch_predecessors": [5]},
+            {"name": "f", "batch_predecessors": [4]},
+            {"name": "g"},
+        ]
+    )
+    graph = braid_db.graph_snapshot(chunk_size=2)
+    assert graph.node_count == 7
+    assert graph.edge_count == 6
+    assert graph.descendants(a) == dict(braid_db.get_descendants(a))
+    assert graph.ancestors(d) == dict(braid_db.get_ancestors(d))
+    assert graph.ancestors(d, max_depth=1) == {c: 1}
+    assert graph.descendants(e) == {f: 1}
+    ids, depths = graph.bfs([b, e])
+    assert ids.tolist() == [b, e, c, f, d]
+    assert depths.tolist() == [0, 0, 1, 1, 2]
+    assert graph.reachable(a, d)
+    assert not graph.reachable(d, a)
+    assert graph.reachable(e, e)
+    assert graph.out_degrees().tolist() == [2, 1, 1, 0, 1, 1, 0]
+    assert graph.degree_stats()["in"]["max"] == 2
+    labels = graph.record_ids[graph.connected_components()]
+    assert labels.tolist() == [a, a, a, a, e, e, g]
+    assert graph.component_count() == 3
+    with pytest.raises(ValueError):
+        graph.bfs(-1)
+    assert isinstance(graph.fwd_indices, np.ndarray)
+
+
+def test_to_arrow(braid_db: BraidDB):
+    pytest.importorskip("pyarrow")
+    a, b, c = braid_db.add_records_bulk(
+        [
+            {"name": "a", "uris": ["file:///d/a"], "tags": {"n": 1}},
+            {"name": "b", "batch_predecessors": [0], "tags": {"n": 2.5}},
+            {"name": "c", "batch_predecessors": [1]},
+        ]
+    )
+    with braid_db.get_session() as session:
+        record = BraidRecord.by_record_id(braid_db, b, session=session)
+        record.invalidate("bad input", session=session)
+        session.commit()
+
+    tables = braid_db.to_arrow(chunk_size=2)
+    assert tables["records"].column("name").to_pylist() == ["a", "b", "c"]
+    invalidation_ids = tables["records"].column("invalidation_id")
+    assert invalidation_ids.null_count == 1
+    assert tables["derivations"].to_pydict() == {
+        "record_id": [a, b],
+        "derivation": [b, c],
+        "time": tables["derivations"].column("time").to_pylist(),
+    }
+    assert tables["uris"].column("uri").to_pylist() == ["file:///d/a"]
+    assert tables["tags"].column("key").to_pylist() == ["n", "n"]
+    assert tables["tags"].column("value_real").to_pylist() == [None, 2.5]
+    assert tables["invalidations"].num_rows == 2
+    assert set(tables["invalidations"].column("id").to_pylist()) == set(
+        invalidation_ids.to_pylist()[1:]
+    )
+
+    batches = list(braid_db.arrow_batches("records", chunk_size=2))
+    assert [batch.num_rows for batch in batches] == [2, 1]
+    with pytest.raises(ValueError):
+        braid_db.to_arrow(["lineage_closure"])
+
+
+def test_jsonl_export_import(braid_db: BraidDB, tmp_path):
+    # a is derived from c, which comes after it
+    a, b, c = braid_db.add_records_bulk(
+        [
+            {"name": "a", "batch_predecessors": [2], "uris": ["file:///a"]},
+            {"name": "b", "batch_predecessors": [0], "tags": {"n": 1.5}},
+            {"name": "c", "tags": {"label": "x", "epoch": 3}},
+        ]
+    )
+    with braid_db.get_session() as session:
+        record = BraidRecord.by_record_id(braid_db, b, session=session)
+        record.invalidate("bad input", session=session)
+        session.commit()
+
+    output = io.StringIO()
+    assert write_jsonl(export_entries(braid_db, chunk_size=2), output) == 4
+    entries = list(read_jsonl(io.StringIO(output.getvalue())))
+    assert [e["type"] for e in entries] == ["invalidation"] + ["record"] * 3
+
+    other = BraidDB(str(tmp_path / "other.db"))
+    other.create()
+    existing = BraidRecord(other, "existing").record_id
+    counts = import_entries(other, entries, chunk_size=2)
+    assert counts == {
+        "invalidations": 1,
+        "records": 3,
+        "missing_derivations": 0,
+    }
+    names = {r.name: r.record_id for r in other.iter_records()}
+    assert existing not in (names["a"], names["b"], names["c"])
+    assert other.get_ancestors(names["b"]) == [
+        (names["a"], 1),
+        (names["c"], 2),
+    ]
+    assert other.get_uris(names["a"]) == ["file:///a"]
+    assert other.get_tags(names["c"])["epoch"].value == 3
+    assert other.get_tags(names["b"])["n"].type_ is BraidTagType.FLOAT
+    assert other.get_record_model_by_id(names["b"]).invalidation_id is not None
+    # Importing again duplicates the records but not the invalidation
+    assert import_entries(other, entries)["invalidations"] == 0
+
+
+def test_is_derived_from(tmp_path):
+    db_file = str(tmp_path / "reach.db")
+    dbs = [
+        BraidDB(db_file, reachability_index=True),
+        BraidDB(db_file, lineage_closure=True),
+        BraidDB(db_file),
+    ]
+    dbs[0].create()
+    # a -> b -> c, a -> d and the cycle e <-> f
+    a, b, c, d, e, f = dbs[1].add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [1]},
+            {"name": "d", "batch_predecessors": [0]},
+            {"name": "e", "batch_predecessors": [5]},
+            {"name": "f", "batch_predecessors": [4]},
+        ]
+    )
+    for db in dbs:
+        assert db.is_derived_from(c, a)
+        assert db.is_derived_from(c, b)
+        assert not db.is_derived_from(a, c)
+        assert not db.is_derived_from(c, d)
+        assert not db.is_derived_from(a, a)
+        assert db.is_derived_from(e, e)
+        assert db.is_derived_from(e, f)
+
+    # Derivations committed through the indexed BraidDB update the index;
+    # rolled back ones do not
+    reach_db = dbs[0]
+    (g,) = reach_db.add_records_bulk([{"name": "g", "predecessors": [c]}])
+    with reach_db.get_session() as session:
+        rec_e = BraidRecord.by_record_id(reach_db, e, session=session)
+        rec_e.add_derivation(
+            BraidRecord.by_record_id(reach_db, a, session=session),
+            session=session,
+        )
+        session.rollback()
+    with reach_db.get_session() as session:
+        rec_g = BraidRecord.by_record_id(reach_db, g, session=session)
+        rec_d = BraidRecord.by_record_id(reach_db, d, session=session)
+        rec_g.add_derivation(rec_d, session=session)
+        session.commit()
+    assert reach_db.is_derived_from(g, a)
+    assert reach_db.is_derived_from(d, g)
+    assert not reach_db.is_derived_from(g, d)
+    assert not reach_db.is_derived_from(a, e)
+    # Derivations added elsewhere are only seen after a refresh
+    (h,) = dbs[2].add_records_bulk([{"name": "h", "predecessors": [f]}])
+    assert not reach_db.is_derived_from(h, e)
+    reach_db.refresh_reachability_index()
+    assert reach_db.is_derived_from(h, e)
+    assert dbs[2].is_derived_from(h, e)
+
+
+def test_reachability_index_incremental():
+    rng = random.Random(4)
+    nodes = list(range(60))
+    edges = [tuple(rng.sample(nodes, 2)) for _ in range(90)]
+    # Build from part of the graph, then add the rest, including derivations
+    # of records not yet in the index
+    initial = [(u, v) for u, v in edges[:40] if u < 40 and v < 40]
+    rest = [edge for edge in edges if edge not in initial]
+
+    def reachable(src, edge_list):
+        seen, pending = {src}, [src]
+        while pending:
+            node = pending.pop()
+            for u, v in edge_list:
+                if u == node and v not in seen:
+                    seen.add(v)
+                    pending.append(v)
+        return seen
+
+    built = BraidReachabilityIndex()
+    built.build(nodes[:40], initial)
+    for u, v in rest:
+        built.add_derivation(u, v)
+    incremental = BraidReachabilityIndex()
+    for u, v in edges:
+        incremental.add_derivation(u, v)
+    for u in nodes:
+        expected = reachable(u, edges)
+        for v in nodes:
+            assert built.reaches(u, v) == (v in expected)
+            assert incremental.reaches(u, v) == (v in expected)
+
+
+def test_lineage_path_and_common_ancestors(braid_db: BraidDB):
+    # a -> b -> c -> d -> e, a -> x -> e, data -> m1, data -> c, and
+    # models m1 <- b and m2 <- d
+    a, b, c, d, e, x, data, m1, m2 = braid_db.add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [1, 6]},
+            {"name": "d", "batch_predecessors": [2]},
+            {"name": "e", "batch_predecessors": [3, 5]},
+            {"name": "x", "batch_predecessors": [0]},
+            {"name": "data"},
+            {"name": "m1", "batch_predecessors": [1, 6]},
+            {"name": "m2", "batch_predecessors": [3]},
+        ]
+    )
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(braid_db.engine, "before_cursor_execute", count)
+    # One query per step along the path
+    assert braid_db.lineage_path(a, e) == [a, x, e]
+    assert len(statements) == 2
+    assert braid_db.lineage_path(b, e) == [b, c, d, e]
+    assert len(statements) == 5
+    event.remove(braid_db.engine, "before_cursor_execute", count)
+    assert braid_db.lineage_path(e, a) is None
+    assert braid_db.lineage_path(b, e, max_depth=2) is None
+    assert braid_db.lineage_path(b, e, max_depth=3) == [b, c, d, e]
+    assert braid_db.lineage_path(c, c) == [c]
+
+    assert braid_db.common_ancestors(m1, m2) == [a, b, data]
+    assert braid_db.common_ancestors(m1, m2, lowest=True) == [b, data]
+    assert braid_db.common_ancestors(c, e, lowest=True) == [c]
+    assert braid_db.common_ancestors(x, data) == []
+
+
+def test_search(braid_db: BraidDB):
+    (old,) = braid_db.add_records_bulk(
+        [{"name": "scan_0042", "uris": ["file:///data/run7/raw_0042.h5"]}]
+    )
+    assert braid_db.create_search_index()
+    assert not braid_db.create_search_index()
+    a, b = braid_db.add_records_bulk(
+        [
+            {"name": "model", "tags": {"sample": "lysozyme_0042"}},
+            {"name": "Lysozyme refinement"},
+        ]
+    )
+    rec = BraidRecord(braid_db, "plot")
+    rec.add_uri("globus://ep/run7/plots/RAW_summary.png")
+
+    assert {r for r, _ in braid_db.search("0042")} == {old, a}
+    assert {r for r, _ in braid_db.search("lysozyme")} == {a, b}
+    assert {r for r, _ in braid_db.search("run7/")} == {old, rec.record_id}
+    assert [r for r, _ in braid_db.search("sample lyso")] == [a]
+    assert braid_db.search("lysozyme", limit=1)[0][0] in (a, b)
+    assert braid_db.search('"quoted"') == []
+    with pytest.raises(ValueError):
+        braid_db.search("ab")
+
+    # Changes to indexed rows are tracked
+    with braid_db.engine.begin() as conn:
+        conn.execute(
+            text("UPDATE records SET name = 'renamed' WHERE record_id = :id"),
+            {"id": b},
+        )
+    assert [r for r, _ in braid_db.search("lysozyme")] == [a]
+    assert [r for r, _ in braid_db.search("renamed")] == [b]
+
+    # Updates to columns which are not indexed, such as an invalidation,
+    # do not rewrite the index
+    with braid_db.engine.begin() as conn:
+        before = conn.execute(text("SELECT total_changes()")).scalar_one()
+        for stmt in (
+            "UPDATE records SET invalidation_action_id = NULL",
+            "UPDATE tags SET value_real = value_real",
+        ):
+            conn.execute(text(stmt))
+        changes = conn.execute(text("SELECT total_changes()")).scalar_one()
+    # One change for each of the 4 records and the 1 tag, and none by triggers
+    assert changes - before == 4 + 1
+    assert [r for r, _ in braid_db.search("lysozyme")] == [a]
+
+
+def test_records_for_uri(braid_db: BraidDB):
+    a, b, c = braid_db.add_records_bulk(
+        [
+            {"name": "a", "uris": ["globus://ep/run1/x.h5", "file:///x"]},
+            {"name": "b", "uris": ["globus://ep/run1/sub/y.h5"]},
+            {"name": "c", "uris": ["globus://ep/run10/z.h5", "file:///x"]},
+        ]
+    )
+    assert braid_db.records_for_uri("file:///x") == [a, c]
+    assert braid_db.records_for_uri("globus://ep/run1/") == []
+    assert braid_db.records_for_uri_prefix("globus://ep/run1/") == {
+        a: ["globus://ep/run1/x.h5"],
+        b: ["globus://ep/run1/sub/y.h5"],
+    }
+    # Records are ordered by their first matching URI
+    assert list(braid_db.records_for_uri_prefix("globus://ep/run1")) == [
+        b,
+        a,
+        c,
+    ]
+    assert braid_db.records_for_uri_prefix("globus://ep/run2") == {}
+    assert set(braid_db.records_for_uri_prefix("")) == {a, b, c}
+
+    # Each prefix is stored once
+    with braid_db.engine.connect() as conn:
+        prefixes = conn.execute(text("SELECT prefix FROM uri_prefixes")).all()
+    assert sorted(p for p, in prefixes) == [
+        "file:///",
+        "globus://ep/run1/",
+        "globus://ep/run1/sub/",
+        "globus://ep/run10/",
+    ]
+
+
+def test_create_indexes(braid_db: BraidDB):
+    assert braid_db.create_indexes() == []
+    with braid_db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_derivations_derivation")
+        conn.exec_driver_sql("DROP INDEX ix_tags_key_value")
+    assert sorted(braid_db.upgrade()) == [
+        "ix_derivations_derivation",
+        "ix_tags_key_value",
+    ]
+    assert braid_db.create_indexes() == []
+
+
+def test_typed_tags(braid_db: BraidDB):
+    records = []
+    tagged = []
+    for i, loss in enumerate([0.005, 0.02, 0.05, 0.2]):
+        record = BraidRecord(braid_db, f"run{i}")
+        record.add_tag("loss", loss, BraidTagType.FLOAT)
+        record.add_tag("epoch", i, BraidTagType.INTEGER)
+        record.add_tag("label", f"l{i}")
+        records.append(record.record_id)
+        tagged.append(record)
+    braid_db.add_records_bulk(
+        [{"name": "bulk", "tags": {"loss": 0.07, "epoch": 10, "label": "b"}}]
+    )
+
+    ids = braid_db.get_record_ids_by_tag("loss", gt=0.01, lt=0.1)
+    assert len(ids) == 3 and records[1] in ids and records[2] in ids
+    assert braid_db.get_record_ids_by_tag("epoch", 2) == [records[2]]
+    assert len(braid_db.get_record_ids_by_tag("epoch", ge=2)) == 3
+    assert sorted(
+        braid_db.get_record_ids_by_tag("label", in_=["l0", "l3"])
+    ) == [records[0], records[3]]
+    assert [
+        r.record_id for r in BraidRecord.for_tag(braid_db, "epoch", le=1)
+    ] == records[:2]
+    with pytest.raises(ValueError):
+        braid_db.get_record_ids_by_tag("loss", gt=0.01, lt="x")
+    with pytest.raises(ValueError):
+        braid_db.get_record_ids_by_tag("loss")
+
+    flagged = braid_db.add_records_bulk([{"name": "f", "tags": {"ok": True}}])
+    ok = braid_db.get_tags(flagged[0])["ok"]
+    assert ok.type_ is BraidTagType.STRING and ok.value == "True"
+    assert braid_db.get_record_ids_by_tag("ok", ge=0) == []
+
+    tags = tagged[1].tags_as_dict()
+    assert tags == {"loss": 0.02, "epoch": 1, "label": "l1"}
+    assert braid_db.get_tags(records[3])["epoch"].value == 3
+
+    # The type is inferred when not given, and values which do not convert
+    # exactly to the given type are stored but not compared numerically
+    odd = BraidRecord(braid_db, "odd")
+    odd.add_tag("epoch", 7)
+    odd.add_tag("size", "large", BraidTagType.INTEGER)
+    odd.add_tag("step", 2.5, BraidTagType.INTEGER)
+    odd.add_tag("rate", "fast", BraidTagType.FLOAT)
+    # The bulk record's epoch is 10
+    late = braid_db.get_record_ids_by_tag("epoch", gt=5)
+    assert len(late) == 2 and odd.record_id in late
+    assert braid_db.get_record_ids_by_tag("step", ge=0) == []
+    assert braid_db.get_record_ids_by_tag("rate", ge=0) == []
+    assert odd.tags_as_dict() == {
+        "epoch": 7,
+        "size": "large",
+        "step": "2.5",
+        "rate": "fast",
+    }
+
+
+# The schema of a DB created by the first release of BraidDB
+_BASELINE_SCHEMA = [
+    "CREATE TABLE invalidations (id CHAR(32) NOT NULL, "
+    "root_invalidation CHAR(32), cause VARCHAR NOT NULL, "
+    "time DATETIME NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(root_invalidation) REFERENCES invalidations (id))",
+    "CREATE TABLE invalidation_actions (action_type VARCHAR(14), "
+    "params JSON, id CHAR(32) NOT NULL, name VARCHAR NOT NULL, "
+    "cmd VARCHAR NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE records (record_id INTEGER NOT NULL, "
+    "name VARCHAR NOT NULL, time DATETIME NOT NULL, "
+    "invalidation_id CHAR(32), invalidation_action_id CHAR(32), "
+    "PRIMARY KEY (record_id), "
+    "FOREIGN KEY(invalidation_id) REFERENCES invalidations (id), "
+    "FOREIGN KEY(invalidation_action_id) "
+    "REFERENCES invalidation_actions (id))",
+    "CREATE TABLE derivations (record_id INTEGER NOT NULL, "
+    "derivation INTEGER NOT NULL, time DATETIME NOT NULL, "
+    "PRIMARY KEY (record_id, derivation), "
+    "FOREIGN KEY(record_id) REFERENCES records (record_id), "
+    "FOREIGN KEY(derivation) REFERENCES records (record_id))",
+    "CREATE TABLE uris (id INTEGER NOT NULL, record_id INTEGER NOT NULL, "
+    "uri VARCHAR NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(record_id) REFERENCES records (record_id))",
+    "CREATE INDEX ix_uris_record_id ON uris (record_id)",
+    "CREATE TABLE tags (id INTEGER NOT NULL, record_id INTEGER NOT NULL, "
+    '"key" VARCHAR NOT NULL, value VARCHAR NOT NULL, '
+    "tag_type INTEGER NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(record_id) REFERENCES records (record_id))",
+    "INSERT INTO records VALUES "
+    "(1, 'old', '2023-01-01 00:00:00.000000', NULL, NULL)",
+    "INSERT INTO tags VALUES (1, 1, 'epoch', '3', 2), "
+    "(2, 1, 'size', 'large', 2)",
+    "INSERT INTO uris VALUES (1, 1, 'file:///data/old.h5')",
+]
+
+
+def _create_baseline_db(path) -> str:
+    """Write a DB with the baseline schema and one tagged record with a URI,
+    returning its path.
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        for stmt in _BASELINE_SCHEMA:
+            conn.exec_driver_sql(stmt)
+    engine.dispose()
+    return str(path)
+
+
+def test_create_upgrades_baseline_db(tmp_path):
+    db = BraidDB(_create_baseline_db(tmp_path / "baseline.db"))
+    assert "tags.value_int" in db.missing_columns()
+    db.create()
+    assert db.missing_columns() == []
+    record = BraidRecord(db, "new")
+    record.add_tag("epoch", 5)
+    # The tags added before the upgrade are compared as the new ones
+    assert db.get_record_ids_by_tag("epoch", ge=3) == [1, record.record_id]
+    assert db.get_record_ids_by_tag("size", ge=0) == []
+    assert db.get_tags(1)["size"].value == "large"
+
+
+def test_worker_db_upgrades_baseline_db(tmp_path):
+    from braid_db.globus_compute.entry_points import get_worker_db
+
+    db_file = _create_baseline_db(tmp_path / "baseline.db")
+    db = get_worker_db(db_file, "performance")
+    record = BraidRecord(db, "new")
+    record.add_uri("file:///data/new.h5")
+    record.add_tag("label", "x")
+    # The tags and URIs from before the upgrade are kept and interned with
+    # the new ones
+    assert db.records_for_uri_prefix("file:///data/") == {
+        1: ["file:///data/old.h5"],
+        record.record_id: ["file:///data/new.h5"],
+    }
+    assert sorted(db.get_tags(1)) == ["epoch", "size"]
+    with db.get_session() as session:
+        prefixes = session.execute(text("SELECT prefix FROM uri_prefixes"))
+        assert [prefix for prefix, in prefixes] == ["file:///data/"]
+
+
+def test_upgrade_typed_tag_columns(tmp_path):
+    db = BraidDB(str(tmp_path / "old.db"))
+    db.create()
+    record = BraidRecord(db, "old")
+    record.add_tag("epoch", 3, BraidTagType.INTEGER)
+    record.add_tag("loss", 0.5, BraidTagType.FLOAT)
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_tags_key_value_int")
+        conn.exec_driver_sql("DROP INDEX ix_tags_key_value_real")
+        conn.exec_driver_sql("ALTER TABLE tags DROP COLUMN value_int")
+        conn.exec_driver_sql("ALTER TABLE tags DROP COLUMN value_real")
+    assert sorted(db.upgrade()) == [
+        "ix_tags_key_value_int",
+        "ix_tags_key_value_real",
+        "tags.value_int",
+        "tags.value_real",
+    ]
+    assert db.get_record_ids_by_tag("epoch", gt=2) == [record.record_id]
+    assert db.get_record_ids_by_tag("loss", le=0.5) == [record.record_id]
+    assert db.upgrade() == []
+
+
+def test_upgrade_interned_columns(tmp_path):
+    db = BraidDB(str(tmp_path / "old.db"))
+    db.create()
+    db.create_search_index()
+    record_id = BraidRecord(db, "old").record_id
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE tags")
+        conn.exec_driver_sql("DROP TABLE uris")
+        conn.exec_driver_sql(
+            "CREATE TABLE tags (id INTEGER PRIMARY KEY, record_id INTEGER, "
+            "key VARCHAR, value VARCHAR, tag_type INTEGER)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE uris (id INTEGER PRIMARY KEY, record_id INTEGER, "
+            "uri VARCHAR)"
+        )
+        conn.exec_driver_sql("CREATE INDEX ix_uris_uri ON uris (uri)")
+        conn.exec_driver_sql(
+            "INSERT INTO tags VALUES (5, ?, 'epoch', '3', 2), "
+            "(6, ?, 'label', 'x', 1)",
+            (record_id, record_id),
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO uris VALUES (7, ?, 'file:///data/a.h5'), "
+            "(8, ?, 'nohost')",
+            (record_id, record_id),
+        )
+    assert "tags.key_id" in db.upgrade()
+    uris = db.get_uris(record_id)
+    assert sorted(uris) == ["file:///data/a.h5", "nohost"]
+    assert db.get_tags(record_id)["epoch"].value == 3
+    assert db.get_record_ids_by_tag("epoch", gt=2) == [record_id]
+    assert db.records_for_uri_prefix("file:///data/") == {
+        record_id: ["file:///data/a.h5"]
+    }
+    assert [r for r, _ in db.search("a.h5")] == [record_id]
+    assert db.upgrade() == []
+
+
+def test_interning_sessions(tmp_path):
+    db = BraidDB(str(tmp_path / "interned.db"))
+    db.create()
+    record_id = BraidRecord(db, "a").record_id
+
+    def tag(value):
+        return BraidTagsModel(
+            record_id=record_id, key="k", value=value, tag_type=1
+        )
+
+    def key_ids():
+        with db.get_session() as session:
+            rows = session.execute(text("SELECT id FROM tag_keys")).all()
+        return [id_ for id_, in rows]
+
+    with db.get_session() as session:
+        session.add(tag("1"))
+        session.add(tag("2"))
+        session.commit()
+    (key_id,) = key_ids()
+
+    # Sessions created without the BraidDB intern their entries too, using
+    # the ids the BraidDB already knows
+    with Session(db.engine) as session:
+        model = tag("3")
+        session.add(model)
+        session.commit()
+        assert model.key_id == key_id
+    with Session(db.engine) as session:
+        model = db.add_model(tag("4"), session=session)
+        session.commit()
+        assert model.key_id == key_id
+    assert key_ids() == [key_id]
+    # The ids known are kept for each engine
+    other = BraidDB(db.db_url)
+    assert interner_for(db.engine) is not interner_for(other.engine)
+
+
+def test_query(braid_db: BraidDB):
+    ids = braid_db.add_records_bulk(
+        [
+            {"name": f"train-{i}", "tags": {"lr": lr, "batch": batch}}
+            for i, (lr, batch) in enumerate(
+                [(0.001, 32), (0.02, 32), (0.05, 64), (0.05, 128), (0.5, 64)]
+            )
+        ]
+        + [{"name": "eval", "tags": {"lr": 0.05, "batch": 64}}]
+    )
+    BraidRecord(braid_db, "other").add_tag("batch", "32")
+
+    def query(**kwargs):
+        return sorted(
+            r.record_id for r in BraidRecord.query(braid_db, **kwargs)
+        )
+
+    assert query(where={"lr": {">": 0.01, "<": 0.1}, "batch": [32, 64]}) == [
+        ids[1],
+        ids[2],
+        ids[5],
+    ]
+    assert query(where={"lr": 0.05}, name="train-%") == ids[2:4]
+    assert query(where={"batch": 64}, name="eval") == [ids[5]]
+    assert len(query(where={"batch": 32})) == 3
+    assert query(name="train-1") == [ids[1]]
+    assert len(query(where={"lr": {">=": 0.0}}, limit=2, batch_size=1)) == 2
+
+    with braid_db.get_session() as session:
+        record = BraidRecord.by_record_id(braid_db, ids[2], session=session)
+        record.invalidate("bad lr", session=session)
+        session.commit()
+    assert query(where={"lr": 0.05}, valid=True) == [ids[3], ids[5]]
+    assert query(where={"lr": 0.05}, valid=False) == [ids[2]]
+
+    with pytest.raises(ValueError):
+        BraidRecord.query(braid_db, where={"lr": {"~": 1}})
+
+
+def test_cascade_invalidation(braid_db: BraidDB):
+    # a -> b -> c -> d and a -> e, plus a chain deeper than the recursion
+    # limit below e
+    depth = 2000
+    a, b, c, d, e, *chain = braid_db.add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [1]},
+            {"name": "d", "batch_predecessors": [2]},
+            {"name": "e", "batch_predecessors": [0]},
+        ]
+        + [
+            {"name": f"chain{i}", "batch_predecessors": [4 + i]}
+            for i in range(depth)
+        ]
+    )
+    with braid_db.get_session() as session:
+        BraidRecord.by_record_id(braid_db, c, session=session).invalidate(
+            "c is bad", session=session
+        )
+        session.commit()
+
+    with braid_db.get_session() as session:
+        root = BraidRecord.by_record_id(braid_db, a, session=session)
+        root.invalidate("a is bad", session=session)
+        session.commit()
+        assert not root.is_valid()
+        root_invalidation = root.model.invalidation_id
+
+        def invalidation(record_id):
+            return BraidRecord.by_record_id(
+                braid_db, record_id, session=session
+            ).model.invalidation
+
+        # Each descendant has its own invalidation, whose root is the
+        # invalidation of the record it was derived from
+        assert invalidation(b).root_invalidation == root_invalidation
+        assert invalidation(b).cause == "a is bad"
+        assert invalidation(e).root_invalidation == root_invalidation
+        assert invalidation(b).id != invalidation(e).id
+        assert invalidation(chain[0]).root_invalidation == invalidation(e).id
+        assert (
+            invalidation(chain[-1]).root_invalidation
+            == invalidation(chain[-2]).id
+        )
+        # Already invalid records are left alone and not cascaded through
+        assert invalidation(c).cause == "c is bad"
+        assert invalidation(d).cause == "c is bad"
+    assert braid_db.invalidate_descendants(a, "again") == []
+
+    # Without a session, the record and its descendants are invalidated and
+    # committed together
+    x, y, z = braid_db.add_records_bulk(
+        [
+            {"name": "x"},
+            {"name": "y", "batch_predecessors": [0]},
+            {"name": "z", "batch_predecessors": [1]},
+        ]
+    )
+    BraidRecord.by_record_id(braid_db, x).invalidate("x is bad")
+    with braid_db.get_session() as session:
+        x_invalidation = invalidation(x)
+        assert (
+            x_invalidation is not None and x_invalidation.cause == "x is bad"
+        )
+        assert invalidation(y).root_invalidation == x_invalidation.id
+        assert invalidation(z).root_invalidation == invalidation(y).id
+
+
+def test_invalidation_impact(braid_db: BraidDB):
+    # a -> b -> c -> d, a -> c and b -> e where e is already invalid
+    a, b, c, d, e = braid_db.add_records_bulk(
+        [
+            {"name": "a"},
+            {"name": "b", "batch_predecessors": [0]},
+            {"name": "c", "batch_predecessors": [0, 1]},
+            {"name": "d", "batch_predecessors": [2]},
+            {"name": "e", "batch_predecessors": [1]},
+        ]
+    )
+    with braid_db.get_session() as session:
+        action = BraidRecord.by_record_id(
+            braid_db, c, session=session
+        ).add_invalidation_action(
+            InvalidationActionType.SHELL_COMMAND,
+            "rerun",
+            "true",
+            {},
+            session=session,
+        )
+        session.flush()
+        BraidRecord.by_record_id(
+            braid_db, d, session=session
+        ).set_invalidation_action(action.id, session=session)
+        BraidRecord.by_record_id(braid_db, e, session=session).invalidate(
+            "e is bad", session=session
+        )
+        session.commit()
+
+    with braid_db.get_session() as session:
+        root = BraidRecord.by_record_id(braid_db, a, session=session)
+        impact = root.invalidation_impact(session=session)
+        assert impact.depth_histogram == {0: 1, 1: 2, 2: 1}
+        assert impact.record_count == 4
+        assert impact.actions == [("rerun", "true", 2)]
+        assert root.is_valid()
+
+        impact = root.invalidation_impact(
+            perform_invalidation_action_on_cascade=False, session=session
+        )
+        assert impact.action_count == 0
+        impact = root.invalidation_impact(cascade=False, session=session)
+        assert impact.depth_histogram == {0: 1}
+
+    assert braid_db.invalidation_impact(e).record_count == 0
+    assert braid_db.invalidation_impact(c).depth_histogram == {0: 1, 1: 1}
+
+
+def test_iter_records(braid_db: BraidDB, capsys):
+    ids = braid_db.add_records_bulk(
+        [{"name": f"rec{i}", "uris": [f"file:///rec{i}"]} for i in range(25)]
+    )
+    batches = list(braid_db.iter_record_batches(batch_size=7))
+    assert [len(batch) for batch in batches] == [7, 7, 7, 4]
+    assert [r.record_id for r in braid_db.iter_records(batch_size=7)] == ids
+    assert [
+        r.record_id
+        for r in braid_db.iter_records(batch_size=3, after_id=ids[20])
+    ] == ids[21:]
+
+    with braid_db.get_session() as session:
+        times = [
+            braid_db.get_record_model_by_id(i, session=session).time
+            for i in ids
+        ]
+    records = braid_db.iter_records(since=times[5], until=times[10])
+    assert [r.record_id for r in records] == [
+        i for i, t in zip(ids, times) if times[5] <= t < times[10]
+    ]
+
+    braid_db.print()
+    assert capsys.readouterr().out.count("URI: file:///rec") == 25
+
+
+def test_get_record_models_by_ids(braid_db: BraidDB, monkeypatch):
+    import braid_db.braid_db as braid_db_module
+
+    monkeypatch.setattr(braid_db_module, "IN_LIST_CHUNK_SIZE", 4)
+    ids = braid_db.add_records_bulk(
+        [
+            {
+                "name": f"rec{i}",
+                "uris": [f"file:///rec{i}"],
+                "tags": {"i": i},
+                "batch_predecessors": [0] if i == 1 else [],
+            }
+            for i in range(10)
+        ]
+    )
+    wanted = ids[::-1] + [-1]
+
+    statements = []
+
+    def count_statements(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(braid_db.engine, "before_cursor_execute", count_statements)
+    try:
+        models = braid_db.get_record_models_by_ids(wanted)
+        # At most the records and each of the 4 relationships (fewer when
+        # all of a chunk's references are null), for each of 3 chunks
+        count = len(statements)
+        assert count <= 15
+        assert [m.record_id for m in models] == ids[::-1]
+        assert [m.uris[0].uri for m in models][0] == "file:///rec9"
+        assert models[0].tags[0].value == "9"
+        assert models[0].invalidation is None
+        assert models[0].invalidation_action is None
+        assert len(statements) == count
+    finally:
+        event.remove(
+            braid_db.engine, "before_cursor_execute", count_statements
+        )
+
+    records = BraidRecord.by_record_ids(braid_db, ids[:2])
+    assert [r.get_uris() for r in records] == [
+        ["file:///rec0"],
+        ["file:///rec1"],
+    ]
+    assert braid_db.get_derivation_edges(ids) == [(ids[0], ids[1])]
+    assert braid_db.get_derivation_edges([ids[1]]) == [(ids[0], ids[1])]
+
+
+def test_get_tags_and_uris_bulk(braid_db: BraidDB):
+    ids = braid_db.add_records_bulk(
+        [
+            {"name": "a", "uris": ["file:///a1", "file:///a2"]},
+            {"name": "b", "tags": {"epoch": 3, "loss": 0.5, "site": "x"}},
+            {"name": "c"},
+        ]
+    )
+    uris = braid_db.get_uris_bulk(ids)
+    assert uris == {ids[0]: ["file:///a1", "file:///a2"]}
+    tags = braid_db.get_tags_bulk(ids)
+    assert list(tags.keys()) == [ids[1]]
+    assert {k: v.value for k, v in tags[ids[1]].items()} == {
+        "epoch": 3,
+        "loss": 0.5,
+        "site": "x",
+    }
+    assert tags[ids[1]]["epoch"].type_ is BraidTagType.INTEGER
+    assert braid_db.get_uris(ids[0]) == ["file:///a1", "file:///a2"]
+    assert braid_db.get_tags(ids[2]) == {}
+
+
+def test_record_cache(tmp_path):
+    db = BraidDB(str(tmp_path / "cache.db"), record_cache_size=2)
+    db.create()
+    a, b, c = db.add_records_bulk(
+        [{"name": "a"}, {"name": "b"}, {"name": "c"}]
+    )
+
+    assert db.get_record_model_by_id(a).name == "a"
+    assert db.get_record_model_by_id(a).name == "a"
+    assert db.record_cache.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "size": 1,
+        "max_size": 2,
+    }
+    db.get_record_model_by_id(b)
+    db.get_record_model_by_id(c)
+    # a was the least recently used record so is no longer cached
+    assert len(db.record_cache) == 2
+    db.get_record_model_by_id(a)
+    assert db.record_cache.misses == 4
+
+    with db.get_session() as session:
+        record = BraidRecord.by_record_id(db, a, session=session)
+        assert db.record_cache.hits == 2
+        assert record.model in session
+        # Relationships are loaded through the session
+        assert record.get_uris() == []
+        record.invalidate("bad", session=session)
+        assert db.get_record_model_by_id(a, session=session) is record.model
+        # A lookup in another session before the commit sees the valid record
+        assert db.get_record_model_by_id(a).invalidation_id is None
+        session.commit()
+    assert db.get_record_model_by_id(a).invalidation_id is not None
+
+    with db.get_session() as session:
+        record = BraidRecord.by_record_id(db, b, session=session)
+        record.invalidate("rolled back", session=session)
+        session.flush()
+        db.get_record_model_by_id(c, session=session)
+        session.rollback()
+    assert len(db.record_cache) == 0
+    assert db.get_record_model_by_id(b).invalidation_id is None
+
+
+def test_record_cache_other_db(tmp_path):
+    db_file = str(tmp_path / "cache.db")
+    db = BraidDB(db_file, record_cache_size=10, record_cache_ttl=0.05)
+    db.create()
+    a, b = db.add_records_bulk([{"name": "a"}, {"name": "b"}])
+    assert db.get_record_model_by_id(a).invalidation_id is None
+
+    # Adding tags and derivations evicts the records they are added to
+    record = BraidRecord.by_record_id(db, a)
+    record.add_tag("k", "v")
+    assert len(db.record_cache) == 0
+    db.get_record_model_by_id(a)
+    db.get_record_model_by_id(b)
+    record.add_derivation(BraidRecord.by_record_id(db, b))
+    assert len(db.record_cache) == 0
+
+    # A record invalidated through another BraidDB is looked up again once
+    # its entry expires
+    db.get_record_model_by_id(a)
+    other = BraidDB(db_file)
+    BraidRecord.by_record_id(other, a).invalidate("elsewhere")
+    time.sleep(0.1)
+    assert db.get_record_model_by_id(a).invalidation_id is not None
+    with pytest.raises(ValueError):
+        BraidRecordCache(10, ttl=0)
@@ -74,3 +74,39 @@ def test_create_models(session: Session):
         assert dep_rec is not None
         dep_recs.append(dep_rec)
     assert rec2 in dep_recs
+
+
+def test_filter_on_interned_columns(session: Session):
+    rec = BraidRecordModel(name="filtered_record")
+    session.add(rec)
+    session.add(BraidUrisModel(record=rec, uri="file:///filter/a.h5"))
+    session.add(BraidUrisModel(record=rec, uri="file:///filter/b.h5"))
+    session.add(
+        BraidTagsModel(record=rec, key="filter_key", value="x", tag_type=1)
+    )
+    session.add(
+        BraidTagsModel(record=rec, key="other_key", value="y", tag_type=1)
+    )
+    session.commit()
+
+    # The key and uri are compared in the DB, through the interned tables
+    tags = session.exec(
+        select(BraidTagsModel).where(
+            BraidTagsModel.record_id == rec.record_id,
+            BraidTagsModel.key == "filter_key",
+        )
+    ).all()
+    assert [(tag.key, tag.value) for tag in tags] == [("filter_key", "x")]
+
+    uris = session.exec(
+        select(BraidUrisModel).where(
+            BraidUrisModel.record_id == rec.record_id,
+            BraidUrisModel.uri == "file:///filter/b.h5",
+        )
+    ).all()
+    assert [uri.uri for uri in uris] == ["file:///filter/b.h5"]
+    assert session.exec(
+        select(BraidUrisModel.record_id).where(
+            BraidUrisModel.uri.startswith("file:///filter/")
+        )
+    ).all() == [rec.record_id, rec.record_id]
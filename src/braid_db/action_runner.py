@@ -0,0 +1,216 @@
+# INVALIDATION ACTION RUNNER
+# Runs the invalidation actions of invalidated records on a pool of threads
+
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from .models import InvalidationActionType
+
+
+class PendingInvalidationAction:
+    """An invalidation action of a record with all values from the record
+    already substituted into its command and parameters, so that running it
+    requires no further access to the DB.
+    """
+
+    def __init__(
+        self,
+        record_id: Optional[int],
+        action_id: Optional[UUID],
+        name: str,
+        action_type: InvalidationActionType,
+        cmd: str,
+        params: Dict[str, Any],
+    ):
+        self.record_id = record_id
+        self.action_id = action_id
+        self.name = name
+        self.action_type = action_type
+        self.cmd = cmd
+        self.params = params
+
+    def __str__(self):
+        return (
+            f"InvalidationAction({self.name}) of record {self.record_id}: "
+            f"{self.cmd} {self.params}"
+        )
+
+
+class InvalidationActionResult:
+    """The outcome of running a PendingInvalidationAction."""
+
+    def __init__(
+        self,
+        action: PendingInvalidationAction,
+        returncode: Optional[int] = None,
+        stdout: Optional[str] = None,
+        stderr: Optional[str] = None,
+        timed_out: bool = False,
+        error: Optional[str] = None,
+        duration: float = 0.0,
+    ):
+        self.action = action
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.error = error
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        """Whether the action ran to completion and succeeded."""
+        return (
+            self.error is None and not self.timed_out and self.returncode == 0
+        )
+
+    def __str__(self):
+        if self.timed_out:
+            outcome = "timed out"
+        elif self.error is not None:
+            outcome = f"failed: {self.error}"
+        else:
+            outcome = f"returned {self.returncode}"
+        return f"{self.action} {outcome} after {self.duration:.3f}s"
+
+
+class InvalidationActionRunner:
+    """Runs invalidation actions on a bounded pool of worker threads. Actions
+    are submitted once the transaction which invalidated their records has
+    been committed (see BraidDB.dispatch_invalidation_action()), so a slow
+    action never holds a DB lock. The results are kept until collected with
+    results().
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        timeout: Optional[float] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        """Create a runner. No threads are started until the first action is
+        submitted.
+
+        :param max_workers: The most actions which run at the same time.
+
+        :param timeout: If provided, the number of seconds after which a
+            running shell command is killed and its result marked as timed
+            out.
+
+        :param logger: The logger results are reported to.
+        """
+        if max_workers < 1:
+            raise ValueError(
+                f"max_workers must be positive, not {max_workers}"
+            )
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger("BraidDB")
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures: List[Future] = []
+        self._lock = threading.Lock()
+
+    def submit(
+        self, action: PendingInvalidationAction
+    ) -> "Future[InvalidationActionResult]":
+        """Queue an action to be run by the next free worker.
+
+        :param action: The action to run.
+
+        :returns: A Future for the result of the action.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="braid-invalidation-action",
+                )
+            future = self._executor.submit(self.run, action)
+            self._futures.append(future)
+        return future
+
+    def run(
+        self, action: PendingInvalidationAction
+    ) -> InvalidationActionResult:
+        """Run an action in the calling thread.
+
+        :param action: The action to run.
+
+        :returns: The result of running the action.
+        """
+        start = time.monotonic()
+        if action.action_type is InvalidationActionType.SHELL_COMMAND:
+            cmd_line = [action.cmd]
+            cmd_line.extend(str(arg) for arg in action.params.get("args", []))
+            try:
+                action_run = subprocess.run(
+                    cmd_line,
+                    capture_output=True,
+                    text=True,
+                    timeout=self.timeout,
+                )
+                result = InvalidationActionResult(
+                    action,
+                    returncode=action_run.returncode,
+                    stdout=action_run.stdout,
+                    stderr=action_run.stderr,
+                )
+            except subprocess.TimeoutExpired as e:
+                result = InvalidationActionResult(
+                    action,
+                    stdout=e.output,
+                    stderr=e.stderr,
+                    timed_out=True,
+                )
+            except OSError as e:
+                result = InvalidationActionResult(action, error=str(e))
+        else:
+            result = InvalidationActionResult(
+                action,
+                error=f"Action type {action.action_type} is not supported",
+            )
+        result.duration = time.monotonic() - start
+        if result.ok:
+            self.logger.debug(str(result))
+        else:
+            self.logger.warning(str(result))
+        return result
+
+    def results(
+        self, wait_for_all: bool = True
+    ) -> List[InvalidationActionResult]:
+        """Collect the results of submitted actions. Each result is returned
+        by only one call.
+
+        :param wait_for_all: If True, wait for all submitted actions to
+            complete. Otherwise, only the results of the actions which have
+            already completed are returned.
+
+        :returns: The results in the order the actions were submitted.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        if wait_for_all:
+            wait(futures)
+        done = [future for future in futures if future.done()]
+        with self._lock:
+            done_set = set(done)
+            self._futures = [f for f in self._futures if f not in done_set]
+        return [future.result() for future in done]
+
+    def shutdown(self, wait_for_all: bool = True) -> None:
+        """Stop the worker threads. Actions submitted afterwards start a new
+        pool.
+
+        :param wait_for_all: If True, wait for all submitted actions to
+            complete first.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait_for_all)
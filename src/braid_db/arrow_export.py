@@ -0,0 +1,192 @@
+# ARROW EXPORT
+# Stream the tables of a BraidDB into Arrow record batches
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from uuid import UUID
+
+import pyarrow as pa
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import (
+    BraidDerivationModel,
+    BraidInvalidationModel,
+    BraidRecordModel,
+    BraidTagKeyModel,
+    BraidTagsModel,
+    BraidUriPrefixModel,
+    BraidUrisModel,
+)
+
+# The tables which may be exported, in an order in which each only refers
+# to those before it
+EXPORT_TABLES = ["invalidations", "records", "derivations", "uris", "tags"]
+
+# A column of an exported table: its name, Arrow type and, if the values
+# stored by the DB are not of that type, the conversion of a chunk of them
+# into an Arrow array
+ExportColumn = Tuple[
+    str, pa.DataType, Optional[Callable[[Sequence[Any]], pa.Array]]
+]
+
+
+def _uuid_array(values: Sequence[Any]) -> pa.Array:
+    # Stored as UUIDs or as hex strings, depending on the DB
+    return pa.array(
+        [None if v is None else str(UUID(str(v))) for v in values],
+        type=pa.string(),
+    )
+
+
+def _timestamp_array(values: Sequence[Any]) -> pa.Array:
+    # Stored as datetimes or as ISO 8601 strings, which Arrow parses much
+    # faster than SQLAlchemy
+    return pa.array(values).cast(pa.timestamp("us"))
+
+
+def _fields_and_select(table_name: str) -> Tuple[List[ExportColumn], Any]:
+    """Internal helper giving the columns of an exported table and the
+    select statement reading them, ordered by primary key, or by time for
+    invalidations, whose ids are random. URIs and tag keys
+    are exported whole rather than as ids of interned values.
+    """
+    timestamp: ExportColumn = ("time", pa.timestamp("us"), _timestamp_array)
+    if table_name == "records":
+        records = BraidRecordModel.__table__
+        fields = [
+            ("record_id", pa.int64(), None),
+            ("name", pa.string(), None),
+            timestamp,
+            ("invalidation_id", pa.string(), _uuid_array),
+            ("invalidation_action_id", pa.string(), _uuid_array),
+        ]
+        stmt = select(*(records.c[name] for name, _, _ in fields))
+        return fields, stmt.order_by(records.c.record_id)
+    if table_name == "derivations":
+        derivations = BraidDerivationModel.__table__
+        fields = [
+            ("record_id", pa.int64(), None),
+            ("derivation", pa.int64(), None),
+            timestamp,
+        ]
+        stmt = select(*(derivations.c[name] for name, _, _ in fields))
+        return fields, stmt.order_by(
+            derivations.c.record_id, derivations.c.derivation
+        )
+    if table_name == "uris":
+        uris = BraidUrisModel.__table__
+        prefixes = BraidUriPrefixModel.__table__
+        fields = [
+            ("id", pa.int64(), None),
+            ("record_id", pa.int64(), None),
+            ("uri", pa.string(), None),
+        ]
+        stmt = select(
+            uris.c.id, uris.c.record_id, prefixes.c.prefix + uris.c.suffix
+        ).join_from(uris, prefixes, uris.c.prefix_id == prefixes.c.id)
+        return fields, stmt.order_by(uris.c.id)
+    if table_name == "tags":
+        tags = BraidTagsModel.__table__
+        keys = BraidTagKeyModel.__table__
+        fields = [
+            ("id", pa.int64(), None),
+            ("record_id", pa.int64(), None),
+            ("key", pa.string(), None),
+            ("value", pa.string(), None),
+            ("tag_type", pa.int32(), None),
+            ("value_int", pa.int64(), None),
+            ("value_real", pa.float64(), None),
+        ]
+        stmt = select(
+            tags.c.id,
+            tags.c.record_id,
+            keys.c.key,
+            tags.c.value,
+            tags.c.tag_type,
+            tags.c.value_int,
+            tags.c.value_real,
+        ).join_from(tags, keys, tags.c.key_id == keys.c.id)
+        return fields, stmt.order_by(tags.c.id)
+    if table_name == "invalidations":
+        invalidations = BraidInvalidationModel.__table__
+        fields = [
+            ("id", pa.string(), _uuid_array),
+            ("root_invalidation", pa.string(), _uuid_array),
+            ("cause", pa.string(), None),
+            timestamp,
+        ]
+        stmt = select(*(invalidations.c[name] for name, _, _ in fields))
+        return fields, stmt.order_by(invalidations.c.time)
+    raise ValueError(
+        f"Cannot export table {table_name!r}, expected one of {EXPORT_TABLES}"
+    )
+
+
+def schema(table_name: str) -> pa.Schema:
+    """The Arrow schema of an exported table."""
+    fields, _ = _fields_and_select(table_name)
+    return pa.schema([(name, type_) for name, type_, _ in fields])
+
+
+def record_batches(
+    session: Session, table_name: str, chunk_size: int
+) -> Iterator[pa.RecordBatch]:
+    """Stream the rows of a table into Arrow record batches, without
+    creating a model per row. Only one chunk of rows is held in memory at a
+    time.
+
+    :param session: The session to read the table on.
+
+    :param table_name: The table to read, one of EXPORT_TABLES.
+
+    :param chunk_size: The number of rows in each batch, except the last.
+
+    :returns: An iterator over the batches, in the order of the table's
+        primary key, or time for invalidations. A table with no rows gives
+        no batches.
+    """
+    fields, stmt = _fields_and_select(table_name)
+    arrow_schema = pa.schema([(name, type_) for name, type_, _ in fields])
+    result = session.execute(stmt.execution_options(stream_results=True))
+    try:
+        # Rows are fetched straight from the DB-API cursor, skipping the
+        # creation of a Row and the conversion of each value by SQLAlchemy,
+        # which take most of the time otherwise
+        cursor = result.cursor
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            arrays = []
+            for (_, type_, convert), column in zip(fields, zip(*rows)):
+                if convert is None:
+                    arrays.append(pa.array(column, type=type_))
+                else:
+                    arrays.append(convert(column))
+            yield pa.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+    finally:
+        result.close()
+
+
+def to_tables(
+    session: Session, table_names: List[str], chunk_size: int
+) -> Dict[str, pa.Table]:
+    """Read whole tables into Arrow tables made of the batches given by
+    record_batches().
+    """
+    return {
+        name: pa.Table.from_batches(
+            list(record_batches(session, name, chunk_size)),
+            schema=schema(name),
+        )
+        for name in table_names
+    }
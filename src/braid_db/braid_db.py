@@ -2,35 +2,145 @@
 
 import datetime
 import logging
-import subprocess
+import operator
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
 from enum import Enum, unique
 from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional, TypeVar, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from uuid import UUID
 
+from sqlalchemy import (
+    and_,
+    bindparam,
+    case,
+    cast,
+    event,
+    exists,
+    func,
+    insert,
+    inspect,
+    literal,
+    or_,
+    text,
+    true,
+    union,
+    union_all,
+    update,
+)
 from sqlalchemy.exc import ArgumentError
+from sqlalchemy.orm import object_session, selectinload
+from sqlalchemy.orm.util import identity_key
 from sqlmodel import Session, SQLModel, create_engine, select
 from sqlmodel.engine.result import ScalarResult
 from sqlmodel.sql.expression import Select
 
+from .action_runner import (
+    InvalidationActionResult,
+    InvalidationActionRunner,
+    PendingInvalidationAction,
+)
 from .gen_tools import substitute_vals
+from .id_allocator import BraidIdAllocator
 from .models import (
     BraidDerivationModel,
+    BraidIdBlockModel,
     BraidInvalidationAction,
     BraidInvalidationModel,
+    BraidLineageClosureModel,
     BraidModelBase,
     BraidRecordModel,
+    BraidTagKeyModel,
     BraidTagsModel,
+    BraidUriPrefixModel,
     BraidUrisModel,
     InvalidationActionParamsType,
     InvalidationActionType,
+    interner_for,
+    split_uri,
 )
+from .models.braid_models import datetime_now
+from .reachability import BraidReachabilityIndex
+from .record_cache import BraidRecordCache
+
+if TYPE_CHECKING:
+    import pyarrow
+
+    from .graph import BraidGraphSnapshot
 
 SCHEMA_FILE_NAME = "braid-db.sql"
 DEFAULT_SCHEMA_FILE_PATH = Path(__file__).parent / SCHEMA_FILE_NAME
 
 SQLITE_URL_PREFIX = "sqlite:///"
 
+# Named sets of PRAGMAs applied to every connection of an SQLite DB. The
+# "performance" profile is suited to many processes writing to the same DB
+# file: WAL mode lets readers proceed while a write is in progress,
+# synchronous=NORMAL only syncs at WAL checkpoints and writers wait for a
+# busy DB rather than failing immediately.
+SQLITE_PROFILES: Dict[str, Dict[str, Union[str, int]]] = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        # Negative values are in KiB, so 64MiB
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+}
+
+# The most rows counted when estimating how many records a predicate of
+# BraidDB.record_query() matches. Predicates matching more rows than this are
+# considered equally unselective.
+QUERY_ESTIMATE_LIMIT = 10000
+
+# The most values bound into a single IN (...) clause. Queries for many ids
+# are split into chunks of this size to stay well within the limit on the
+# number of parameters of a statement (as low as 999 for older SQLite).
+IN_LIST_CHUNK_SIZE = 500
+
+# The SQLite FTS5 table indexing record names, URIs and tags for search().
+# It holds one row per record name, URI and tag, with a rowid derived from
+# the id of the source row (times 3, plus 0, 1 or 2 for the source table) so
+# that the triggers keeping it in sync can find the row to remove.
+SEARCH_TABLE = "record_search"
+_SEARCH_SOURCES = [
+    # (table, id column, text expression, rowid offset, columns the text
+    # and record id are read from)
+    ("records", "record_id", "{row}.name", 0, "name"),
+    (
+        "uris",
+        "id",
+        "(SELECT prefix FROM uri_prefixes WHERE id = {row}.prefix_id) "
+        "|| {row}.suffix",
+        1,
+        "record_id, prefix_id, suffix",
+    ),
+    (
+        "tags",
+        "id",
+        "(SELECT key FROM tag_keys WHERE id = {row}.key_id) "
+        "|| ' ' || {row}.value",
+        2,
+        "record_id, key_id, value",
+    ),
+]
+
 
 @unique
 class BraidTagType(Enum):
@@ -41,12 +151,16 @@ class BraidTagType(Enum):
     FLOAT = 3
 
     @classmethod
-    def type_for_value(cls):
-        if isinstance(cls, int):
+    def type_for_value(cls, value: Any) -> "BraidTagType":
+        # bool is a subclass of int, but True and False are stored as the
+        # strings "True" and "False" rather than as numbers
+        if isinstance(value, bool):
+            return cls.STRING
+        elif isinstance(value, int):
             return cls.INTEGER
-        elif isinstance(cls, float):
+        elif isinstance(value, float):
             return cls.FLOAT
-        elif isinstance(cls, str):
+        elif isinstance(value, str):
             return cls.STRING
         else:
             return cls.NONE
@@ -58,6 +172,7 @@ class BraidTagType(Enum):
 
 
 BraidModelTypeVar = TypeVar("BraidModelTypeVar", bound=BraidModelBase)
+T = TypeVar("T")
 TagValueType = Union[str, int, float]
 
 
@@ -67,6 +182,346 @@ class BraidTagValue:
         self.type_ = type_
 
 
+class InvalidationImpact:
+    """Summary of the records which invalidating a record would mark invalid,
+    as computed by BraidDB.invalidation_impact().
+    """
+
+    def __init__(
+        self,
+        depth_histogram: Optional[Dict[int, int]] = None,
+        actions: Optional[List[Tuple[str, str, int]]] = None,
+    ):
+        # Maps the depth below the invalidated record, which itself has depth
+        # 0, to the number of records at that depth
+        self.depth_histogram: Dict[int, int] = depth_histogram or {}
+        # (name, cmd, number of records) for each invalidation action which
+        # would be performed
+        self.actions: List[Tuple[str, str, int]] = actions or []
+
+    @property
+    def record_count(self) -> int:
+        return sum(self.depth_histogram.values())
+
+    @property
+    def action_count(self) -> int:
+        return sum(count for _, _, count in self.actions)
+
+    def __str__(self):
+        lines = [
+            f"{self.record_count} records would be invalidated, "
+            f"{self.action_count} invalidation actions would be performed"
+        ]
+        for depth, count in sorted(self.depth_histogram.items()):
+            lines.append(f"  depth {depth}: {count} records")
+        for name, cmd, count in self.actions:
+            lines.append(f"  action {name} ({cmd}): {count} records")
+        return "\n".join(lines)
+
+
+def _edge_depths(
+    record_id: int, edges: Iterable[Tuple[int, int]]
+) -> List[Tuple[int, int]]:
+    """Internal helper returning (record_id, depth) for each record reachable
+    from record_id over edges, ordered by depth and then id, where depth is
+    the length of the shortest path to the record.
+    """
+    adjacency: Dict[int, List[int]] = {}
+    for from_id, to_id in edges:
+        adjacency.setdefault(from_id, []).append(to_id)
+
+    depths = {record_id: 0}
+    lineage_depths: List[Tuple[int, int]] = []
+    frontier = [record_id]
+    depth = 0
+    while frontier:
+        depth += 1
+        next_frontier = []
+        for from_id in frontier:
+            for to_id in adjacency.get(from_id, []):
+                if to_id not in depths:
+                    depths[to_id] = depth
+                    next_frontier.append(to_id)
+        next_frontier.sort()
+        lineage_depths.extend((to_id, depth) for to_id in next_frontier)
+        frontier = next_frontier
+    return lineage_depths
+
+
+def _typed_tag_columns(value: Any, type_: BraidTagType) -> Dict[str, Any]:
+    """Internal helper returning the typed value columns of a tags table row,
+    which hold a numeric copy of the value of INTEGER and FLOAT tags. A value
+    which does not convert exactly to the type of its tag, such as a string
+    which is not a number, is stored as is with the typed columns left NULL,
+    so it is not matched by numeric comparisons.
+    """
+    columns: Dict[str, Any] = {"value_int": None, "value_real": None}
+    if isinstance(value, bool):
+        return columns
+    if type_ is BraidTagType.INTEGER:
+        if isinstance(value, float):
+            if value.is_integer():
+                columns["value_int"] = int(value)
+        else:
+            try:
+                columns["value_int"] = int(value)
+            except (TypeError, ValueError):
+                pass
+    elif type_ is BraidTagType.FLOAT:
+        try:
+            columns["value_real"] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return columns
+
+
+def _tag_row(record_id: int, key_id: int, value: Any) -> Dict[str, Any]:
+    """Internal helper building the column values of a tags table row. The
+    tag type is taken from value when it is a BraidTagValue, otherwise it is
+    determined from the python type of value.
+    """
+    if isinstance(value, BraidTagValue):
+        type_ = value.type_
+        value = value.value
+    else:
+        type_ = BraidTagType.type_for_value(value)
+    return {
+        "record_id": record_id,
+        "key_id": key_id,
+        "value": str(value),
+        "tag_type": type_.value,
+        **_typed_tag_columns(value, type_),
+    }
+
+
+def _tag_value(tag_model: BraidTagsModel) -> TagValueType:
+    """Internal helper returning the value of a tag converted to the python
+    type corresponding to its BraidTagType. tag_model may also be a row with
+    the same columns.
+    """
+    if tag_model.value_int is not None:
+        return tag_model.value_int
+    if tag_model.value_real is not None:
+        return tag_model.value_real
+    try:
+        python_type = BraidTagType(tag_model.tag_type).to_python_type()
+        if python_type is not None:
+            return python_type(tag_model.value)
+    except ValueError:
+        pass
+    return tag_model.value
+
+
+_TAG_COMPARISONS = {
+    "==": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _tag_conditions(
+    value: Optional[TagValueType] = None,
+    lt: Optional[TagValueType] = None,
+    le: Optional[TagValueType] = None,
+    gt: Optional[TagValueType] = None,
+    ge: Optional[TagValueType] = None,
+    in_: Optional[Iterable[TagValueType]] = None,
+) -> Dict[str, Any]:
+    """Internal helper gathering the tag comparisons which were provided into
+    the form expected by _tag_filter.
+    """
+    conditions = {
+        op: operand
+        for op, operand in (
+            ("==", value),
+            ("<", lt),
+            ("<=", le),
+            (">", gt),
+            (">=", ge),
+            ("in", in_),
+        )
+        if operand is not None
+    }
+    if len(conditions) == 0:
+        raise ValueError("At least one tag value or comparison is required")
+    return conditions
+
+
+def _tag_branches(key: str, conditions: Dict[str, Any], tags) -> List[Any]:
+    """Internal helper building the clauses selecting rows of the tags table
+    (or an alias of it) for a tag named key whose value satisfies all of the
+    conditions. conditions maps an operator, one of "==", "<", "<=", ">", ">="
+    or "in", to its operand, which is a list of values for "in".
+
+    String operands are compared to the text value of the tag. Numeric
+    operands are compared to the typed value columns of INTEGER and FLOAT
+    tags and, for equality and "in", also to the text value of STRING
+    tags. A row matches if it satisfies any one of the returned clauses, each
+    of which compares a single value column so that it can use the index on
+    key and that column.
+    """
+    conditions = {
+        op: list(operand) if op == "in" else operand
+        for op, operand in conditions.items()
+    }
+    operands: List[Any] = []
+    for op, operand in conditions.items():
+        if op == "in":
+            operands.extend(operand)
+        elif op in _TAG_COMPARISONS:
+            operands.append(operand)
+        else:
+            raise ValueError(
+                f"Unknown tag comparison {op}, expected one of "
+                f"{list(_TAG_COMPARISONS.keys()) + ['in']}"
+            )
+    numeric = all(isinstance(o, (int, float)) for o in operands)
+    if not numeric and not all(isinstance(o, str) for o in operands):
+        raise ValueError(
+            f"Values compared to tag {key} must be all numbers or all "
+            f"strings, not {operands}"
+        )
+
+    keys = BraidTagKeyModel.__table__
+    key_id = select(keys.c.id).where(keys.c.key == key).scalar_subquery()
+
+    def branch(column, convert):
+        clauses = [tags.c.key_id == key_id]
+        for op, operand in conditions.items():
+            if op == "in":
+                clauses.append(column.in_([convert(o) for o in operand]))
+            else:
+                clauses.append(_TAG_COMPARISONS[op](column, convert(operand)))
+        return and_(*clauses)
+
+    if not numeric:
+        return [branch(tags.c.value, str)]
+    branches = [
+        branch(tags.c.value_int, lambda o: o),
+        branch(tags.c.value_real, lambda o: o),
+    ]
+    if set(conditions.keys()) <= {"==", "in"}:
+        branches.append(branch(tags.c.value, str))
+    return branches
+
+
+def _tag_filter(key: str, conditions: Dict[str, Any]):
+    """Internal helper building a query for the ids of records with a tag
+    named key whose value satisfies all of the conditions, as described for
+    _tag_branches.
+    """
+    tags = BraidTagsModel.__table__
+    branches = [
+        select(tags.c.record_id).where(clause)
+        for clause in _tag_branches(key, conditions, tags)
+    ]
+    if len(branches) == 1:
+        return branches[0].distinct()
+    return union(*branches)
+
+
+def _chunks(
+    values: Iterable[T], size: Optional[int] = None
+) -> Iterator[List[T]]:
+    """Internal helper splitting values into lists of at most size values,
+    by default IN_LIST_CHUNK_SIZE.
+    """
+    size = size or IN_LIST_CHUNK_SIZE
+    chunk: List[T] = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _uri_columns():
+    """Internal helper returning the uris and uri_prefixes tables and an
+    expression for the full URI of a row of uris joined to its prefix.
+    """
+    uris = BraidUrisModel.__table__
+    prefixes = BraidUriPrefixModel.__table__
+    return uris, prefixes, (prefixes.c.prefix + uris.c.suffix).label("uri")
+
+
+def _range_condition(column, prefix: str):
+    """Internal helper matching the values of a column which start with
+    prefix, as a range which can be looked up in an index on the column.
+    """
+    condition = column >= prefix
+    upper = _prefix_upper_bound(prefix)
+    if upper is not None:
+        condition = and_(condition, column < upper)
+    return condition
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Internal helper returning the smallest string greater than every
+    string starting with prefix, or None if there is no such string (when
+    prefix is empty or made up of only the largest code point).
+    """
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if stripped == "":
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+
+def _where_conditions(value: Any) -> Dict[str, Any]:
+    """Internal helper converting the value of an entry of the where
+    argument of BraidDB.record_query() to the form expected by _tag_filter.
+    """
+    if isinstance(value, dict):
+        if len(value) == 0:
+            raise ValueError("At least one tag comparison is required")
+        return value
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return {"in": value}
+    else:
+        return {"==": value}
+
+
+def _tag_exists(key: str, conditions: Dict[str, Any], record_id):
+    """Internal helper building a clause which is true when the record whose
+    id is in the column record_id has a tag named key whose value satisfies
+    all of the conditions, as described for _tag_branches.
+    """
+    tags = BraidTagsModel.__table__.alias()
+    return exists().where(
+        tags.c.record_id == record_id,
+        or_(*_tag_branches(key, conditions, tags)),
+    )
+
+
+class BraidBatch:
+    """Collects the models added to a BraidDB while a batch is active and
+    commits them in groups rather than one at a time. Created by
+    BraidDB.batch() and not typically instantiated directly.
+    """
+
+    def __init__(self, db: "BraidDB", flush_every: int):
+        if flush_every < 1:
+            raise ValueError(
+                f"flush_every must be positive, not {flush_every}"
+            )
+        self.session = db.get_session(expire_on_commit=False)
+        self.flush_every = flush_every
+        self.pending = 0
+
+    def add(self, model: BraidModelBase) -> None:
+        self.session.add(model)
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        self.session.commit()
+        self.pending = 0
+
+
 class BraidDB:
     def __init__(
         self,
@@ -76,6 +531,14 @@ class BraidDB:
         mpi=False,
         echo_sql=False,
         create_engine_kwargs: Optional[Dict] = None,
+        id_block_size: Optional[int] = None,
+        sqlite_profile: Optional[Union[str, Dict]] = None,
+        action_workers: int = 4,
+        action_timeout: Optional[float] = None,
+        record_cache_size: Optional[int] = None,
+        lineage_closure: bool = False,
+        reachability_index: bool = False,
+        record_cache_ttl: Optional[float] = None,
     ):
         """Initialze a new BraidDB object. All parameters are used for
         connecting to and establishing communication with a
@@ -107,6 +570,43 @@ class BraidDB:
 
         :param create_engine_kwargs: Additional SQLModel compatible arguments
             to be passed to the create engine operation.
+
+        :param sqlite_profile: The name of an entry in SQLITE_PROFILES, or a
+            dict of PRAGMA names to values, to be applied to each connection
+            when the DB is SQLite. See create_engine().
+
+        :param id_block_size: If provided, ids for new records are allocated
+            by this process from blocks of this many ids reserved in the DB
+            (see BraidIdAllocator) rather than being assigned by the DB when
+            each record is inserted. This allows the id of a new BraidRecord
+            to be used without first writing the record to the DB.
+
+        :param action_workers: The most invalidation actions which may run at
+            the same time. See InvalidationActionRunner.
+
+        :param action_timeout: If provided, the number of seconds after which
+            a running invalidation action is killed.
+
+        :param record_cache_size: If provided, records looked up by id are
+            kept in a BraidRecordCache of this size, available as
+            record_cache, so repeated lookups of the same records do not
+            query the DB.
+
+        :param lineage_closure: If True, the lineage_closure table is updated
+            as derivations are added and used to answer get_ancestors() and
+            get_descendants() with a single indexed lookup. All processes
+            adding derivations to the DB must enable this for the table to
+            stay complete. Use rebuild_lineage_closure() to fill the table
+            for an existing DB.
+
+        :param reachability_index: If True, is_derived_from() is answered
+            from an in-memory BraidReachabilityIndex, built from the DB on
+            first use and updated as derivations added through this BraidDB
+            are committed.
+
+        :param record_cache_ttl: If provided with record_cache_size, the
+            number of seconds a record stays in the record cache, after which
+            changes made to it by other processes are seen.
         """
         self.db_url = db_url
         self.logger = logging.getLogger("BraidDB")
@@ -125,13 +625,39 @@ class BraidDB:
             from db_tools_mpi import BraidSQL_MPI
 
             self.sql = BraidSQL_MPI(db_url, log, debug)
-        self.engine = self.create_engine(db_url, echo_sql=echo_sql)
+        self.engine = self.create_engine(
+            db_url,
+            echo_sql=echo_sql,
+            create_engine_kwargs=create_engine_kwargs,
+            sqlite_profile=sqlite_profile,
+        )
+        self._batch: Optional[BraidBatch] = None
+        self.id_allocator: Optional[BraidIdAllocator] = None
+        self._id_blocks_exist = False
+        if id_block_size is not None:
+            self.id_allocator = BraidIdAllocator(self, id_block_size)
+        self.action_runner = InvalidationActionRunner(
+            max_workers=action_workers,
+            timeout=action_timeout,
+            logger=self.logger,
+        )
+        self.record_cache: Optional[BraidRecordCache] = None
+        if record_cache_size is not None:
+            self.record_cache = BraidRecordCache(
+                record_cache_size, ttl=record_cache_ttl
+            )
+        self.lineage_closure = lineage_closure
+        self.reachability_index = reachability_index
+        self._reachability: Optional[BraidReachabilityIndex] = None
+        self._reachability_lock = threading.Lock()
+        self._interner = interner_for(self.engine)
 
     def create_engine(
         self,
         db_url: str,
         echo_sql=False,
         create_engine_kwargs: Optional[Dict] = None,
+        sqlite_profile: Optional[Union[str, Dict]] = None,
     ):
         """Create an SQLModel engine object for communicating with the
         database. End-users should typically not make use of this method and,
@@ -148,17 +674,52 @@ class BraidDB:
         :param create_engine_kwargs: Additional SQLModel compatible arguments
             to be passed to the create engine operation.
 
+        :param sqlite_profile: The name of an entry in SQLITE_PROFILES, or a
+            dict of PRAGMA names to values, to be applied to each new
+            connection. For example, the "performance" profile sets WAL
+            journal mode, synchronous=NORMAL and larger caches which greatly
+            reduce contention when many processes write to the same DB
+            file. Ignored if the DB is not SQLite.
+
         :returns: An SQLModel "engine" which is used connect to and perform
             operations on the database.
         """
+        kwargs = dict(create_engine_kwargs or {})
+        if echo_sql:
+            kwargs["echo"] = True
         try:
-            if create_engine_kwargs is None:
-                create_engine_kwargs = {}
-            if echo_sql:
-                create_engine_kwargs["echo"] = True
-            return create_engine(db_url, echo=echo_sql)
+            engine = create_engine(db_url, **kwargs)
         except ArgumentError:
-            return create_engine(SQLITE_URL_PREFIX + db_url, echo=echo_sql)
+            engine = create_engine(SQLITE_URL_PREFIX + db_url, **kwargs)
+        if sqlite_profile is not None:
+            self._apply_sqlite_profile(engine, sqlite_profile)
+        return engine
+
+    def _apply_sqlite_profile(
+        self, engine, sqlite_profile: Union[str, Dict]
+    ) -> None:
+        """Internal method registering a connect hook on engine which sets the
+        PRAGMAs of an SQLite profile on each new connection.
+        """
+        if isinstance(sqlite_profile, str):
+            if sqlite_profile not in SQLITE_PROFILES:
+                raise ValueError(
+                    f"Unknown SQLite profile {sqlite_profile}, expected one "
+                    f"of {list(SQLITE_PROFILES.keys())}"
+                )
+            pragmas = SQLITE_PROFILES[sqlite_profile]
+        else:
+            pragmas = dict(sqlite_profile)
+        if engine.dialect.name != "sqlite":
+            self.debug(f"Not applying SQLite profile to {engine.url}")
+            return
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
 
     def create(self):
         """Create the DB tables used by the BraidDB. This should typically
@@ -168,6 +729,359 @@ class BraidDB:
         if self.mpi and self.sql.rank != 0:
             return
         SQLModel.metadata.create_all(self.engine)
+        # The models write columns which the tables of a DB created by an
+        # older version of BraidDB lack
+        missing = self.missing_columns()
+        if missing:
+            self.logger.info(
+                f"Upgrading DB with missing columns {', '.join(missing)}"
+            )
+            self.upgrade()
+
+    def missing_columns(self) -> List[str]:
+        """Find the columns declared on the BraidDB models which are missing
+        from existing tables in the DB, as in a DB created by an older
+        version of BraidDB. upgrade() adds them.
+
+        :returns: The names, as table.column, of the missing columns.
+        """
+        inspector = inspect(self.engine)
+        table_names = set(inspector.get_table_names())
+        missing: List[str] = []
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in table_names:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            missing += [
+                f"{table.name}.{column.name}"
+                for column in table.columns
+                if column.name not in existing
+            ]
+        return missing
+
+    def create_indexes(self) -> List[str]:
+        """Create any indexes declared on the BraidDB models which are missing
+        from the DB. Indexes are created along with their tables by create(),
+        so this is only needed for DBs created by an older version of
+        BraidDB. Creating an index on a large table may take some time.
+
+        :returns: The names of the indexes which were created.
+        """
+        inspector = inspect(self.engine)
+        table_names = set(inspector.get_table_names())
+        created: List[str] = []
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in table_names:
+                continue
+            existing = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    self.logger.info(f"Creating index {index.name}")
+                    index.create(bind=self.engine)
+                    created.append(index.name)
+        return created
+
+    def create_columns(self) -> List[str]:
+        """Add any columns declared on the BraidDB models which are missing
+        from existing tables in the DB. Only needed for DBs created by an
+        older version of BraidDB. Added columns are empty (NULL).
+
+        :returns: The names, as table.column, of the columns which were
+            added.
+        """
+        inspector = inspect(self.engine)
+        table_names = set(inspector.get_table_names())
+        preparer = self.engine.dialect.identifier_preparer
+        added: List[str] = []
+        with self.engine.begin() as conn:
+            for table in SQLModel.metadata.sorted_tables:
+                if table.name not in table_names:
+                    continue
+                existing = {
+                    c["name"] for c in inspector.get_columns(table.name)
+                }
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_type = column.type.compile(
+                        dialect=self.engine.dialect
+                    )
+                    self.logger.info(
+                        f"Adding column {table.name}.{column.name}"
+                    )
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {preparer.format_table(table)} "
+                            f"ADD COLUMN {preparer.format_column(column)} "
+                            f"{column_type}"
+                        )
+                    )
+                    added.append(f"{table.name}.{column.name}")
+        return added
+
+    def intern_columns(self) -> List[str]:
+        """Move the tag keys and URIs of a DB created before they were
+        interned into the tag_keys and uri_prefixes tables, rebuilding the
+        tags and uris tables with the ids of their keys and prefixes. Ids of
+        tags and URIs are kept. Only needed for DBs created by an older
+        version of BraidDB, and may take some time on a large DB.
+
+        :returns: The names, as table.column, of the columns which were
+            added.
+        """
+        inspector = inspect(self.engine)
+        columns = {
+            table: {c["name"] for c in inspector.get_columns(table)}
+            for table in ("tags", "uris")
+        }
+        migrate_tags = "key_id" not in columns["tags"]
+        migrate_uris = "prefix_id" not in columns["uris"]
+        if not (migrate_tags or migrate_uris):
+            return []
+        if migrate_uris:
+            uri_prefix = self._uri_prefix_sql("uri")
+        search_index = SEARCH_TABLE in inspector.get_table_names()
+        added: List[str] = []
+        with self.engine.begin() as conn:
+            if search_index:
+                # The triggers refer to the old columns, so the index is
+                # rebuilt afterwards
+                conn.execute(text(f"DROP TABLE {SEARCH_TABLE}"))
+                for table, *_ in _SEARCH_SOURCES:
+                    for event_name in ("insert", "update", "delete"):
+                        conn.execute(
+                            text(
+                                "DROP TRIGGER IF EXISTS "
+                                f"{SEARCH_TABLE}_{table}_{event_name}"
+                            )
+                        )
+            for table, migrate in (
+                ("tags", migrate_tags),
+                ("uris", migrate_uris),
+            ):
+                if not migrate:
+                    continue
+                self.logger.info(f"Interning the {table} table")
+                for index in inspector.get_indexes(table):
+                    conn.execute(text(f"DROP INDEX {index['name']}"))
+                conn.execute(
+                    text(f"ALTER TABLE {table} RENAME TO {table}_old")
+                )
+            if migrate_tags:
+                tags = BraidTagsModel.__table__
+                tags.create(conn)
+                # Columns added to tags since, such as value_int, are left
+                # empty for upgrade() to fill
+                copied = [
+                    c.name for c in tags.columns if c.name in columns["tags"]
+                ]
+                conn.execute(
+                    text(
+                        "INSERT INTO tag_keys(key) "
+                        "SELECT DISTINCT key FROM tags_old"
+                    )
+                )
+                conn.execute(
+                    text(
+                        f"INSERT INTO tags({', '.join(copied)}, key_id) "
+                        "SELECT "
+                        + "".join(f"tags_old.{c}, " for c in copied)
+                        + "tag_keys.id FROM tags_old "
+                        "JOIN tag_keys ON tag_keys.key = tags_old.key"
+                    )
+                )
+                conn.execute(text("DROP TABLE tags_old"))
+                added.append("tags.key_id")
+            if migrate_uris:
+                BraidUrisModel.__table__.create(conn)
+                conn.execute(
+                    text(
+                        "INSERT INTO uri_prefixes(prefix) "
+                        f"SELECT DISTINCT {uri_prefix} FROM uris_old"
+                    )
+                )
+                conn.execute(
+                    text(
+                        "INSERT INTO uris(id, record_id, prefix_id, suffix) "
+                        "SELECT uris_old.id, uris_old.record_id, "
+                        "uri_prefixes.id, substr(uris_old.uri, "
+                        "length(uri_prefixes.prefix) + 1) "
+                        "FROM uris_old JOIN uri_prefixes "
+                        f"ON uri_prefixes.prefix = {uri_prefix}"
+                    )
+                )
+                conn.execute(text("DROP TABLE uris_old"))
+                added += ["uris.prefix_id", "uris.suffix"]
+        if search_index:
+            self.create_search_index()
+        return added
+
+    def _uri_prefix_sql(self, column: str) -> str:
+        """Internal method giving the SQL computing split_uri()'s prefix of a
+        URI column.
+        """
+        dialect_name = self.engine.dialect.name
+        if dialect_name == "sqlite":
+            # Trimming all characters other than "/" from the end leaves the
+            # URI up to its last "/"
+            return f"rtrim({column}, replace({column}, '/', ''))"
+        if dialect_name == "postgresql":
+            return f"coalesce(substring({column} from '^.*/'), '')"
+        raise ValueError(
+            f"interning URIs is not supported for {dialect_name} DBs"
+        )
+
+    def upgrade(self) -> List[str]:
+        """Bring a DB created by an older version of BraidDB up to date with
+        the current schema by creating any missing tables, columns and
+        indexes and filling in values for newly added columns. Safe to run on
+        an up to date DB.
+
+        :returns: The names of the columns and indexes which were created.
+        """
+        if self.mpi and self.sql.rank != 0:
+            return []
+        SQLModel.metadata.create_all(self.engine)
+        created = self.intern_columns()
+        created += self.create_columns()
+        # Fill the typed value columns of tags added before they existed, as
+        # they would be filled when adding the tags now
+        tags = BraidTagsModel.__table__
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                select(tags.c.id, tags.c.value, tags.c.tag_type)
+                .where(
+                    tags.c.tag_type.in_(
+                        [BraidTagType.INTEGER.value, BraidTagType.FLOAT.value]
+                    )
+                )
+                .where(tags.c.value_int.is_(None))
+                .where(tags.c.value_real.is_(None))
+            )
+            rows = [
+                {
+                    "tag_id": tag_id,
+                    **_typed_tag_columns(value, BraidTagType(tag_type)),
+                }
+                for tag_id, value, tag_type in result
+            ]
+            rows = [
+                row
+                for row in rows
+                if row["value_int"] is not None
+                or row["value_real"] is not None
+            ]
+            if rows:
+                conn.execute(
+                    update(tags)
+                    .where(tags.c.id == bindparam("tag_id"))
+                    .values(
+                        value_int=bindparam("value_int"),
+                        value_real=bindparam("value_real"),
+                    ),
+                    rows,
+                )
+        return created + self.create_indexes()
+
+    def create_search_index(self) -> bool:
+        """Create the full-text index used by search(), if it is missing, and
+        fill it from the records, uris and tags already in the DB. Triggers
+        keep the index up to date with all later changes to those tables,
+        whichever process makes them, which makes adding records several
+        times slower. Requires SQLite 3.34 or later with FTS5.
+
+        :returns: True if the index was created, False if it already
+            existed.
+        """
+        if self.engine.dialect.name != "sqlite":
+            raise ValueError(
+                f"search is not supported for {self.engine.dialect.name} DBs"
+            )
+        if SEARCH_TABLE in inspect(self.engine).get_table_names():
+            return False
+        self.logger.info(f"Creating search index {SEARCH_TABLE}")
+        with self.engine.begin() as conn:
+            # The trigram tokenizer matches any fragment of three or more
+            # characters, such as part of a path or sample name
+            conn.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+                    "text, record_id UNINDEXED, tokenize = 'trigram')"
+                )
+            )
+            for table, id_col, text_expr, offset, columns in _SEARCH_SOURCES:
+                record_id = f"{table}.record_id"
+                conn.execute(
+                    text(
+                        f"INSERT INTO {SEARCH_TABLE}(rowid, text, record_id) "
+                        f"SELECT {table}.{id_col} * 3 + {offset}, "
+                        f"{text_expr.format(row=table)}, {record_id} "
+                        f"FROM {table}"
+                    )
+                )
+                insert_new = (
+                    f"INSERT INTO {SEARCH_TABLE}(rowid, text, record_id) "
+                    f"VALUES (new.{id_col} * 3 + {offset}, "
+                    f"{text_expr.format(row='new')}, new.record_id);"
+                )
+                delete_old = (
+                    f"DELETE FROM {SEARCH_TABLE} "
+                    f"WHERE rowid = old.{id_col} * 3 + {offset};"
+                )
+                # Updates to other columns, such as the invalidation of a
+                # record, leave the index alone
+                for event_name, trigger_event, body in (
+                    ("insert", "INSERT", insert_new),
+                    (
+                        "update",
+                        f"UPDATE OF {columns}",
+                        delete_old + insert_new,
+                    ),
+                    ("delete", "DELETE", delete_old),
+                ):
+                    conn.execute(
+                        text(
+                            f"CREATE TRIGGER {SEARCH_TABLE}_{table}_"
+                            f"{event_name} AFTER {trigger_event} ON "
+                            f"{table} BEGIN {body} END"
+                        )
+                    )
+        return True
+
+    def search(
+        self, query: str, limit: int = 20, session: Optional[Session] = None
+    ) -> List[Tuple[int, float]]:
+        """Find records whose name, URIs or tags contain a piece of text,
+        using the index created by create_search_index().
+
+        :param query: The text to look for, at least three characters long.
+            It is matched as a case-insensitive substring of record names,
+            URIs and tags. A tag matches as "key value".
+
+        :param limit: The most records to return.
+
+        :param session: The SQLModel session to use when running the query. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: A list of (record_id, score) pairs, best match first. The
+            score is the FTS5 bm25 rank of the record's best matching name,
+            URI or tag, where lower is better.
+        """
+        if len(query) < 3:
+            raise ValueError(
+                f"search text must be at least 3 characters, not {query!r}"
+            )
+        # Quote the text as a single phrase so that it is not parsed as FTS5
+        # query syntax
+        phrase = '"' + query.replace('"', '""') + '"'
+        stmt = text(
+            f"SELECT record_id, min(rank) AS score FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH :phrase "
+            "GROUP BY record_id ORDER BY score, record_id LIMIT :limit"
+        ).bindparams(phrase=phrase, limit=limit)
+        with self._session_scope(session) as session:
+            return [(row[0], row[1]) for row in session.execute(stmt)]
 
     def get_session(self, **kwargs) -> Session:
         """
@@ -186,6 +1100,59 @@ class BraidDB:
         """
         return Session(self.engine, **kwargs)
 
+    @contextmanager
+    def _session_scope(
+        self, session: Optional[Session] = None
+    ) -> Iterator[Session]:
+        """Internal helper yielding the session to use for an operation. If a
+        session is provided it is used as-is and left for the caller to
+        commit. Otherwise, a new session is created and committed when the
+        operation completes successfully.
+        """
+        if session is not None:
+            yield session
+        elif self._batch is not None:
+            yield self._batch.session
+        else:
+            with self.get_session(expire_on_commit=False) as session:
+                yield session
+                session.commit()
+
+    @contextmanager
+    def batch(self, flush_every: int = 1000) -> Iterator[Session]:
+        """Context manager grouping DB operations into a small number of
+        large transactions. While the batch is active, operations which are
+        not given an explicit session, such as creating a BraidRecord or
+        calling its add_uri, add_tag, add_derivation and
+        add_invalidation_action methods, are performed on a session shared by
+        the batch. That session is committed each time flush_every models
+        have been added and again when the batch exits. If the batch exits
+        due to an exception, models added since the last commit are rolled
+        back.
+
+        Batches may be nested, in which case the outermost batch is used. A
+        batch is tied to this BraidDB object and should only be used by a
+        single thread.
+
+        :param flush_every: The number of models to add between commits.
+
+        :returns: The session shared by operations within the batch.
+        """
+        if self._batch is not None:
+            yield self._batch.session
+            return
+        batch = BraidBatch(self, flush_every)
+        self._batch = batch
+        try:
+            yield batch.session
+            batch.flush()
+        except BaseException:
+            batch.session.rollback()
+            raise
+        finally:
+            self._batch = None
+            batch.session.close()
+
     def run_query(
         self,
         stmt: Select,
@@ -207,6 +1174,8 @@ class BraidDB:
         :returns: Results from the query as defined by the filter_func
         """
         func_name = filter_func.__name__
+        if session is None and self._batch is not None:
+            session = self._batch.session
         if session is not None:
             result = session.exec(stmt)
             func_to_call = getattr(result, func_name)
@@ -266,12 +1235,240 @@ class BraidDB:
         :returns: An instance of the SQLModel for the record if it exists in
             the DB.
         """
-        return self.query_one_or_none(
-            select(BraidRecordModel).where(
-                BraidRecordModel.record_id == record_id
-            ),
-            session=session,
+        stmt = select(BraidRecordModel).where(
+            BraidRecordModel.record_id == record_id
         )
+        if self.record_cache is None:
+            return self.query_one_or_none(stmt, session=session)
+
+        if session is None and self._batch is not None:
+            session = self._batch.session
+        if session is not None:
+            # A record already in the session may have unflushed changes
+            in_session = session.identity_map.get(
+                identity_key(BraidRecordModel, record_id)
+            )
+            if in_session is not None:
+                return in_session
+        cached = self.record_cache.get(record_id)
+        if cached is not None:
+            if session is None:
+                return cached
+            return session.merge(cached, load=False)
+
+        model = self.query_one_or_none(stmt, session=session)
+        if model is not None:
+            if session is not None:
+                self._watch_cached_session(session)
+            self.record_cache.put(model)
+        return model
+
+    def _watch_cached_session(self, session: Session) -> None:
+        """Internal method keeping the record cache consistent with the
+        changes made by session. Records the session changes are evicted
+        when it commits, as they may have been cached by other lookups before
+        then. If the session writes to the DB and is then rolled back, the
+        whole cache is cleared, as records cached from the session may
+        include the changes which were rolled back.
+        """
+        if self.record_cache is None or "braid_cache" in session.info:
+            return
+        state: Dict[str, Any] = {"flushed": False, "changed": set()}
+        session.info["braid_cache"] = state
+
+        def after_flush(session, flush_context):
+            state["flushed"] = True
+            state["changed"].update(
+                model.record_id
+                for model in session.dirty
+                if isinstance(model, BraidRecordModel)
+            )
+
+        def after_commit(session):
+            if self.record_cache is not None:
+                if None in state["changed"]:
+                    self.record_cache.clear()
+                for record_id in state["changed"]:
+                    self.record_cache.evict(record_id)
+            state["flushed"] = False
+            state["changed"] = set()
+
+        def after_transaction_end(session, transaction):
+            if transaction.parent is not None:
+                return
+            if state["flushed"] and self.record_cache is not None:
+                self.record_cache.clear()
+            state["flushed"] = False
+            state["changed"] = set()
+
+        event.listen(session, "after_flush", after_flush)
+        event.listen(session, "after_commit", after_commit)
+        event.listen(session, "after_transaction_end", after_transaction_end)
+
+    def evict_cached_record(
+        self, record_id: Optional[int], session: Optional[Session] = None
+    ) -> None:
+        """Drop a record from the record cache, if there is one, so that it is
+        looked up in the DB next time. Called when the record is changed.
+
+        :param record_id: The id of the record, or None to drop all records.
+
+        :param session: The session the record was changed in, if any. The
+            record is dropped again once the session commits.
+        """
+        if self.record_cache is None:
+            return
+        if record_id is None:
+            self.record_cache.clear()
+        else:
+            self.record_cache.evict(record_id)
+        if session is None and self._batch is not None:
+            session = self._batch.session
+        if session is not None:
+            self._watch_cached_session(session)
+            session.info["braid_cache"]["changed"].add(record_id)
+
+    def get_record_models_by_ids(
+        self, record_ids: Iterable[int], session: Optional[Session] = None
+    ) -> List[BraidRecordModel]:
+        """Retrieve many records from the database together with their uris,
+        tags, invalidation and invalidation action. The related objects are
+        loaded with one query per relationship for each IN_LIST_CHUNK_SIZE
+        records rather than lazily for each record, so they can be used
+        without any further queries, even once the session has been closed.
+
+        :param record_ids: The ids of the records to be retrieved.
+
+        :param session: The SQLModel session to use when running the query. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: The record models in the order of record_ids. Ids which are
+            not found in the DB are skipped.
+        """
+        record_ids = list(dict.fromkeys(record_ids))
+        models: Dict[int, BraidRecordModel] = {}
+        for chunk in _chunks(record_ids):
+            for model in self.query_all(
+                select(BraidRecordModel)
+                .where(BraidRecordModel.record_id.in_(chunk))
+                .options(
+                    selectinload(BraidRecordModel.uris),
+                    selectinload(BraidRecordModel.tags),
+                    selectinload(BraidRecordModel.invalidation),
+                    selectinload(BraidRecordModel.invalidation_action),
+                ),
+                session=session,
+            ):
+                models[model.record_id] = model
+        return [models[i] for i in record_ids if i in models]
+
+    def get_derivation_edges(
+        self, record_ids: Iterable[int], session: Optional[Session] = None
+    ) -> List[Tuple[int, int]]:
+        """Get the derivations to or from any of a set of records.
+
+        :param record_ids: The ids of the records.
+
+        :param session: The SQLModel session to use when running the query. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: A list of (record_id, derivation) pairs, where derivation
+            is the id of the record derived from record_id.
+        """
+        derivations = BraidDerivationModel.__table__
+        edges: Dict[Tuple[int, int], None] = {}
+        for chunk in _chunks(dict.fromkeys(record_ids)):
+            rows = self.query_all(
+                select(
+                    derivations.c.record_id, derivations.c.derivation
+                ).where(
+                    or_(
+                        derivations.c.record_id.in_(chunk),
+                        derivations.c.derivation.in_(chunk),
+                    )
+                ),
+                session=session,
+            )
+            edges.update((tuple(row), None) for row in rows)
+        return list(edges)
+
+    def iter_record_batches(
+        self,
+        batch_size: int = 1000,
+        after_id: Optional[int] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        session: Optional[Session] = None,
+    ) -> Iterator[List[BraidRecordModel]]:
+        """Iterate over the records in the DB in order of record id, a batch
+        at a time. Each batch is fetched with a separate query starting after
+        the last id of the previous batch (keyset pagination), so the cost of
+        fetching a batch does not grow with the position in the DB and only
+        one batch needs to be held in memory.
+
+        :param batch_size: The most records in each batch.
+
+        :param after_id: If provided, only records with a larger id are
+            returned. Used to resume an earlier iteration.
+
+        :param since: If provided, only records created at or after this time
+            are returned.
+
+        :param until: If provided, only records created before this time are
+            returned.
+
+        :param session: The SQLModel session to run the queries on. If None,
+            each batch is fetched with a new session, so no transaction is
+            held open between batches, and the models are returned detached.
+
+        :returns: An iterator over lists of record models.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be positive, not {batch_size}")
+        stmt = select(BraidRecordModel).order_by(BraidRecordModel.record_id)
+        if since is not None:
+            stmt = stmt.where(BraidRecordModel.time >= since)
+        if until is not None:
+            stmt = stmt.where(BraidRecordModel.time < until)
+        stmt = stmt.limit(batch_size).execution_options(yield_per=batch_size)
+        last_id = after_id
+        while True:
+            page = stmt
+            if last_id is not None:
+                page = page.where(BraidRecordModel.record_id > last_id)
+            batch: List[BraidRecordModel] = list(
+                self.query_all(page, session=session)
+            )
+            if len(batch) == 0:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1].record_id
+
+    def iter_records(
+        self,
+        batch_size: int = 1000,
+        after_id: Optional[int] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        session: Optional[Session] = None,
+    ) -> Iterator[BraidRecordModel]:
+        """Iterate over the records in the DB in order of record id in
+        constant memory. The parameters are as for iter_record_batches().
+
+        :returns: An iterator over record models.
+        """
+        for batch in self.iter_record_batches(
+            batch_size=batch_size,
+            after_id=after_id,
+            since=since,
+            until=until,
+            session=session,
+        ):
+            yield from batch
 
     def insert(self, record):
         """
@@ -292,51 +1489,489 @@ class BraidDB:
 
         :param session: The SQLModel session to use when running the query. If
             session is None, a new session will be created for this single
-            operation.
+            operation unless a batch is active, in which case the model is
+            added to the batch.
 
         :returns: The same BraidModel passed as input
         """
         self.trace(f"Adding model {model} to session {str(session)}")
+        # A new record has no id yet and cannot be cached, while evicting
+        # None would clear the whole cache
+        if isinstance(model, BraidRecordModel) and model.record_id is not None:
+            self.evict_cached_record(model.record_id, session=session)
         if session is not None:
+            self.allocate_id(model, session=session)
             session.add(model)
+            self._derivation_added(model, session)
+            return model
+        elif self._batch is not None:
+            self.allocate_id(model, session=self._batch.session)
+            self._derivation_added(model, self._batch.session)
+            self._batch.add(model)
             return model
         else:
-            with Session(self.engine, expire_on_commit=False) as session:
+            with self.get_session(expire_on_commit=False) as session:
+                self.allocate_id(model, session=session)
                 session.add(model)
+                self._derivation_added(model, session)
                 session.commit()
                 return model
 
+    def _derivation_added(
+        self, model: BraidModelBase, session: Session
+    ) -> None:
+        """Internal helper adding a derivation being added to the DB to the
+        lineage closure and reachability index, when enabled.
+        """
+        if not isinstance(model, BraidDerivationModel):
+            return
+        edge = (model.record_id, model.derivation)
+        if self.lineage_closure:
+            self._add_closure_edges([edge], session)
+        self._add_pending_edges([edge], session)
+
+    def _add_closure_edges(
+        self, edges: List[Tuple[int, int]], session: Session
+    ) -> None:
+        """Internal helper holding derivations added on a session until its
+        next flush, when the records they refer to have been written, and
+        adding them to the lineage closure then. This avoids a flush for each
+        derivation, which would defeat the grouping done by batch().
+        """
+        if "braid_closure_edges" not in session.info:
+            event.listen(session, "after_flush", self._apply_closure_edges)
+            event.listen(
+                session, "after_transaction_end", self._discard_closure_edges
+            )
+        session.info.setdefault("braid_closure_edges", []).extend(edges)
+
+    def _apply_closure_edges(self, session: Session, flush_context) -> None:
+        edges = session.info.get("braid_closure_edges", [])
+        session.info["braid_closure_edges"] = []
+        for record_id, derivation in edges:
+            self.add_closure_edge(record_id, derivation, session)
+
+    def _discard_closure_edges(self, session: Session, transaction) -> None:
+        if transaction.parent is None:
+            session.info["braid_closure_edges"] = []
+
+    def _add_pending_edges(
+        self, edges: List[Tuple[int, int]], session: Session
+    ) -> None:
+        """Internal helper holding derivations added on a session until it
+        commits, when they are added to the reachability index.
+        """
+        if not self.reachability_index:
+            return
+        if "braid_pending_edges" not in session.info:
+            event.listen(session, "after_commit", self._apply_pending_edges)
+            event.listen(
+                session, "after_transaction_end", self._discard_pending_edges
+            )
+        session.info.setdefault("braid_pending_edges", []).extend(edges)
+
+    def _apply_pending_edges(self, session: Session) -> None:
+        edges = session.info.pop("braid_pending_edges", [])
+        session.info["braid_pending_edges"] = []
+        with self._reachability_lock:
+            # An index which has not been built yet will read these edges
+            # from the DB when it is
+            if self._reachability is not None:
+                for record_id, derivation in edges:
+                    self._reachability.add_derivation(record_id, derivation)
+
+    def _discard_pending_edges(self, session: Session, transaction) -> None:
+        if transaction.parent is None:
+            session.info["braid_pending_edges"] = []
+
+    def add_closure_edge(
+        self, record_id: int, derivation: int, session: Session
+    ) -> None:
+        """Update the lineage_closure table for a new derivation from
+        record_id to derivation. Each ancestor of record_id (and record_id
+        itself) becomes an ancestor of derivation and each of its descendants,
+        with a single INSERT ... SELECT that keeps the shorter depth for pairs
+        already in the table. Called automatically for derivations added to a
+        BraidDB with lineage_closure enabled.
+
+        :param record_id: The id of the record derived from.
+
+        :param derivation: The id of the derived record.
+
+        :param session: The session to perform the update on.
+        """
+        closure = BraidLineageClosureModel.__table__
+        up = union_all(
+            select(closure.c.ancestor, closure.c.depth).where(
+                closure.c.descendant == record_id
+            ),
+            select(
+                literal(record_id).label("ancestor"),
+                literal(0).label("depth"),
+            ),
+        ).subquery("up")
+        down = union_all(
+            select(closure.c.descendant, closure.c.depth).where(
+                closure.c.ancestor == derivation
+            ),
+            select(
+                literal(derivation).label("descendant"),
+                literal(0).label("depth"),
+            ),
+        ).subquery("down")
+        pairs = (
+            select(
+                up.c.ancestor,
+                down.c.descendant,
+                up.c.depth + down.c.depth + 1,
+            ).select_from(up.join(down, true()))
+            # SQLite requires a WHERE clause in an INSERT ... SELECT which is
+            # followed by ON CONFLICT
+            .where(up.c.depth >= 0)
+        )
+        dialect_name = session.get_bind().dialect.name
+        if dialect_name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        elif dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            raise ValueError(
+                f"lineage_closure is not supported for {dialect_name} DBs"
+            )
+        stmt = upsert(closure).from_select(
+            ["ancestor", "descendant", "depth"], pairs
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[closure.c.ancestor, closure.c.descendant],
+            set_={"depth": stmt.excluded.depth},
+            where=stmt.excluded.depth < closure.c.depth,
+        )
+        session.execute(stmt)
+
+    def rebuild_lineage_closure(
+        self, session: Optional[Session] = None
+    ) -> int:
+        """Fill the lineage_closure table from the derivations table,
+        replacing its current contents, with a single recursive INSERT ...
+        SELECT. Needed when enabling lineage_closure on an existing DB, or if
+        derivations were added by a BraidDB which did not have it enabled.
+
+        :param session: The session to perform the rebuild on. If None, a new
+            session is used and committed.
+
+        :returns: The number of rows in the rebuilt table.
+        """
+        closure = BraidLineageClosureModel.__table__
+        derivations = BraidDerivationModel.__table__
+        records = BraidRecordModel.__table__
+        with self._session_scope(session) as session:
+            session.execute(closure.delete())
+            # A shortest path visits each record at most once, so with the
+            # paths cut at that length the query terminates even if the
+            # derivations contain a cycle
+            max_depth = session.execute(
+                select(func.count()).select_from(records)
+            ).scalar_one()
+            paths = select(
+                derivations.c.record_id.label("ancestor"),
+                derivations.c.derivation.label("descendant"),
+                literal(1).label("depth"),
+            ).cte("paths", recursive=True)
+            step = (
+                select(
+                    paths.c.ancestor,
+                    derivations.c.derivation,
+                    paths.c.depth + 1,
+                )
+                .select_from(
+                    paths.join(
+                        derivations,
+                        derivations.c.record_id == paths.c.descendant,
+                    )
+                )
+                .where(paths.c.depth < max_depth)
+            )
+            paths = paths.union(step)
+            session.execute(
+                closure.insert().from_select(
+                    ["ancestor", "descendant", "depth"],
+                    select(
+                        paths.c.ancestor,
+                        paths.c.descendant,
+                        func.min(paths.c.depth),
+                    ).group_by(paths.c.ancestor, paths.c.descendant),
+                )
+            )
+            # The row count of an INSERT ... SELECT with a CTE is not
+            # reported by every driver
+            return session.execute(
+                select(func.count()).select_from(closure)
+            ).scalar_one()
+
+    def allocate_id(
+        self, model: BraidModelBase, session: Optional[Session] = None
+    ) -> BraidModelBase:
+        """Set the record_id of a BraidRecordModel which does not yet have one
+        using the id allocator of this BraidDB. Other models, and all models
+        when the BraidDB was created without an id_block_size, are returned
+        unchanged.
+
+        :param model: The SQLModel object to set the id on
+
+        :param session: The session the model will be written with, used if
+            a new block of ids needs to be reserved.
+
+        :returns: The same BraidModel passed as input
+        """
+        if (
+            self.id_allocator is not None
+            and isinstance(model, BraidRecordModel)
+            and model.record_id is None
+        ):
+            model.record_id = self.id_allocator.next_id(session=session)
+        return model
+
+    def flush_model(self, model: BraidModelBase) -> BraidModelBase:
+        """Make sure a model has been written to the DB so that values
+        generated by the DB, such as its id, are available. If the model
+        belongs to an open session, including the session of an active batch,
+        that session is flushed but not committed. Otherwise, the model is
+        added using add_model(). When the model is a BraidRecordModel and this
+        BraidDB has an id allocator, the id is allocated without flushing.
+
+        :param model: The SQLModel object to be written
+
+        :returns: The same BraidModel passed as input
+        """
+        session = object_session(model)
+        if session is None:
+            self.add_model(model)
+            session = object_session(model)
+        if session is not None:
+            if isinstance(model, BraidRecordModel) and self.id_allocator:
+                self.allocate_id(model, session=session)
+            else:
+                session.flush()
+        return model
+
+    def add_records_bulk(
+        self,
+        records: Iterable[Dict[str, Any]],
+        session: Optional[Session] = None,
+    ) -> List[int]:
+        """Add many records, along with their URIs, tags and derivations, to
+        the DB using a small number of set-based insert statements in a single
+        transaction. This is much faster than creating a BraidRecord for each
+        entry when loading large numbers of records.
+
+        Each entry in records is a dict which may contain the following keys:
+
+        * name: The name of the record (required).
+        * time: The timestamp of the record. The current time is used if not
+          provided.
+        * uris: A list of URI strings associated with the record.
+        * tags: A dict of tag keys to values. Values may be BraidTagValue
+          objects, otherwise the tag type is determined from the type of the
+          value.
+        * predecessors: Ids of records already in the DB which this record is
+          derived from.
+        * derivations: Ids of records already in the DB which are derived from
+          this record.
+        * batch_predecessors: Positions, within records, of other entries
+          which this record is derived from.
+        * invalidation_id: The id of an invalidation already in the DB
+          which marks this record invalid.
+
+        :param records: The records to be added.
+
+        :param session: The SQLModel session to use when adding the
+            records. If session is None, a new session will be created and
+            committed for this single operation unless a batch is active, in
+            which case the batch session is used.
+
+        :returns: The ids of the newly added records in the same order as the
+            input records.
+        """
+        records = list(records)
+        if len(records) == 0:
+            return []
+        self.trace(f"DB.add_records_bulk({len(records)} records) ...")
+        with self._session_scope(session) as session:
+            record_ids = self._insert_record_rows(records, session)
+
+            now = datetime_now()
+            uris: List[Tuple[int, str, str]] = []
+            tags: List[Tuple[int, str, Any]] = []
+            derivation_rows: List[Dict[str, Any]] = []
+            for record_id, record in zip(record_ids, records):
+                for uri in record.get("uris") or []:
+                    uris.append((record_id, *split_uri(uri)))
+                for key, value in (record.get("tags") or {}).items():
+                    tags.append((record_id, key, value))
+                predecessors = list(record.get("predecessors") or [])
+                predecessors.extend(
+                    record_ids[i]
+                    for i in record.get("batch_predecessors") or []
+                )
+                for predecessor in predecessors:
+                    derivation_rows.append(
+                        {
+                            "record_id": predecessor,
+                            "derivation": record_id,
+                            "time": now,
+                        }
+                    )
+                for derivation in record.get("derivations") or []:
+                    derivation_rows.append(
+                        {
+                            "record_id": record_id,
+                            "derivation": derivation,
+                            "time": now,
+                        }
+                    )
+
+            prefix_ids = self._interner.intern_values(
+                session,
+                BraidUriPrefixModel.__table__.c.prefix,
+                (prefix for _, prefix, _ in uris),
+            )
+            uri_rows = [
+                {
+                    "record_id": record_id,
+                    "prefix_id": prefix_ids[prefix],
+                    "suffix": suffix,
+                }
+                for record_id, prefix, suffix in uris
+            ]
+            key_ids = self._interner.intern_values(
+                session,
+                BraidTagKeyModel.__table__.c.key,
+                (key for _, key, _ in tags),
+            )
+            tag_rows = [
+                _tag_row(record_id, key_ids[key], value)
+                for record_id, key, value in tags
+            ]
+            for model, rows in (
+                (BraidUrisModel, uri_rows),
+                (BraidTagsModel, tag_rows),
+                (BraidDerivationModel, derivation_rows),
+            ):
+                if len(rows) > 0:
+                    session.execute(insert(model.__table__), rows)
+            if self.lineage_closure:
+                for row in derivation_rows:
+                    self.add_closure_edge(
+                        row["record_id"], row["derivation"], session
+                    )
+            self._add_pending_edges(
+                [
+                    (row["record_id"], row["derivation"])
+                    for row in derivation_rows
+                ],
+                session,
+            )
+        return record_ids
+
+    def _insert_record_rows(
+        self, records: List[Dict[str, Any]], session: Session
+    ) -> List[int]:
+        """Internal helper inserting the rows for add_records_bulk into the
+        records table and returning their ids.
+
+        When this BraidDB has an id allocator, a block of ids is reserved for
+        the rows. Otherwise, on SQLite, the ids are reserved through the
+        id_blocks table all the same, so that they cannot collide with blocks
+        which other processes' allocators have reserved but not yet written.
+        In both cases the rows are then inserted with a single statement.
+        SQLite DBs created before the id_blocks table existed take the write
+        lock by inserting the first row, whose new rowid is one larger than
+        any existing id, and give the remaining rows consecutive ids. Other
+        databases insert the rows one at a time.
+        """
+        now = datetime.datetime.now()
+        rows = [
+            {
+                "name": r["name"],
+                "time": r.get("time") or now,
+                "invalidation_id": r.get("invalidation_id"),
+            }
+            for r in records
+        ]
+        table = BraidRecordModel.__table__
+        allocator = self.id_allocator
+        is_sqlite = session.get_bind().dialect.name == "sqlite"
+        if allocator is None and is_sqlite and self._has_id_blocks(session):
+            allocator = BraidIdAllocator(self)
+        if allocator is not None:
+            start = allocator.reserve(len(rows), session=session)
+            record_ids = list(range(start, start + len(rows)))
+            for record_id, row in zip(record_ids, rows):
+                row["record_id"] = record_id
+            session.execute(insert(table), rows)
+            return record_ids
+
+        first = session.execute(insert(table), rows[0])
+        first_id = first.inserted_primary_key[0]
+        if not is_sqlite:
+            record_ids = [first_id]
+            for row in rows[1:]:
+                result = session.execute(insert(table), row)
+                record_ids.append(result.inserted_primary_key[0])
+            return record_ids
+
+        record_ids = list(range(first_id, first_id + len(rows)))
+        for record_id, row in zip(record_ids[1:], rows[1:]):
+            row["record_id"] = record_id
+        if len(rows) > 1:
+            session.execute(insert(table), rows[1:])
+        return record_ids
+
+    def _has_id_blocks(self, session: Session) -> bool:
+        """Internal method checking whether the DB has the id_blocks table.
+        Only a positive answer is remembered, as upgrade() may add it.
+        """
+        if not self._id_blocks_exist:
+            self._id_blocks_exist = inspect(session.connection()).has_table(
+                BraidIdBlockModel.__tablename__
+            )
+        return self._id_blocks_exist
+
     def print(self, session: Optional[Session] = None) -> None:
         """Provide a rudimentary dump of the database to standard
         out. Suitable only for debugging. Can lead to huge amounts of output if
         the database is large.
 
-        :param session: The SQLModel session to use when running the query. If
-            session is None, a new session will be created for this single
-            operation.
+        :param session: The SQLModel session to use when running the queries.
+            If session is None, new sessions will be created for each batch
+            of records printed.
         """
-        with Session(self.engine) as session:
-            records = session.exec(select(BraidRecordModel))
+        for records in self.iter_record_batches(session=session):
+            record_ids = [record.record_id for record in records]
+            derivatives: Dict[int, List[int]] = {}
+            for from_id, to_id in self.get_derivation_edges(
+                record_ids, session=session
+            ):
+                derivatives.setdefault(from_id, []).append(to_id)
+            uris_by_record = self.get_uris_bulk(record_ids, session=session)
+            tags_by_record = self.get_tags_bulk(record_ids, session=session)
             for record in records:
                 record_id = record.record_id
                 # text = "%5s : %-16s %s" % ("[%i]" % record_id, name, time)
                 text = (
                     f"[{record.record_id:5}] : {record.name:16} {record.time}"
                 )
-                derivatives = self.get_derivations(record_id, session=session)
-                text = text + " <- " + str([d.record_id for d in derivatives])
-                uris = self.get_uris(record_id, session=session)
-                if uris is not None:
-                    for uri in uris:
-                        text += "\n\t\t\t URI: "
-                        text += uri
-                tags = self.get_tags(record_id, session=session)
+                text = (
+                    text + " <- " + str(sorted(derivatives.get(record_id, [])))
+                )
+                for uri in uris_by_record.get(record_id, []):
+                    text += "\n\t\t\t URI: "
+                    text += uri
+                tags = tags_by_record.get(record_id, {})
                 for key, tag in tags.items():
                     text += "\n\t\t\t TAG: "
-                    quote = (
-                        "'" if tags[key].type_ is BraidTagType.STRING else ""
-                    )
-                    text += f"{key} = {quote}{tags[key].value}{quote}"
+                    quote = "'" if tag.type_ is BraidTagType.STRING else ""
+                    text += f"{key} = {quote}{tag.value}{quote}"
 
                 print(text)
 
@@ -368,75 +2003,807 @@ class BraidDB:
         """Return list of predecessor records in the derivation hierarchy of a
         record based on its id
 
-        :param record_id: The id of the BraidDB record to search for
-            predecessors from
+        :param record_id: The id of the BraidDB record to search for
+            predecessors from
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: A list of SQLModel representations of the records that
+            proceed the input record id in derivation hierarchy.
+        """
+
+        self.trace(f"DB.get_predecssors({record_id}) ...")
+        return self.query_all(
+            select(BraidRecordModel)
+            .join(
+                BraidDerivationModel,
+                BraidDerivationModel.record_id == BraidRecordModel.record_id,
+            )
+            .where(BraidDerivationModel.derivation == record_id),
+            session=session,
+        )
+
+    def get_derivations(
+        self, record_id, session: Optional[Session] = None
+    ) -> Iterable[BraidRecordModel]:
+        """Get a list of SQLModel records that are derived from the record
+        based on the record id.
+
+        :param record_id: The id of the BraidDB record to search for
+            predecessors from
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: list of derived records of a record based on its id
+        """
+        self.trace(f"DB.get_derivations({record_id}) ...")
+        return self.query_all(
+            select(BraidRecordModel)
+            .join(
+                BraidDerivationModel,
+                BraidDerivationModel.derivation == BraidRecordModel.record_id,
+            )
+            .where(BraidDerivationModel.record_id == record_id),
+            session=session,
+        )
+
+    def _lineage_columns(self, descendants: bool):
+        """Internal helper returning the (from, to) columns of the derivations
+        table to follow when walking towards descendants or ancestors.
+        """
+        derivations = BraidDerivationModel.__table__
+        if descendants:
+            return derivations.c.record_id, derivations.c.derivation
+        else:
+            return derivations.c.derivation, derivations.c.record_id
+
+    def _reachable_cte(
+        self,
+        record_id: int,
+        descendants: bool,
+        name: str = "reachable",
+        valid_only: bool = False,
+    ):
+        """Internal method building a recursive CTE with a single record_id
+        column containing each ancestor or descendant of a record once. As
+        rows are de-duplicated on the record id alone, the query visits each
+        derivation at most once and terminates even if the derivations
+        contain a cycle. If valid_only is set, invalidated records are
+        neither included nor followed.
+        """
+        from_col, to_col = self._lineage_columns(descendants)
+        records = BraidRecordModel.__table__
+
+        def only_valid(stmt):
+            if not valid_only:
+                return stmt
+            return stmt.join_from(
+                from_col.table, records, records.c.record_id == to_col
+            ).where(records.c.invalidation_id.is_(None))
+
+        reachable = only_valid(
+            select(to_col.label("record_id")).where(from_col == record_id)
+        ).cte(name, recursive=True)
+        step = only_valid(
+            select(to_col).join_from(
+                from_col.table,
+                reachable,
+                from_col == reachable.c.record_id,
+            )
+        )
+        return reachable.union(step)
+
+    def _lineage_depth_cte(
+        self,
+        record_id: int,
+        descendants: bool,
+        max_depth: int,
+        name: str = "lineage",
+    ):
+        """Internal method building a recursive CTE with columns (record_id,
+        depth) for the ancestors or descendants of a record at most max_depth
+        derivations away. A record reachable by paths of different lengths
+        appears once per distinct length.
+        """
+        from_col, to_col = self._lineage_columns(descendants)
+        lineage = (
+            select(to_col.label("record_id"), literal(1).label("depth"))
+            .where(from_col == record_id)
+            .cte(name, recursive=True)
+        )
+        step = (
+            select(to_col, lineage.c.depth + 1)
+            .select_from(
+                from_col.table.join(lineage, from_col == lineage.c.record_id)
+            )
+            .where(lineage.c.depth < max_depth)
+        )
+        return lineage.union(step)
+
+    def _lineage(
+        self,
+        record_id: int,
+        descendants: bool,
+        max_depth: Optional[int],
+        session: Optional[Session],
+    ) -> List[Tuple[int, int]]:
+        """Internal implementation of get_ancestors and get_descendants.
+
+        With a max_depth, the depth of each record is computed in the query
+        itself. Without one, tracking depth in the query could produce a row
+        for every distinct path length to every record, so instead a single
+        query returns each derivation reachable from the record once and the
+        depths are computed with a breadth-first pass over those edges.
+
+        With lineage_closure enabled, the records and depths are looked up
+        directly in the lineage_closure table instead.
+        """
+        if max_depth is not None and max_depth < 1:
+            return []
+        if self.lineage_closure:
+            closure = BraidLineageClosureModel.__table__
+            from_col, to_col = closure.c.ancestor, closure.c.descendant
+            if not descendants:
+                from_col, to_col = to_col, from_col
+            stmt = select(to_col, closure.c.depth).where(from_col == record_id)
+            if max_depth is not None:
+                stmt = stmt.where(closure.c.depth <= max_depth)
+            else:
+                # As for the breadth-first pass, which starts at the record
+                stmt = stmt.where(to_col != record_id)
+            rows = self.query_all(
+                stmt.order_by(closure.c.depth, to_col), session=session
+            )
+            return [(row[0], row[1]) for row in rows]
+
+        if max_depth is not None:
+            lineage = self._lineage_depth_cte(
+                record_id, descendants, max_depth
+            )
+            depth = func.min(lineage.c.depth).label("depth")
+            rows = self.query_all(
+                select(lineage.c.record_id, depth)
+                .group_by(lineage.c.record_id)
+                .order_by(depth, lineage.c.record_id),
+                session=session,
+            )
+            return [(row.record_id, row.depth) for row in rows]
+
+        from_col, to_col = self._lineage_columns(descendants)
+        reachable = self._reachable_cte(record_id, descendants)
+        edges = self.query_all(
+            select(from_col, to_col)
+            .where(from_col == record_id)
+            .union_all(
+                select(from_col, to_col).select_from(
+                    from_col.table.join(
+                        reachable, from_col == reachable.c.record_id
+                    )
+                )
+            ),
+            session=session,
+        )
+        return _edge_depths(record_id, edges)
+
+    def get_ancestors(
+        self,
+        record_id: int,
+        max_depth: Optional[int] = None,
+        session: Optional[Session] = None,
+    ) -> List[Tuple[int, int]]:
+        """Return all records which a record is derived from, directly or
+        indirectly, using a single recursive query.
+
+        :param record_id: The id of the BraidDB record to find the ancestors
+            of
+
+        :param max_depth: If provided, only ancestors at most this many
+            derivation steps away are returned.
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: A list of (record_id, depth) pairs ordered by depth, where
+            depth is the length of the shortest derivation path from the
+            ancestor to the record. Direct predecessors have depth 1.
+        """
+        self.trace(f"DB.get_ancestors({record_id}, {max_depth}) ...")
+        return self._lineage(record_id, False, max_depth, session)
+
+    def get_descendants(
+        self,
+        record_id: int,
+        max_depth: Optional[int] = None,
+        session: Optional[Session] = None,
+    ) -> List[Tuple[int, int]]:
+        """Return all records derived from a record, directly or indirectly,
+        using a single recursive query.
+
+        :param record_id: The id of the BraidDB record to find the descendants
+            of
+
+        :param max_depth: If provided, only descendants at most this many
+            derivation steps away are returned.
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: A list of (record_id, depth) pairs ordered by depth, where
+            depth is the length of the shortest derivation path from the
+            record to the descendant. Direct derivations have depth 1.
+        """
+        self.trace(f"DB.get_descendants({record_id}, {max_depth}) ...")
+        return self._lineage(record_id, True, max_depth, session)
+
+    def is_derived_from(
+        self,
+        record_id: int,
+        ancestor_id: int,
+        session: Optional[Session] = None,
+    ) -> bool:
+        """Determine whether a record is derived, directly or indirectly,
+        from another. A record is derived from itself only if it is part of
+        a cycle of derivations.
+
+        With reachability_index enabled, this is answered from the in-memory
+        index without a query. Otherwise, it is a single lookup in the
+        lineage_closure table when that is enabled, or a single recursive
+        query over the ancestors of record_id.
+
+        :param record_id: The id of the possibly derived record.
+
+        :param ancestor_id: The id of the possible ancestor.
+
+        :param session: The SQLModel session to use for any query. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: True if ancestor_id is an ancestor of record_id.
+        """
+        if self.reachability_index:
+            with self._reachability_lock:
+                if self._reachability is None:
+                    self._reachability = self._build_reachability(session)
+                return self._reachability.is_derived_from(
+                    record_id, ancestor_id
+                )
+        if self.lineage_closure:
+            closure = BraidLineageClosureModel.__table__
+            condition = and_(
+                closure.c.ancestor == ancestor_id,
+                closure.c.descendant == record_id,
+            )
+        else:
+            reachable = self._reachable_cte(record_id, False)
+            condition = reachable.c.record_id == ancestor_id
+        return bool(
+            self.query_one_or_none(
+                select(exists().where(condition)), session=session
+            )
+        )
+
+    def lineage_path(
+        self,
+        record_id: int,
+        derivation: int,
+        max_depth: Optional[int] = None,
+        session: Optional[Session] = None,
+    ) -> Optional[List[int]]:
+        """Find a shortest chain of derivations leading from one record to
+        another.
+
+        The search proceeds from both ends at once, towards descendants from
+        record_id and towards ancestors from derivation, always expanding
+        the smaller of the two frontiers. Each step fetches the derivations
+        of a whole frontier with a single query, so the number of queries
+        depends on the length of the path, not on the number of records
+        visited.
+
+        :param record_id: The id of the record the path starts from.
+
+        :param derivation: The id of the record, derived from record_id, the
+            path leads to.
+
+        :param max_depth: If provided, only paths of at most this many
+            derivations are looked for.
+
+        :param session: The SQLModel session to use when running the
+            queries. If session is None, a new session will be created for
+            this single operation.
+
+        :returns: The record ids along the path, starting with record_id and
+            ending with derivation, or None if derivation is not derived from
+            record_id.
+        """
+        if record_id == derivation:
+            return [record_id]
+        # For each record reached from either end, the record it was reached
+        # from and its distance from that end
+        reached = (
+            {record_id: (None, 0)},
+            {derivation: (None, 0)},
+        )
+        frontiers = ([record_id], [derivation])
+        best: Optional[Tuple[int, int]] = None
+        depth = 0
+        with self._session_scope(session) as session:
+            while frontiers[0] and frontiers[1]:
+                if max_depth is not None and depth >= max_depth:
+                    break
+                depth += 1
+                side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+                seen, other = reached[side], reached[1 - side]
+                from_col, to_col = self._lineage_columns(side == 0)
+                frontier: List[int] = []
+                for chunk in _chunks(frontiers[side]):
+                    rows = session.execute(
+                        select(from_col, to_col)
+                        .where(from_col.in_(chunk))
+                        .order_by(from_col, to_col)
+                    )
+                    for previous, node in rows:
+                        if node in seen:
+                            continue
+                        seen[node] = (previous, seen[previous][1] + 1)
+                        frontier.append(node)
+                        if node in other:
+                            length = seen[node][1] + other[node][1]
+                            if best is None or length < best[0]:
+                                best = (length, node)
+                frontiers = (
+                    (frontier, frontiers[1])
+                    if side == 0
+                    else (frontiers[0], frontier)
+                )
+                if best is not None:
+                    break
+        if best is None or (max_depth is not None and best[0] > max_depth):
+            return None
+
+        path: List[int] = []
+        node: Optional[int] = best[1]
+        while node is not None:
+            path.append(node)
+            node = reached[0][node][0]
+        path.reverse()
+        node = reached[1][best[1]][0]
+        while node is not None:
+            path.append(node)
+            node = reached[1][node][0]
+        return path
+
+    def common_ancestors(
+        self,
+        record_id: int,
+        other_id: int,
+        lowest: bool = False,
+        session: Optional[Session] = None,
+    ) -> List[int]:
+        """Find the records both of two records are derived from, such as
+        the inputs shared by two models. Each record counts as one of its own
+        ancestors here, so if one record is derived from the other, the
+        other is included.
+
+        A single query intersects the ancestors of the two records, each
+        found with a recursive CTE.
+
+        :param record_id: The id of one of the records.
+
+        :param other_id: The id of the other record.
+
+        :param lowest: If True, only return the common ancestors which no
+            other common ancestor is derived from, that is, those closest to
+            the two records.
+
+        :param session: The SQLModel session to use when running the query.
+            If session is None, a new session will be created for this single
+            operation.
+
+        :returns: The ids of the common ancestors in ascending order.
+        """
+
+        def ancestors(record_id: int, name: str):
+            reachable = self._reachable_cte(record_id, False, name=name)
+            return union(
+                select(reachable.c.record_id),
+                select(literal(record_id).label("record_id")),
+            ).cte(f"{name}_and_self")
+
+        first = ancestors(record_id, "ancestors")
+        second = ancestors(other_id, "other_ancestors")
+        common = (
+            select(first.c.record_id)
+            .where(first.c.record_id.in_(select(second.c.record_id)))
+            .cte("common")
+        )
+        stmt = select(common.c.record_id)
+        if lowest:
+            # If a common ancestor has a derivation which leads to either
+            # record, that derivation is a common ancestor too
+            derivations = BraidDerivationModel.__table__
+            stmt = stmt.where(
+                ~exists().where(
+                    derivations.c.record_id == common.c.record_id,
+                    derivations.c.derivation != common.c.record_id,
+                    derivations.c.derivation.in_(select(common.c.record_id)),
+                )
+            )
+        return self.query_all(
+            stmt.order_by(common.c.record_id), session=session
+        )
+
+    def refresh_reachability_index(
+        self, session: Optional[Session] = None
+    ) -> BraidReachabilityIndex:
+        """Rebuild the reachability index used by is_derived_from() from the
+        DB, picking up derivations added by other processes.
+
+        :param session: The SQLModel session to use when reading the DB. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: The rebuilt index.
+        """
+        index = self._build_reachability(session)
+        with self._reachability_lock:
+            self._reachability = index
+        return index
+
+    def _build_reachability(
+        self, session: Optional[Session]
+    ) -> BraidReachabilityIndex:
+        records = BraidRecordModel.__table__
+        derivations = BraidDerivationModel.__table__
+        index = BraidReachabilityIndex()
+        with self._session_scope(session) as session:
+            index.build(
+                session.execute(select(records.c.record_id)).scalars(),
+                session.execute(
+                    select(derivations.c.record_id, derivations.c.derivation)
+                ),
+            )
+        return index
+
+    def graph_snapshot(
+        self, chunk_size: int = 100000, session: Optional[Session] = None
+    ) -> "BraidGraphSnapshot":
+        """Load the whole derivation graph into a BraidGraphSnapshot for
+        analytics such as breadth-first search, reachability, degree
+        statistics and connected components. The records and derivations
+        tables are streamed in chunks straight into NumPy arrays, without
+        creating a model per row. Requires NumPy.
+
+        :param chunk_size: The number of rows fetched from the DB at a time.
+
+        :param session: The SQLModel session to use when reading the DB. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: A snapshot of all records and derivations in the DB.
+        """
+        import numpy as np
+
+        from .graph import from_chunks
+
+        def stream(stmt, columns):
+            result = session.execute(
+                stmt.execution_options(stream_results=True)
+            )
+            for rows in result.partitions(chunk_size):
+                yield np.array(rows, dtype=np.int64).reshape(-1, columns)
+
+        records = BraidRecordModel.__table__
+        derivations = BraidDerivationModel.__table__
+        with self._session_scope(session) as session:
+            record_ids = [
+                chunk[:, 0] for chunk in stream(select(records.c.record_id), 1)
+            ]
+            return from_chunks(
+                record_ids,
+                stream(
+                    select(derivations.c.record_id, derivations.c.derivation),
+                    2,
+                ),
+            )
+
+    def arrow_batches(
+        self,
+        table: str,
+        chunk_size: int = 100000,
+        session: Optional[Session] = None,
+    ) -> Iterator["pyarrow.RecordBatch"]:
+        """Stream one table of the DB into Arrow record batches, without
+        creating a model per row, so that tables of any size can be written
+        out, for instance to Parquet, in bounded memory. Requires PyArrow.
+
+        :param table: The table to read: one of "invalidations", "records",
+            "derivations", "uris" or "tags". URIs are given whole and tags
+            with their keys, rather than as ids of interned values. UUIDs are
+            given as strings.
+
+        :param chunk_size: The number of rows in each batch, except the last.
+
+        :param session: The SQLModel session to use when reading the DB. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: An iterator over the batches.
+        """
+        from .arrow_export import record_batches
+
+        with self._session_scope(session) as session:
+            yield from record_batches(session, table, chunk_size)
+
+    def to_arrow(
+        self,
+        tables: Optional[List[str]] = None,
+        chunk_size: int = 100000,
+        session: Optional[Session] = None,
+    ) -> Dict[str, "pyarrow.Table"]:
+        """Read tables of the DB into Arrow tables, for loading into pandas
+        or DuckDB. Each table is built from the batches given by
+        arrow_batches(), so it must fit in memory. Requires PyArrow.
+
+        :param tables: The tables to read, as for arrow_batches(). If None,
+            all of them are read.
+
+        :param chunk_size: The number of rows fetched from the DB at a time.
+
+        :param session: The SQLModel session to use when reading the DB. If
+            session is None, a new session will be created for this single
+            operation.
+
+        :returns: A dict from table name to Arrow table.
+        """
+        from .arrow_export import EXPORT_TABLES, to_tables
+
+        with self._session_scope(session) as session:
+            return to_tables(session, tables or EXPORT_TABLES, chunk_size)
+
+    def invalidation_impact(
+        self,
+        record_id: int,
+        cascade: bool = True,
+        perform_invalidation_action: bool = True,
+        perform_invalidation_action_on_cascade: bool = True,
+        session: Optional[Session] = None,
+    ) -> InvalidationImpact:
+        """Determine which records invalidating a record with
+        BraidRecord.invalidate() would mark invalid and which invalidation
+        actions would be performed, without changing the DB. The arguments
+        have the same meaning as for BraidRecord.invalidate().
+
+        A single query returns the record itself and each derivation leading
+        to a record which would be invalidated, together with the
+        invalidation action of that record. The depths are computed from
+        these derivations with a breadth-first pass.
+
+        :param record_id: The id of the record which would be invalidated.
 
         :param session: An open SQLModel session object. If none is provided,
             a temporary session will be created for only this database
             operation.
 
-        :returns: A list of SQLModel representations of the records that
-            proceed the input record id in derivation hierarchy.
+        :returns: An InvalidationImpact, which is empty if the record does
+            not exist or is already invalid.
         """
-
-        self.trace(f"DB.get_predecssors({record_id}) ...")
-        predecessors = self.query_all(
-            select(BraidDerivationModel).where(
-                BraidDerivationModel.derivation == record_id
-            ),
-            session=session,
+        self.trace(f"DB.invalidation_impact({record_id}) ...")
+        records = BraidRecordModel.__table__
+        actions = BraidInvalidationAction.__table__
+        from_col, to_col = self._lineage_columns(True)
+        columns = (
+            records.c.invalidation_action_id,
+            actions.c.name,
+            actions.c.cmd,
         )
 
-        pred_recs: List[BraidRecordModel] = []
+        def with_actions(joined):
+            return joined.outerjoin(
+                actions, actions.c.id == records.c.invalidation_action_id
+            )
 
-        for pred in predecessors:
-            pred_id = pred.record_id
-            pred_rec = self.query_one_or_none(
-                select(BraidRecordModel).where(
-                    BraidRecordModel.record_id == pred_id
-                ),
-                session=session,
+        stmt = (
+            select(
+                literal(None).label("from_id"),
+                records.c.record_id.label("to_id"),
+                *columns,
+            )
+            .select_from(with_actions(records))
+            .where(
+                records.c.record_id == record_id,
+                records.c.invalidation_id.is_(None),
+            )
+        )
+        if cascade:
+            reachable = self._reachable_cte(record_id, True, valid_only=True)
+            seed_edges = from_col.table.join(
+                records, records.c.record_id == to_col
+            )
+            reachable_edges = from_col.table.join(
+                reachable, from_col == reachable.c.record_id
+            ).join(records, records.c.record_id == to_col)
+            stmt = stmt.union_all(
+                select(from_col, to_col, *columns)
+                .select_from(with_actions(seed_edges))
+                .where(from_col == record_id)
+                .where(records.c.invalidation_id.is_(None)),
+                select(from_col, to_col, *columns)
+                .select_from(with_actions(reachable_edges))
+                .where(records.c.invalidation_id.is_(None)),
             )
-            pred_recs.append(pred_rec)
+        rows = self.query_all(stmt, session=session)
+        edges = [
+            (row.from_id, row.to_id) for row in rows if row.from_id is not None
+        ]
+        if len(edges) == len(rows):
+            # No row for the record itself, so it is missing or invalid
+            return InvalidationImpact()
+
+        record_actions = {row.to_id: row for row in rows}
+        depth_histogram: Dict[int, int] = {0: 1}
+        depths = [(record_id, 0)]
+        for to_id, depth in _edge_depths(record_id, edges):
+            if to_id != record_id:
+                depth_histogram[depth] = depth_histogram.get(depth, 0) + 1
+                depths.append((to_id, depth))
+
+        action_counts: Dict[Any, List[Any]] = {}
+        for to_id, depth in depths:
+            row = record_actions[to_id]
+            if row.invalidation_action_id is None:
+                continue
+            if depth == 0 and not perform_invalidation_action:
+                continue
+            if depth > 0 and not perform_invalidation_action_on_cascade:
+                continue
+            entry = action_counts.setdefault(
+                row.invalidation_action_id, [row.name, row.cmd, 0]
+            )
+            entry[2] += 1
+        return InvalidationImpact(
+            depth_histogram,
+            sorted(
+                (tuple(entry) for entry in action_counts.values()),
+                key=lambda entry: (-entry[2], entry[0]),
+            ),
+        )
 
-        return pred_recs
+    def invalidate_descendants(
+        self,
+        record_id: int,
+        cause: str,
+        root_invalidation: Optional[Union[str, UUID]] = None,
+        session: Optional[Session] = None,
+    ) -> List[int]:
+        """Mark all valid records derived from a record, directly or
+        indirectly, as invalid. The descendants are found with a recursive
+        query which does not continue past records that are already invalid.
+        Each is given its own invalidation, whose root_invalidation is the
+        invalidation of the record it was derived from, as if each record
+        had been invalidated in turn. All of the invalidations are added with
+        a single INSERT ... SELECT from the query, and the records marked
+        with a single UPDATE.
 
-    def get_derivations(
-        self, record_id, session: Optional[Session] = None
-    ) -> Iterable[BraidRecordModel]:
-        """Get a list of SQLModel records that are derived from the record
-        based on the record id.
+        :param record_id: The id of the record whose descendants are
+            invalidated. The record itself is not changed.
 
-        :param record_id: The id of the BraidDB record to search for
-            predecessors from
+        :param cause: The cause recorded on each invalidation.
+
+        :param root_invalidation: The id of the invalidation of the record
+            itself, used as the root_invalidation of its direct derivations.
 
         :param session: An open SQLModel session object. If none is provided,
-            a temporary session will be created for only this database
-            operation.
+            a temporary session will be created and committed for only this
+            database operation.
 
-        :returns: list of derived records of a record based on its id
+        :returns: The ids of the invalidated descendants, in ascending order.
         """
-        self.trace(f"DB.get_derivations({record_id}) ...")
-        derivations = self.query_all(
-            select(BraidDerivationModel).where(
-                BraidDerivationModel.record_id == record_id
-            ),
-            session=session,
+        self.trace(f"DB.invalidate_descendants({record_id}) ...")
+        derivations = BraidDerivationModel.__table__
+        records = BraidRecordModel.__table__
+        invalidations = BraidInvalidationModel.__table__
+
+        def only_valid(stmt):
+            return stmt.join_from(
+                derivations,
+                records,
+                records.c.record_id == derivations.c.derivation,
+            ).where(records.c.invalidation_id.is_(None))
+
+        # Each valid descendant with each valid record it is derived from
+        cascade = only_valid(
+            select(
+                derivations.c.derivation.label("record_id"),
+                derivations.c.record_id.label("parent"),
+            ).where(derivations.c.record_id == record_id)
+        ).cte("cascade", recursive=True)
+        cascade = cascade.union(
+            only_valid(
+                select(derivations.c.derivation, derivations.c.record_id)
+                .select_from(derivations)
+                .join(cascade, derivations.c.record_id == cascade.c.record_id)
+            )
+        )
+        targets = select(cascade.c.record_id).where(
+            cascade.c.record_id != record_id
         )
 
-        dep_recs: List[BraidRecordModel] = []
+        # The id of the invalidation of each target is derived from its
+        # record id and a random prefix shared by the cascade, so that the
+        # UPDATE can compute it without looking it up
+        prefix = uuid.uuid4().hex[:16]
 
-        for dep in derivations:
-            derivation_id = dep.derivation
-            dep_rec = self.query_one_or_none(
-                select(BraidRecordModel).where(
-                    BraidRecordModel.record_id == derivation_id
-                ),
-                session=session,
+        def invalidation_id(column):
+            return cast(
+                literal(prefix) + self._hex16(column), invalidations.c.id.type
+            )
+
+        root = literal(
+            None
+            if root_invalidation is None
+            else UUID(str(root_invalidation)),
+            invalidations.c.root_invalidation.type,
+        )
+        parent = func.min(cascade.c.parent)
+        with self._session_scope(session) as session:
+            # The query is not on ORM entities so pending changes, such as
+            # new derivations, are not flushed automatically
+            session.flush()
+            target_ids = list(
+                session.execute(
+                    targets.group_by(cascade.c.record_id).order_by(
+                        cascade.c.record_id
+                    )
+                ).scalars()
+            )
+            if len(target_ids) == 0:
+                return []
+            session.execute(
+                insert(invalidations).from_select(
+                    ["id", "root_invalidation", "cause", "time"],
+                    select(
+                        invalidation_id(cascade.c.record_id),
+                        case(
+                            (parent == record_id, root),
+                            else_=invalidation_id(parent),
+                        ),
+                        literal(cause),
+                        literal(datetime_now(), invalidations.c.time.type),
+                    )
+                    .where(cascade.c.record_id != record_id)
+                    .group_by(cascade.c.record_id),
+                )
             )
-            dep_recs.append(dep_rec)
+            session.execute(
+                update(BraidRecordModel)
+                .where(BraidRecordModel.record_id.in_(targets))
+                .where(BraidRecordModel.invalidation_id.is_(None))
+                .values(
+                    invalidation_id=invalidation_id(BraidRecordModel.record_id)
+                )
+                .execution_options(synchronize_session="fetch")
+            )
+            self.evict_cached_record(None, session=session)
+            return target_ids
 
-        return dep_recs
+    def _hex16(self, column):
+        """Internal method giving the SQL formatting an integer column as 16
+        lowercase hexadecimal digits.
+        """
+        dialect_name = self.engine.dialect.name
+        if dialect_name == "sqlite":
+            return func.printf("%016x", column)
+        if dialect_name == "postgresql":
+            return func.lpad(func.to_hex(column), 16, "0")
+        raise ValueError(
+            f"invalidating descendants is not supported for {dialect_name} DBs"
+        )
 
     def get_uris(
         self, record_id: int, session: Optional[Session] = None
@@ -453,11 +2820,114 @@ class BraidDB:
 
         """
         self.trace(f"DB.get_uris({record_id}) ...")
-        rec = self.get_record_model_by_id(record_id, session=session)
-        uris = []
-        if rec is not None:
-            uris = [u.uri for u in rec.uris]
-        return uris
+        return self.get_uris_bulk([record_id], session=session).get(
+            record_id, []
+        )
+
+    def get_uris_bulk(
+        self, record_ids: Iterable[int], session: Optional[Session] = None
+    ) -> Dict[int, List[str]]:
+        """Get the URIs associated with many records, using one query for
+        each IN_LIST_CHUNK_SIZE records.
+
+        :param record_ids: The ids of the BraidDB records to retrieve uris for
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: A dict mapping each record id which has uris to the list of
+            its uris, in the order they were added.
+        """
+        uris, prefixes, uri = _uri_columns()
+        uris_by_record: Dict[int, List[str]] = {}
+        for chunk in _chunks(dict.fromkeys(record_ids)):
+            rows = self.query_all(
+                select(uris.c.record_id, uri)
+                .join_from(uris, prefixes, prefixes.c.id == uris.c.prefix_id)
+                .where(uris.c.record_id.in_(chunk))
+                .order_by(uris.c.id),
+                session=session,
+            )
+            for row in rows:
+                uris_by_record.setdefault(row.record_id, []).append(row.uri)
+        return uris_by_record
+
+    def records_for_uri(
+        self, uri: str, session: Optional[Session] = None
+    ) -> List[int]:
+        """Find the records a URI has been added to, such as the record which
+        produced a file, with lookups on the indexes of the URI prefix and
+        suffix.
+
+        :param uri: The exact URI to look for.
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: The ids of the records with the URI, in ascending order.
+        """
+        uris, prefixes, _ = _uri_columns()
+        prefix, suffix = split_uri(uri)
+        return self.query_all(
+            select(uris.c.record_id)
+            .join_from(uris, prefixes, prefixes.c.id == uris.c.prefix_id)
+            .where(prefixes.c.prefix == prefix, uris.c.suffix == suffix)
+            .distinct()
+            .order_by(uris.c.record_id),
+            session=session,
+        )
+
+    def records_for_uri_prefix(
+        self, prefix: str, session: Optional[Session] = None
+    ) -> Dict[int, List[str]]:
+        """Find the records with URIs starting with a prefix, for instance all
+        files under a globustransfer://endpoint/path/ directory. The prefix
+        is turned into ranges of the indexes on uri_prefixes.prefix and
+        uris.suffix, so this is a scan of just the matching parts of those
+        indexes rather than a LIKE over the whole table. Matching is
+        case-sensitive.
+
+        :param prefix: The start of the URIs to look for.
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: A dict mapping the id of each record with a matching URI to
+            its matching URIs, in URI order.
+        """
+        uris, prefixes, uri = _uri_columns()
+        # URIs whose stored prefix is the directory part of prefix match if
+        # their suffix starts with the rest of it. Stored prefixes which are
+        # longer can only match if they start with all of prefix.
+        directory, rest = split_uri(prefix)
+        conditions = [_range_condition(prefixes.c.prefix, prefix)]
+        if rest != "":
+            conditions.append(
+                and_(
+                    prefixes.c.prefix == directory,
+                    _range_condition(uris.c.suffix, rest),
+                )
+            )
+        matches = union_all(
+            *(
+                select(uris.c.record_id, uri)
+                .join_from(uris, prefixes, prefixes.c.id == uris.c.prefix_id)
+                .where(condition)
+                for condition in conditions
+            )
+        ).subquery()
+        uris_by_record: Dict[int, List[str]] = {}
+        for row in self.query_all(
+            select(matches.c.record_id, matches.c.uri).order_by(
+                matches.c.uri, matches.c.record_id
+            ),
+            session=session,
+        ):
+            uris_by_record.setdefault(row.record_id, []).append(row.uri)
+        return uris_by_record
 
     def get_tags(
         self, record_id, session: Optional[Session] = None
@@ -473,18 +2943,263 @@ class BraidDB:
         :returns: dict of string->BraidTagValue key->value pairs
         """
         self.trace(f"DB.get_tags({record_id}) ...")
-        tag_models = self.query_all(
-            select(BraidTagsModel).where(
-                BraidTagsModel.record_id == record_id
-            ),
-            session=session,
+        return self.get_tags_bulk([record_id], session=session).get(
+            record_id, {}
+        )
+
+    def get_tags_bulk(
+        self, record_ids: Iterable[int], session: Optional[Session] = None
+    ) -> Dict[int, Dict[str, BraidTagValue]]:
+        """Get the tags associated with many records, using one query for
+        each IN_LIST_CHUNK_SIZE records.
+
+        :param record_ids: The ids of the BraidDB records to get the tags for
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: A dict mapping each record id which has tags to a dict of
+            string->BraidTagValue key->value pairs
+        """
+        tags = BraidTagsModel.__table__
+        keys = BraidTagKeyModel.__table__
+        tags_by_record: Dict[int, Dict[str, BraidTagValue]] = {}
+        for chunk in _chunks(dict.fromkeys(record_ids)):
+            rows = self.query_all(
+                select(
+                    tags.c.record_id,
+                    keys.c.key,
+                    tags.c.value,
+                    tags.c.tag_type,
+                    tags.c.value_int,
+                    tags.c.value_real,
+                )
+                .join_from(tags, keys, keys.c.id == tags.c.key_id)
+                .where(tags.c.record_id.in_(chunk))
+                .order_by(tags.c.id),
+                session=session,
+            )
+            for row in rows:
+                type_ = BraidTagType(row.tag_type)
+                value = BraidTagValue(_tag_value(row), type_)
+                tags_by_record.setdefault(row.record_id, {})[row.key] = value
+        return tags_by_record
+
+    def get_record_ids_by_tag(
+        self,
+        key: str,
+        value: Optional[TagValueType] = None,
+        *,
+        lt: Optional[TagValueType] = None,
+        le: Optional[TagValueType] = None,
+        gt: Optional[TagValueType] = None,
+        ge: Optional[TagValueType] = None,
+        in_: Optional[Iterable[TagValueType]] = None,
+        session: Optional[Session] = None,
+    ) -> List[int]:
+        """Get the ids of records having a tag whose value satisfies all of
+        the provided comparisons. For example, gt=0.01, lt=0.1 selects
+        records where the tag value is between 0.01 and 0.1. Numeric
+        comparisons apply to INTEGER and FLOAT tags and are performed in the
+        DB using an index.
+
+        :param key: The key of the tag to compare.
+
+        :param value: If provided, the tag value must be equal to this.
+
+        :param lt: If provided, the tag value must be less than this.
+
+        :param le: If provided, the tag value must be at most this.
+
+        :param gt: If provided, the tag value must be greater than this.
+
+        :param ge: If provided, the tag value must be at least this.
+
+        :param in_: If provided, the tag value must be one of these values.
+
+        :param session: An open SQLModel session object. If none is provided,
+            a temporary session will be created for only this database
+            operation.
+
+        :returns: The ids of the matching records.
+        """
+        conditions = _tag_conditions(value, lt, le, gt, ge, in_)
+        matches = _tag_filter(key, conditions).subquery()
+        return self.query_all(select(matches.c.record_id), session=session)
+
+    def record_query(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        *,
+        name: Optional[str] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        valid: Optional[bool] = None,
+        session: Optional[Session] = None,
+    ) -> Select:
+        """Build a single query selecting the BraidRecordModels which satisfy
+        all of the provided predicates.
+
+        Where more than one predicate can be looked up using an index, the
+        number of records matching each of them is estimated by counting up
+        to QUERY_ESTIMATE_LIMIT matching rows and the query is driven by the
+        most selective one. Records found this way are then checked against
+        the remaining predicates.
+
+        :param where: Maps tag keys to the value the tag must have. The value
+            may also be a list, tuple or set of allowed values, or a dict
+            mapping operators ("==", "<", "<=", ">", ">=" or "in") to
+            operands, e.g. {"lr": {">": 0.01, "<": 0.1}}. See
+            get_record_ids_by_tag() for how values are compared.
+
+        :param name: If provided, an SQL LIKE pattern the name of the record
+            must match, e.g. "train-%".
+
+        :param since: If provided, the record must have been created at or
+            after this time.
+
+        :param until: If provided, the record must have been created before
+            this time.
+
+        :param valid: If True, only records which have not been invalidated
+            are selected, and if False, only those which have been.
+
+        :param session: The session to run the estimates on. If None, a
+            temporary session is used.
+
+        :returns: A Select statement for BraidRecordModels.
+        """
+        tag_predicates = [
+            (key, _where_conditions(value))
+            for key, value in (where or {}).items()
+        ]
+        # Predicates on the records table and whether they can use an index
+        record_predicates: List[Tuple[Any, bool]] = []
+        if name is not None:
+            if "%" in name or "_" in name:
+                record_predicates.append(
+                    (BraidRecordModel.name.like(name), False)
+                )
+            else:
+                record_predicates.append((BraidRecordModel.name == name, True))
+        if since is not None:
+            record_predicates.append((BraidRecordModel.time >= since, True))
+        if until is not None:
+            record_predicates.append((BraidRecordModel.time < until, True))
+        if valid is not None:
+            invalidation_id = BraidRecordModel.invalidation_id
+            record_predicates.append(
+                (
+                    invalidation_id.is_(None)
+                    if valid
+                    else invalidation_id.is_not(None),
+                    False,
+                )
+            )
+
+        # Candidates for driving the query: each tag predicate and, as one
+        # candidate, the indexable predicates on the records table
+        candidates: Dict[int, Any] = {
+            index: _tag_filter(key, conditions)
+            for index, (key, conditions) in enumerate(tag_predicates)
+        }
+        indexed = [
+            clause for clause, uses_index in record_predicates if uses_index
+        ]
+        if len(indexed) > 0:
+            candidates[-1] = select(BraidRecordModel.record_id).where(*indexed)
+        driver = -1
+        if len(tag_predicates) > 0:
+            if len(candidates) > 1:
+                estimates = {
+                    index: self._estimate_count(matches, session)
+                    for index, matches in candidates.items()
+                }
+                driver = min(estimates, key=lambda index: estimates[index])
+            else:
+                driver = 0
+
+        stmt = select(BraidRecordModel)
+        if driver >= 0:
+            matches = candidates[driver].subquery()
+            stmt = stmt.join(
+                matches, matches.c.record_id == BraidRecordModel.record_id
+            )
+        for index, (key, conditions) in enumerate(tag_predicates):
+            if index != driver:
+                stmt = stmt.where(
+                    _tag_exists(key, conditions, BraidRecordModel.record_id)
+                )
+        for clause, _ in record_predicates:
+            stmt = stmt.where(clause)
+        return stmt
+
+    def _estimate_count(self, stmt, session: Optional[Session]) -> int:
+        """Internal method counting the rows returned by stmt, stopping at
+        QUERY_ESTIMATE_LIMIT.
+        """
+        capped = stmt.limit(QUERY_ESTIMATE_LIMIT).subquery()
+        return self.query_one_or_none(
+            select(func.count()).select_from(capped), session=session
         )
-        tags = {}
-        for tag_model in tag_models:
-            type_ = BraidTagType(tag_model.tag_type)
-            value = BraidTagValue(tag_model.value, type_)
-            tags[tag_model.key] = value
-        return tags
+
+    def dispatch_invalidation_action(
+        self,
+        action: PendingInvalidationAction,
+        session: Optional[Session] = None,
+    ) -> None:
+        """Run an invalidation action on the action_runner once the
+        invalidation which triggered it has been committed.
+
+        :param action: The action to run.
+
+        :param session: The session the invalidation was made on. The action
+            is held until this session commits and discarded if it rolls
+            back. If None, the invalidation has already been committed and
+            the action is submitted immediately.
+        """
+        if session is None and self._batch is not None:
+            session = self._batch.session
+        if session is None:
+            self.action_runner.submit(action)
+            return
+        if "braid_pending_actions" not in session.info:
+            event.listen(session, "after_commit", self._submit_pending_actions)
+            event.listen(
+                session, "after_transaction_end", self._discard_pending_actions
+            )
+        session.info.setdefault("braid_pending_actions", []).append(action)
+
+    def _submit_pending_actions(self, session: Session) -> None:
+        for action in session.info.pop("braid_pending_actions", []):
+            self.action_runner.submit(action)
+        session.info["braid_pending_actions"] = []
+
+    def _discard_pending_actions(self, session: Session, transaction) -> None:
+        # Actions still pending when the outermost transaction ends belong to
+        # invalidations which were rolled back (after a commit, the actions
+        # have already been submitted).
+        if transaction.parent is None and session.info.get(
+            "braid_pending_actions"
+        ):
+            self.logger.info(
+                "Discarding invalidation actions of rolled back transaction"
+            )
+            session.info["braid_pending_actions"] = []
+
+    def invalidation_action_results(
+        self, wait_for_all: bool = True
+    ) -> List[InvalidationActionResult]:
+        """Collect the results of invalidation actions which have been run.
+
+        :param wait_for_all: If True, wait for all dispatched actions to
+            complete. Actions held until their session commits are not
+            waited for.
+
+        :returns: The results not returned by a previous call.
+        """
+        return self.action_runner.results(wait_for_all=wait_for_all)
 
     def debug(self, msg):
         self.logger.debug(msg)
@@ -625,17 +3340,42 @@ class BraidRecord:
             the provided record_id is found in the DB.
         """
 
-        model_rec: BraidRecordModel = db.query_one_or_none(
-            select(BraidRecordModel).where(
-                BraidRecordModel.record_id == record_id
-            ),
-            session=session,
-        )
+        model_rec = db.get_record_model_by_id(record_id, session=session)
         if model_rec is not None:
             return cls.from_orm(model_rec, db=db)
         else:
             return None
 
+    @classmethod
+    def by_record_ids(
+        cls,
+        db: BraidDB,
+        record_ids: Iterable[int],
+        session: Optional[Session] = None,
+    ) -> List["BraidRecord"]:
+        """This method creates BraidRecords for many record ids at once. The
+        uris, tags, invalidation and invalidation action of the records are
+        loaded up front (see BraidDB.get_record_models_by_ids()).
+
+        :param db: The database object used when looking up or instantiating
+            the BraidRecords to return.
+
+        :param record_ids: The ids of the records to look up.
+
+        :param session: A session on the BraidDB to use when instantiating the
+            BraidRecords. The returned records will be associated with this
+            BraidDB.
+
+        :returns: The BraidRecords found in the database, in the order of
+            record_ids. Ids with no record in the DB are skipped.
+        """
+        return [
+            cls.from_orm(model_rec, db=db)
+            for model_rec in db.get_record_models_by_ids(
+                record_ids, session=session
+            )
+        ]
+
     @classmethod
     def for_tag_value(
         cls,
@@ -658,21 +3398,119 @@ class BraidRecord:
             BraidRecords. The returned records will be associated with this
             BraidDB.
 
-        :returns: A BraidRecord found in the database or None if no record with
-            the provided record_id is found in the DB. If no records are found
-            with the tag value, an empty list is returned.
+        :returns: The BraidRecords found in the database with the tag value.
         """
+        return cls.query(db, where={key: value}, session=session)
 
-        model_tags: Iterable[BraidTagsModel] = db.query_all(
-            select(BraidTagsModel).where(
-                BraidTagsModel.key == key
-                and BraidTagsModel.value == str(value)
-            ),
+    @classmethod
+    def query(
+        cls,
+        db: BraidDB,
+        where: Optional[Dict[str, Any]] = None,
+        *,
+        name: Optional[str] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None,
+        valid: Optional[bool] = None,
+        limit: Optional[int] = None,
+        batch_size: int = 1000,
+        session: Optional[Session] = None,
+    ) -> Iterator["BraidRecord"]:
+        """This method returns the BraidRecord objects satisfying all of the
+        provided predicates, which are combined into a single query. See
+        BraidDB.record_query() for the meaning of the predicates. For
+        example, to find valid records with a learning rate between 0.01 and
+        0.1 and a batch size of 32 or 64:
+
+            BraidRecord.query(
+                db,
+                where={"lr": {">": 0.01, "<": 0.1}, "batch": [32, 64]},
+                valid=True,
+            )
+
+        Records are read from the DB batch_size at a time as the returned
+        iterator is consumed, in no particular order. If no session is
+        provided, the temporary session used is closed once the iterator is
+        exhausted.
+
+        :param db: The database object used when looking up or instantiating
+            the BraidRecords to return.
+
+        :param limit: If provided, the maximum number of records to return.
+
+        :param batch_size: The number of records fetched from the DB at a
+            time.
+
+        :param session: A session on the BraidDB to use when instantiating the
+            BraidRecords. The returned records will be associated with this
+            BraidDB.
+
+        :returns: An iterator over the matching BraidRecords.
+        """
+        stmt = db.record_query(
+            where,
+            name=name,
+            since=since,
+            until=until,
+            valid=valid,
             session=session,
         )
-        return (
-            cls.from_orm(model_tag.record, db=db) for model_tag in model_tags
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        stmt = stmt.execution_options(yield_per=batch_size)
+        if session is None and db._batch is not None:
+            session = db._batch.session
+
+        def stream(session: Session) -> Iterator["BraidRecord"]:
+            for model_rec in session.exec(stmt):
+                yield cls.from_orm(model_rec, db=db)
+
+        if session is not None:
+            return stream(session)
+
+        def stream_own_session() -> Iterator["BraidRecord"]:
+            with db.get_session(expire_on_commit=False) as session:
+                yield from stream(session)
+
+        return stream_own_session()
+
+    @classmethod
+    def for_tag(
+        cls,
+        db: BraidDB,
+        key: str,
+        value: Optional[TagValueType] = None,
+        *,
+        lt: Optional[TagValueType] = None,
+        le: Optional[TagValueType] = None,
+        gt: Optional[TagValueType] = None,
+        ge: Optional[TagValueType] = None,
+        in_: Optional[Iterable[TagValueType]] = None,
+        session: Optional[Session] = None,
+    ) -> Iterator["BraidRecord"]:
+        """This method returns the BraidRecord objects which have a tag whose
+        value satisfies all of the provided comparisons. See
+        BraidDB.get_record_ids_by_tag() for the meaning of the comparisons.
+
+        :param db: The database object used when looking up or instantiating
+            the BraidRecords to return.
+
+        :param key: The key for the tag to be looked up.
+
+        :param session: A session on the BraidDB to use when instantiating the
+            BraidRecords. The returned records will be associated with this
+            BraidDB.
+
+        :returns: The matching BraidRecords.
+        """
+        conditions = _tag_conditions(value, lt, le, gt, ge, in_)
+        model_recs: Iterable[BraidRecordModel] = db.query_all(
+            select(BraidRecordModel).where(
+                BraidRecordModel.record_id.in_(_tag_filter(key, conditions))
+            ),
+            session=session,
         )
+        return (cls.from_orm(model_rec, db=db) for model_rec in model_recs)
 
     @classmethod
     def invalidate_by_tag_value(
@@ -714,7 +3552,7 @@ class BraidRecord:
     def record_id(self) -> Optional[int]:
         if self.model.record_id is None:
             if self.db is not None:
-                self.db.add_model(self.model)
+                self.db.flush_model(self.model)
         return self.model.record_id
 
     def add_derivation(
@@ -737,10 +3575,12 @@ class BraidRecord:
         """
         self.derivations.append(record)
         dep_model = BraidDerivationModel(
-            record_id=self.record_id, derivation=record.model.record_id
+            record_id=self.record_id, derivation=record.record_id
         )
         if self.db is not None:
             dep_model = self.db.add_model(dep_model, session=session)
+            for record_id in (self.record_id, record.record_id):
+                self.db.evict_cached_record(record_id, session=session)
         return dep_model
 
     def add_uri(
@@ -774,16 +3614,18 @@ class BraidRecord:
         self,
         key,
         value,
-        type_=BraidTagType.STRING,
+        type_: Optional[BraidTagType] = None,
         session: Optional[Session] = None,
     ) -> int:
         """Add a key/value tag to this BraidRecord.
 
         :param key:   a string key name
 
-        :param value: a string value
+        :param value: the value, a string or number
 
         :param type_: The data type of the tag as defined by the BraidTagType.
+            If None, it is determined from the python type of value, so that
+            int and float values can be compared numerically in queries.
 
         :param session: A session on the BraidDB to use when persisting this
             operation. If not provided, a one-time session will be created to
@@ -791,6 +3633,8 @@ class BraidRecord:
 
         :returns: The tag ID.
         """
+        if type_ is None:
+            type_ = BraidTagType.type_for_value(value)
         if not isinstance(type_, BraidTagType):
             raise Exception(
                 "type must be a BraidTagType! "
@@ -800,11 +3644,13 @@ class BraidRecord:
         tag_model = BraidTagsModel(
             record_id=self.record_id,
             key=key,
-            value=value,
+            value=str(value),
             tag_type=type_.value,
+            **_typed_tag_columns(value, type_),
         )
         if self.db is not None:
             self.db.add_model(tag_model, session=session)
+            self.db.evict_cached_record(self.record_id, session=session)
         return tag_model.id
 
     def tags_as_dict(
@@ -817,7 +3663,8 @@ class BraidRecord:
             persist this object.
 
         :returns: Dictionary containing the tags associated with this
-            BraidRecord.
+            BraidRecord. Values of INTEGER and FLOAT tags are returned as int
+            and float respectively.
         """
         tags: Iterable[BraidTagsModel] = self.db.query_all(
             select(BraidTagsModel).where(
@@ -827,11 +3674,7 @@ class BraidRecord:
         )
         ret_dict: Dict[str, TagValueType] = {}
         for tag in tags:
-            key = tag.key
-            value = tag.value
-            # tag_type = tag.tag_type
-            # TODO: Use tag_type to coerce value to the proper python type
-            ret_dict[key] = value
+            ret_dict[tag.key] = _tag_value(tag)
 
         return ret_dict
 
@@ -866,6 +3709,7 @@ class BraidRecord:
         )
         if ia is not None:
             self.model.invalidation_action = ia
+            self.db.evict_cached_record(self.record_id, session=session)
         return ia
 
     def add_invalidation_action(
@@ -911,6 +3755,7 @@ class BraidRecord:
         self.model.invalidation_action = invalidation_action
         if self.db is not None:
             self.db.add_model(invalidation_action, session=session)
+            self.db.evict_cached_record(self.record_id, session=session)
         return invalidation_action
 
     def invalidate(
@@ -936,7 +3781,7 @@ class BraidRecord:
             derived from this record will also be marked as invalid. When these
             derived records are marked invalid, the invalidation of this record
             will be marked as the root cause of the derived record's
-            invalidation.
+            invalidation. See BraidDB.invalidate_descendants().
 
         :param perform_invalidation_action: A boolean flag indicating whether
             the invalidation action associated with this record (if any) should
@@ -964,30 +3809,85 @@ class BraidRecord:
         invalid_model = BraidInvalidationModel(cause=cause)
         if root_invalidation is not None:
             invalid_model.root_invalidation = UUID(str(root_invalidation))
-        if self.db is not None:
+        if self.db is None:
+            if perform_invalidation_action:
+                self.perform_invalidation_action(session=session)
+            return self
+        # The invalidations of the record and its descendants and the
+        # dispatch of their actions share one session, so the actions are run
+        # once all of them are committed
+        with self.db._session_scope(session) as session:
             self.db.add_model(invalid_model, session=session)
             self.model.invalidation = invalid_model
+            if object_session(self.model) is not session:
+                # The model was loaded on another session, so assigning the
+                # invalidation does not write it
+                records = BraidRecordModel.__table__
+                session.execute(
+                    update(records)
+                    .where(records.c.record_id == self.record_id)
+                    .values(invalidation_id=invalid_model.id)
+                )
+            self.db.evict_cached_record(self.record_id, session=session)
             if cascade:
-                derivations = self.db.get_derivations(
-                    self.model.record_id, session=session
+                invalidated = self.db.invalidate_descendants(
+                    self.model.record_id,
+                    cause,
+                    root_invalidation=invalid_model.id,
+                    session=session,
                 )
-                for derivation in derivations:
-                    dep_rec = BraidRecord.from_orm(derivation, db=self.db)
-                    dep_rec.invalidate(
-                        cause=cause,
-                        root_invalidation=invalid_model.id,
-                        cascade=cascade,
-                        perform_invalidation_action=(
-                            perform_invalidation_action_on_cascade
-                        ),
-                        perform_invalidation_action_on_cascade=(
-                            perform_invalidation_action_on_cascade
-                        ),
-                        session=session,
+                if perform_invalidation_action_on_cascade:
+                    # Only the invalidated records with an action are loaded
+                    has_action = (
+                        BraidRecordModel.invalidation_action_id.is_not(None)
                     )
-        self.perform_invalidation_action(session=session)
+                    for chunk in _chunks(invalidated):
+                        dep_models: Iterable[
+                            BraidRecordModel
+                        ] = self.db.query_all(
+                            select(BraidRecordModel)
+                            .where(BraidRecordModel.record_id.in_(chunk))
+                            .where(has_action)
+                            .options(
+                                selectinload(
+                                    BraidRecordModel.invalidation_action
+                                )
+                            ),
+                            session=session,
+                        )
+                        for dep_model in dep_models:
+                            dep_rec = BraidRecord.from_orm(dep_model, self.db)
+                            dep_rec.perform_invalidation_action(
+                                session=session
+                            )
+            if perform_invalidation_action:
+                self.perform_invalidation_action(session=session)
         return self
 
+    def invalidation_impact(
+        self,
+        cascade=True,
+        perform_invalidation_action=True,
+        perform_invalidation_action_on_cascade=True,
+        session: Optional[Session] = None,
+    ) -> InvalidationImpact:
+        """Report what calling invalidate() with the same arguments would do,
+        without changing the DB. See BraidDB.invalidation_impact().
+
+        :returns: An InvalidationImpact with the number of records which would
+            be invalidated, their depth histogram and the invalidation actions
+            which would be performed.
+        """
+        return self.db.invalidation_impact(
+            self.record_id,
+            cascade=cascade,
+            perform_invalidation_action=perform_invalidation_action,
+            perform_invalidation_action_on_cascade=(
+                perform_invalidation_action_on_cascade
+            ),
+            session=session,
+        )
+
     def perform_invalidation_action(
         self, session: Optional[Session] = None
     ) -> None:
@@ -995,41 +3895,46 @@ class BraidRecord:
         BraidRecord. Typically, this method is not invoked directly but rather
         is called internally as a result of the invalidate method.
 
+        The values of the record's tags, name and uri are substituted into the
+        action's command and parameters immediately, but the action is run on
+        the BraidDB's action_runner only once the session has been committed.
+        Results are collected with BraidDB.invalidation_action_results().
+
         :param session: A session on the BraidDB to use when persisting this
             operation. If not provided, a one-time session will be created to
             persist this object.
         """
         invalidation_action = self.model.invalidation_action
-        if invalidation_action is None:
+        if invalidation_action is None or self.db is None:
             return
 
-        return
-
-        substitution_vals = self.tags_as_dict(session)
+        substitution_vals: Dict[str, Any] = self.tags_as_dict(session)
         substitution_vals["name"] = self.model.name
-        substitution_vals["uri"] = self.model.uri
-
-        cmd = substitute_vals(invalidation_action.cmd, substitution_vals)
-        params = substitute_vals(invalidation_action.params, substitution_vals)
-
-        if (
-            invalidation_action.action_type
-            is InvalidationActionType.SHELL_COMMAND
-        ):
-            cmd_line = [cmd]
-            cmd_line.extend(params.get("args", []))
-            action_run = subprocess.run(cmd_line)
-            self.debug(
-                f"Return of command {cmd} {params} was: "
-                f"{action_run.returncode}"
+        uri_table, prefixes, uri = _uri_columns()
+        uris = self.db.query_all(
+            select(uri)
+            .join_from(
+                uri_table, prefixes, prefixes.c.id == uri_table.c.prefix_id
             )
-        elif (
-            invalidation_action.action_type
-            is InvalidationActionType.AUTOMATE_EVENT
-        ):
-            ...
-        else:
-            ...
+            .where(uri_table.c.record_id == self.record_id)
+            .order_by(uri_table.c.id)
+            .limit(1),
+            session=session,
+        )
+        substitution_vals["uri"] = uris[0] if len(uris) > 0 else ""
+
+        action = PendingInvalidationAction(
+            record_id=self.record_id,
+            action_id=invalidation_action.id,
+            name=invalidation_action.name,
+            action_type=invalidation_action.action_type,
+            cmd=substitute_vals(invalidation_action.cmd, substitution_vals),
+            params=substitute_vals(
+                invalidation_action.params, substitution_vals
+            ),
+        )
+        self.debug(f"Dispatching {action}")
+        self.db.dispatch_invalidation_action(action, session=session)
 
     def is_valid(self, session: Optional[Session] = None) -> bool:
         """Return whether the record is valid or has been marked as invalid.
@@ -1,3 +1,58 @@
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from braid_db import BraidDB
+
+# The BraidDBs opened by get_worker_db() in this worker process, so that
+# their record caches are kept across invocations of the entry points
+_worker_dbs: Dict[
+    Tuple[str, str, Optional[int], Optional[float]], "BraidDB"
+] = {}
+_worker_dbs_lock = threading.Lock()
+
+
+def get_worker_db(
+    db_file: str,
+    sqlite_profile: str = "performance",
+    record_cache_size: Optional[int] = None,
+    record_cache_ttl: Optional[float] = None,
+) -> "BraidDB":
+    """Get the BraidDB for a DB file, creating it and its tables the first
+    time it is asked for in this process and reusing it afterwards. Records
+    looked up by one invocation, such as the predecessors of a step, are then
+    found in the record cache by the next, until they expire after
+    record_cache_ttl seconds, so that changes made by other workers, such as
+    invalidations, are seen.
+
+    :param db_file: The DB file.
+
+    :param sqlite_profile: The PRAGMA profile the BraidDB is created with.
+
+    :param record_cache_size: The size of the BraidDB's record cache, if any.
+
+    :param record_cache_ttl: The seconds records stay in the cache, if they
+        are to expire.
+
+    :returns: The BraidDB shared by all callers with the same arguments.
+    """
+    from braid_db import BraidDB
+
+    key = (db_file, sqlite_profile, record_cache_size, record_cache_ttl)
+    with _worker_dbs_lock:
+        db = _worker_dbs.get(key)
+        if db is None:
+            db = BraidDB(
+                db_file,
+                sqlite_profile=sqlite_profile,
+                record_cache_size=record_cache_size,
+                record_cache_ttl=record_cache_ttl,
+            )
+            db.create()
+            _worker_dbs[key] = db
+        return db
+
+
 def add_transfer_request(
     previous_step_record_id=None,
     transfer_input={},
@@ -13,7 +68,8 @@ def add_transfer_request(
 
     db_file = os.getenv("BRAID_DB_FILE", os.path.expanduser(DEFAULT_DB_FILE))
 
-    DB = BraidDB(db_file)
+    sqlite_profile = os.getenv("BRAID_SQLITE_PROFILE", "performance")
+    DB = BraidDB(db_file, sqlite_profile=sqlite_profile)
     DB.create()
     session = DB.get_session()
 
@@ -96,7 +152,8 @@ def add_record_for_action_step(
     import logging
     import os
 
-    from braid_db import BraidDB, BraidRecord
+    from braid_db import BraidRecord
+    from braid_db.globus_compute.entry_points import get_worker_db
     from braid_db.models import BraidDerivationModel
 
     DEFAULT_LOG_FILE = "~/globus-compute-braid.log"
@@ -123,8 +180,15 @@ def add_record_for_action_step(
 
     db_file = os.getenv("BRAID_DB_FILE", os.path.expanduser(DEFAULT_DB_FILE))
 
-    DB = BraidDB(db_file)
-    DB.create()
+    sqlite_profile = os.getenv("BRAID_SQLITE_PROFILE", "performance")
+    # The same predecessor records are looked up by step after step, so the
+    # BraidDB and its record cache are kept for the life of the worker.
+    # Cached records expire so that invalidations by others are seen.
+    record_cache_size = int(os.getenv("BRAID_RECORD_CACHE_SIZE", "10000"))
+    record_cache_ttl = float(os.getenv("BRAID_RECORD_CACHE_TTL", "30"))
+    DB = get_worker_db(
+        db_file, sqlite_profile, record_cache_size, record_cache_ttl
+    )
     session = DB.get_session()
 
     ############################
@@ -383,7 +447,8 @@ def create_invalidation_action(
 
     db_file = os.getenv("BRAID_DB_FILE", os.path.expanduser(DEFAULT_DB_FILE))
 
-    DB = BraidDB(db_file)
+    sqlite_profile = os.getenv("BRAID_SQLITE_PROFILE", "performance")
+    DB = BraidDB(db_file, sqlite_profile=sqlite_profile)
     DB.create()
     session = DB.get_session()
 
@@ -418,7 +483,8 @@ def add_invalidation_action_to_record(
 
     DB_FILE = "~/globus-compute-braid.db"
 
-    DB = BraidDB(os.path.expanduser(DB_FILE))
+    sqlite_profile = os.getenv("BRAID_SQLITE_PROFILE", "performance")
+    DB = BraidDB(os.path.expanduser(DB_FILE), sqlite_profile=sqlite_profile)
     session = DB.get_session()
 
     # If the input is a dict, we will assume we were provided the
@@ -474,7 +540,8 @@ def add_records(record_dicts, *args, **kwargs) -> list:
 
     db_file = os.getenv("BRAID_DB_FILE", os.path.expanduser(DEFAULT_DB_FILE))
 
-    DB = BraidDB(db_file)
+    sqlite_profile = os.getenv("BRAID_SQLITE_PROFILE", "performance")
+    DB = BraidDB(db_file, sqlite_profile=sqlite_profile)
     DB.create()
     session = DB.get_session()
 
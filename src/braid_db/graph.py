@@ -0,0 +1,290 @@
+# GRAPH
+# An in-memory snapshot of the derivation graph for analytics
+
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+class BraidGraphSnapshot:
+    """The derivation graph of a BraidDB at one point in time, held in
+    compressed sparse row (CSR) arrays. Nodes are numbered 0..n-1 in order of
+    record id, record_ids[i] being the record id of node i. The derivations
+    of node i are fwd_indices[fwd_indptr[i]:fwd_indptr[i + 1]] and the
+    records it was derived from are rev_indices[rev_indptr[i]:rev_indptr[i +
+    1]].
+
+    A snapshot uses about 8 bytes per edge plus 24 bytes per record, and does
+    not change when the DB does. Create one with BraidDB.graph_snapshot().
+    """
+
+    def __init__(self, record_ids: np.ndarray, edges: np.ndarray):
+        """Build the CSR arrays.
+
+        :param record_ids: The sorted, unique ids of all records in the
+            graph.
+
+        :param edges: An (m, 2) array of (record_id, derivation) pairs. Both
+            ids of each pair must be present in record_ids.
+        """
+        self.record_ids = record_ids
+        n = len(record_ids)
+        index_type = np.int32 if n < np.iinfo(np.int32).max else np.int64
+        src = _to_index(record_ids, edges[:, 0], index_type)
+        dst = _to_index(record_ids, edges[:, 1], index_type)
+        self.fwd_indptr, self.fwd_indices = _csr(src, dst, n)
+        self.rev_indptr, self.rev_indices = _csr(dst, src, n)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.record_ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.fwd_indices)
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the arrays of the snapshot."""
+        return sum(
+            a.nbytes
+            for a in (
+                self.record_ids,
+                self.fwd_indptr,
+                self.fwd_indices,
+                self.rev_indptr,
+                self.rev_indices,
+            )
+        )
+
+    def index_of(self, record_ids) -> np.ndarray:
+        """Map record ids to node indices.
+
+        :param record_ids: A record id or an array of record ids.
+
+        :returns: The node index or array of node indices.
+
+        :raises ValueError: If any of the record ids is not in the snapshot.
+        """
+        ids = np.asarray(record_ids, dtype=np.int64)
+        index = np.searchsorted(self.record_ids, ids)
+        found = np.atleast_1d(index < self.node_count)
+        flat_ids, flat_index = np.atleast_1d(ids), np.atleast_1d(index)
+        found[found] = self.record_ids[flat_index[found]] == flat_ids[found]
+        if not np.all(found):
+            missing = flat_ids[~found]
+            raise ValueError(f"Records not in graph snapshot: {missing[:10]}")
+        return index
+
+    def _adjacency(self, descendants: bool) -> Tuple[np.ndarray, np.ndarray]:
+        if descendants:
+            return self.fwd_indptr, self.fwd_indices
+        return self.rev_indptr, self.rev_indices
+
+    def bfs(
+        self,
+        record_ids,
+        descendants: bool = True,
+        max_depth: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Breadth-first search from one or more records, expanding a whole
+        level of the search with each step.
+
+        :param record_ids: The record id or ids to start from. These are
+            reached at depth 0.
+
+        :param descendants: If True, follow derivations. Otherwise follow
+            them in reverse to find ancestors.
+
+        :param max_depth: If provided, stop after this many levels.
+
+        :returns: Arrays of the record ids reached and the depth at which
+            each was first reached, ordered by depth and then record id.
+        """
+        indptr, indices = self._adjacency(descendants)
+        depth = np.full(self.node_count, -1, dtype=np.int32)
+        frontier = np.unique(self.index_of(np.atleast_1d(record_ids)))
+        level = 0
+        depth[frontier] = level
+        while len(frontier) > 0 and (max_depth is None or level < max_depth):
+            neighbours = _gather(indptr, indices, frontier)
+            frontier = np.unique(neighbours[depth[neighbours] < 0])
+            level += 1
+            depth[frontier] = level
+        reached = np.flatnonzero(depth >= 0)
+        order = np.argsort(depth[reached], kind="stable")
+        reached = reached[order]
+        return self.record_ids[reached], depth[reached]
+
+    def descendants(
+        self, record_id: int, max_depth: Optional[int] = None
+    ) -> Dict[int, int]:
+        """Get the records derived, directly or indirectly, from a record.
+
+        :returns: A dict from record id to its depth below record_id. The
+            record itself is not included.
+        """
+        return self._lineage(record_id, True, max_depth)
+
+    def ancestors(
+        self, record_id: int, max_depth: Optional[int] = None
+    ) -> Dict[int, int]:
+        """Get the records a record was derived from, directly or
+        indirectly.
+
+        :returns: A dict from record id to its depth above record_id. The
+            record itself is not included.
+        """
+        return self._lineage(record_id, False, max_depth)
+
+    def _lineage(
+        self, record_id: int, descendants: bool, max_depth: Optional[int]
+    ) -> Dict[int, int]:
+        ids, depths = self.bfs(record_id, descendants, max_depth)
+        return dict(zip(ids[1:].tolist(), depths[1:].tolist()))
+
+    def reachable(self, src: int, dst: int) -> bool:
+        """Whether dst was derived, directly or indirectly, from src. A
+        record is reachable from itself.
+        """
+        indptr, indices = self.fwd_indptr, self.fwd_indices
+        target = int(self.index_of(dst))
+        visited = np.zeros(self.node_count, dtype=bool)
+        frontier = np.atleast_1d(self.index_of(src))
+        visited[frontier] = True
+        while len(frontier) > 0:
+            if visited[target]:
+                return True
+            neighbours = _gather(indptr, indices, frontier)
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+        return bool(visited[target])
+
+    def out_degrees(self) -> np.ndarray:
+        """The number of derivations of each node."""
+        return np.diff(self.fwd_indptr)
+
+    def in_degrees(self) -> np.ndarray:
+        """The number of records each node was derived from."""
+        return np.diff(self.rev_indptr)
+
+    def degree_stats(self) -> Dict[str, Dict[str, float]]:
+        """Summarize the in and out degrees of the nodes.
+
+        :returns: For each of "in" and "out", a dict of the min, max, mean
+            and median degree and the number of nodes with degree 0.
+        """
+        stats = {}
+        for name, degrees in (
+            ("in", self.in_degrees()),
+            ("out", self.out_degrees()),
+        ):
+            if len(degrees) == 0:
+                degrees = np.zeros(1, dtype=np.int64)
+            stats[name] = {
+                "min": int(degrees.min()),
+                "max": int(degrees.max()),
+                "mean": float(degrees.mean()),
+                "median": float(np.median(degrees)),
+                "zero": int(np.count_nonzero(degrees == 0)),
+            }
+        return stats
+
+    def connected_components(self) -> np.ndarray:
+        """Label the weakly connected components of the graph, that is,
+        ignoring the direction of derivations.
+
+        :returns: An array giving, for each node, the smallest node index in
+            its component. Map these through record_ids to get the smallest
+            record id in each component.
+        """
+        n = self.node_count
+        labels = np.arange(n, dtype=self.fwd_indices.dtype)
+        src = np.repeat(labels, np.diff(self.fwd_indptr))
+        dst = self.fwd_indices
+        while True:
+            # Hook each edge's endpoints to the smaller of their labels, then
+            # shortcut label chains so each node points directly at a root
+            previous = labels.copy()
+            smaller = np.minimum(labels[src], labels[dst])
+            np.minimum.at(labels, labels[src], smaller)
+            np.minimum.at(labels, labels[dst], smaller)
+            while True:
+                jumped = labels[labels]
+                if np.array_equal(jumped, labels):
+                    break
+                labels = jumped
+            if np.array_equal(labels, previous):
+                return labels
+
+    def component_count(self) -> int:
+        """The number of weakly connected components."""
+        labels = self.connected_components()
+        return int(np.count_nonzero(labels == np.arange(len(labels))))
+
+
+def _to_index(
+    record_ids: np.ndarray, ids: np.ndarray, index_type: type
+) -> np.ndarray:
+    """Internal helper mapping record ids known to be in the sorted array
+    record_ids to their positions in it.
+    """
+    if len(record_ids) == 0:
+        return np.zeros(len(ids), dtype=index_type)
+    low, high = int(record_ids[0]), int(record_ids[-1])
+    if high - low < 4 * len(record_ids) + 1024:
+        # Record ids are mostly dense, so a direct lookup table is small and
+        # much faster than a binary search per id
+        lookup = np.zeros(high - low + 1, dtype=index_type)
+        lookup[record_ids - low] = np.arange(len(record_ids))
+        return lookup[ids - low]
+    return np.searchsorted(record_ids, ids).astype(index_type)
+
+
+def _csr(
+    rows: np.ndarray, cols: np.ndarray, n: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Internal helper building the indptr and indices arrays of a CSR
+    matrix from the row and column of each entry. Entries within a row keep
+    the order they were given in.
+    """
+    # A stable sort of integers is a radix sort, linear in the entries
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order]
+
+
+def _gather(
+    indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray
+) -> np.ndarray:
+    """Internal helper concatenating the neighbour lists of a set of nodes
+    without a Python loop over the nodes.
+    """
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return indices[:0]
+    # The position within indices of each neighbour: the start of its
+    # node's list plus its offset within that list
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return indices[np.repeat(starts, counts) + offsets]
+
+
+def from_chunks(
+    record_id_chunks: Iterable[np.ndarray], edge_chunks: Iterable[np.ndarray]
+) -> BraidGraphSnapshot:
+    """Build a snapshot from chunks of record ids and (record_id, derivation)
+    edges as read from the DB. Records referred to only by an edge are
+    included too.
+    """
+    edge_list = [chunk for chunk in edge_chunks if len(chunk) > 0]
+    if edge_list:
+        edges = np.concatenate(edge_list)
+    else:
+        edges = np.zeros((0, 2), dtype=np.int64)
+    id_list = [chunk for chunk in record_id_chunks]
+    id_list.append(edges.ravel())
+    record_ids = np.unique(np.concatenate(id_list).astype(np.int64))
+    return BraidGraphSnapshot(record_ids, edges)
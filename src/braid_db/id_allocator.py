@@ -0,0 +1,152 @@
+# ID ALLOCATOR
+
+import threading
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from sqlalchemy import (
+    case,
+    event,
+    exists,
+    func,
+    insert,
+    literal,
+    select,
+    update,
+)
+from sqlmodel import Session
+
+from .models import BraidIdBlockModel, BraidRecordModel
+
+if TYPE_CHECKING:
+    from .braid_db import BraidDB
+
+
+class BraidIdAllocator:
+    """Hands out record ids from blocks reserved in the id_blocks table, so
+    that ids for new records are known without first inserting the record
+    into the DB. Each process (or MPI rank) using a BraidDB with an allocator
+    reserves its own blocks, so ids handed out by different processes never
+    overlap.
+
+    A block always starts after the largest record id already present, so
+    allocation is safe on a DB which already contains records. However, all
+    processes writing new records to the DB should use an allocator: a
+    process which does not will have its record ids assigned by the DB and
+    these may fall within a block reserved by another process.
+    """
+
+    def __init__(
+        self,
+        db: "BraidDB",
+        block_size: int = 1000,
+        name: str = BraidRecordModel.__tablename__,
+    ):
+        """Create an allocator for a BraidDB.
+
+        :param db: The BraidDB the ids are allocated for.
+
+        :param block_size: The number of ids to reserve each time the current
+            block is exhausted.
+
+        :param name: The name of the counter in the id_blocks table.
+        """
+        if block_size < 1:
+            raise ValueError(f"block_size must be positive, not {block_size}")
+        self.db = db
+        self.block_size = block_size
+        self.name = name
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self, session: Optional[Session] = None) -> int:
+        """Return the next unused record id, reserving a new block if needed.
+
+        :param session: The session to reserve a new block on. This should be
+            the session the caller is writing to, if any, so that the
+            reservation does not wait on the caller's own write lock. If None,
+            the reservation is made and committed in a separate session.
+
+        :returns: A record id which no other allocator will hand out.
+        """
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(self.block_size, session)
+            record_id = self._next
+            self._next += 1
+            return record_id
+
+    def reserve(self, count: int, session: Optional[Session] = None) -> int:
+        """Reserve count consecutive record ids. The ids come from the current
+        block if it has room, otherwise a block of exactly count ids is
+        reserved and the current block is kept for later calls to next_id().
+
+        :param count: The number of ids needed.
+
+        :param session: As for next_id().
+
+        :returns: The first of the count reserved ids.
+        """
+        with self._lock:
+            if self._end - self._next >= count:
+                start = self._next
+                self._next += count
+                return start
+            start, _ = self._reserve(count, session)
+            return start
+
+    def reset(self) -> None:
+        """Discard the remainder of the current block. The next id will come
+        from a newly reserved block.
+        """
+        with self._lock:
+            self._next = self._end = 0
+
+    def _reserve(
+        self, count: int, session: Optional[Session]
+    ) -> Tuple[int, int]:
+        """Internal method advancing the counter in the id_blocks table by
+        count and returning the (start, end) range of the reserved ids. The
+        counter is advanced with a single UPDATE so that concurrent
+        reservations are serialized by the DB.
+        """
+        if session is None:
+            with self.db.get_session() as own_session:
+                reserved = self._reserve(count, own_session)
+                own_session.commit()
+                return reserved
+
+        table = BraidIdBlockModel.__table__
+        counter = select(table.c.next_id).where(table.c.name == self.name)
+        if session.execute(counter).one_or_none() is None:
+            session.execute(
+                insert(table).from_select(
+                    ["name", "next_id"],
+                    select(literal(self.name), literal(1)).where(
+                        ~exists(counter)
+                    ),
+                )
+            )
+
+        first_free = select(
+            func.coalesce(func.max(BraidRecordModel.record_id), 0) + 1
+        ).scalar_subquery()
+        session.execute(
+            update(table)
+            .where(table.c.name == self.name)
+            .values(
+                next_id=case(
+                    (table.c.next_id > first_free, table.c.next_id),
+                    else_=first_free,
+                )
+                + count
+            )
+        )
+        end = session.execute(counter).scalar_one()
+        # If the caller's transaction is rolled back, so is the reservation,
+        # so the block must not be used any further.
+        event.listen(session, "after_rollback", self._on_rollback, once=True)
+        return end - count, end
+
+    def _on_rollback(self, session: Session) -> None:
+        self._next = self._end = 0
@@ -0,0 +1,229 @@
+# JSONL TRANSFER
+# Stream the contents of a BraidDB to and from JSON Lines
+
+import datetime
+import json
+from itertools import islice
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+
+from sqlalchemy import insert, select
+
+from .braid_db import BraidDB, BraidTagType, BraidTagValue
+from .models import BraidDerivationModel, BraidInvalidationModel
+
+# Each line of a JSONL export is one entry: an invalidation or a record.
+# All invalidations come first, ordered by time, so that each is imported
+# before the invalidations and records referring to it:
+#
+# {"type": "invalidation", "id": "<uuid>", "root_invalidation": "<uuid>",
+#  "cause": "...", "time": "<iso time>"}
+#
+# Records follow in order of id. Ids are those of the exporting DB, and
+# predecessors are the ids of the records each record is derived from:
+#
+# {"type": "record", "record_id": 1, "name": "...", "time": "<iso time>",
+#  "invalidation_id": "<uuid>", "uris": ["..."],
+#  "tags": {"key": {"value": 1, "type": "INTEGER"}}, "predecessors": [0]}
+
+
+def _uuid_str(value: Optional[UUID]) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _uuid(value: Optional[str]) -> Optional[UUID]:
+    return None if value is None else UUID(value)
+
+
+def export_entries(db: BraidDB, chunk_size: int = 1000) -> Iterator[dict]:
+    """Generate the entries of a JSONL export of a DB. Records are read a
+    chunk at a time, each chunk with its URIs, tags and derivations in one
+    transaction, so only one chunk is held in memory.
+
+    :param db: The DB to export.
+
+    :param chunk_size: The number of records read at a time.
+
+    :returns: An iterator over the entries, as dicts ready for json.dumps().
+    """
+    invalidations = BraidInvalidationModel.__table__
+    with db.get_session() as session:
+        result = session.execute(
+            select(invalidations)
+            .order_by(invalidations.c.time)
+            .execution_options(stream_results=True)
+        )
+        for rows in result.partitions(chunk_size):
+            for row in rows:
+                yield {
+                    "type": "invalidation",
+                    "id": _uuid_str(row.id),
+                    "root_invalidation": _uuid_str(row.root_invalidation),
+                    "cause": row.cause,
+                    "time": row.time.isoformat(),
+                }
+
+    derivations = BraidDerivationModel.__table__
+    last_id = None
+    while True:
+        with db.get_session() as session:
+            records = next(
+                db.iter_record_batches(
+                    chunk_size, after_id=last_id, session=session
+                ),
+                [],
+            )
+            record_ids = [record.record_id for record in records]
+            uris = db.get_uris_bulk(record_ids, session=session)
+            tags = db.get_tags_bulk(record_ids, session=session)
+            predecessors: Dict[int, List[int]] = {}
+            if record_ids:
+                rows = session.execute(
+                    select(derivations.c.record_id, derivations.c.derivation)
+                    .where(derivations.c.derivation.in_(record_ids))
+                    .order_by(derivations.c.record_id)
+                )
+                for record_id, derivation in rows:
+                    predecessors.setdefault(derivation, []).append(record_id)
+        for record in records:
+            record_tags = tags.get(record.record_id, {})
+            yield {
+                "type": "record",
+                "record_id": record.record_id,
+                "name": record.name,
+                "time": record.time.isoformat(),
+                "invalidation_id": _uuid_str(record.invalidation_id),
+                "uris": uris.get(record.record_id, []),
+                "tags": {
+                    key: {"value": tag.value, "type": tag.type_.name}
+                    for key, tag in record_tags.items()
+                },
+                "predecessors": predecessors.get(record.record_id, []),
+            }
+        if len(records) < chunk_size:
+            return
+        last_id = records[-1].record_id
+
+
+def import_entries(
+    db: BraidDB, entries: Iterable[dict], chunk_size: int = 1000
+) -> Dict[str, int]:
+    """Add the entries of a JSONL export to a DB, which need not be empty.
+    Each chunk of entries is added in its own transaction, records through
+    BraidDB.add_records_bulk(). Records are given new ids, and their
+    derivations are mapped to the new ids, including derivations from
+    records further on in the entries. Invalidations keep their ids and are
+    skipped if already in the DB.
+
+    :param db: The DB to add the entries to.
+
+    :param entries: The entries, as given by export_entries().
+
+    :param chunk_size: The number of entries added in each transaction.
+
+    :returns: The number of invalidations and records added, and of
+        derivations which were not added because the record derived from
+        was not among the entries.
+    """
+    invalidations = BraidInvalidationModel.__table__
+    # The new id of each record added, by its id in the entries
+    new_ids: Dict[int, int] = {}
+    # The new ids of the records derived from a record not yet added, by the
+    # id in the entries of that record
+    waiting: Dict[int, List[int]] = {}
+    counts = {"invalidations": 0, "records": 0}
+    entries = iter(entries)
+    while True:
+        chunk = list(islice(entries, chunk_size))
+        if not chunk:
+            break
+        records = [e for e in chunk if e["type"] == "record"]
+        invalidation_rows = [
+            {
+                "id": UUID(e["id"]),
+                "root_invalidation": _uuid(e["root_invalidation"]),
+                "cause": e["cause"],
+                "time": datetime.datetime.fromisoformat(e["time"]),
+            }
+            for e in chunk
+            if e["type"] == "invalidation"
+        ]
+        with db.get_session() as session:
+            if invalidation_rows:
+                existing = set(
+                    session.execute(
+                        select(invalidations.c.id).where(
+                            invalidations.c.id.in_(
+                                [row["id"] for row in invalidation_rows]
+                            )
+                        )
+                    ).scalars()
+                )
+                invalidation_rows = [
+                    row
+                    for row in invalidation_rows
+                    if row["id"] not in existing
+                ]
+            if invalidation_rows:
+                session.execute(insert(invalidations), invalidation_rows)
+
+            positions = {e["record_id"]: i for i, e in enumerate(records)}
+            bulk: List[Dict[str, Any]] = []
+            for entry in records:
+                predecessors, batch_predecessors = [], []
+                for old_id in entry["predecessors"]:
+                    if old_id in positions:
+                        batch_predecessors.append(positions[old_id])
+                    elif old_id in new_ids:
+                        predecessors.append(new_ids[old_id])
+                bulk.append(
+                    {
+                        "name": entry["name"],
+                        "time": datetime.datetime.fromisoformat(entry["time"]),
+                        "invalidation_id": _uuid(entry["invalidation_id"]),
+                        "uris": entry["uris"],
+                        "tags": {
+                            key: BraidTagValue(
+                                tag["value"], BraidTagType[tag["type"]]
+                            )
+                            for key, tag in entry["tags"].items()
+                        },
+                        "predecessors": predecessors,
+                        "batch_predecessors": batch_predecessors,
+                        "derivations": waiting.pop(entry["record_id"], []),
+                    }
+                )
+            added = db.add_records_bulk(bulk, session=session)
+            session.commit()
+
+        for entry, record_id in zip(records, added):
+            new_ids[entry["record_id"]] = record_id
+        for entry, record_id in zip(records, added):
+            for old_id in entry["predecessors"]:
+                if old_id not in new_ids:
+                    waiting.setdefault(old_id, []).append(record_id)
+        counts["invalidations"] += len(invalidation_rows)
+        counts["records"] += len(added)
+    counts["missing_derivations"] = sum(len(ids) for ids in waiting.values())
+    return counts
+
+
+def write_jsonl(entries: Iterable[dict], file: IO[str]) -> int:
+    """Write entries to a file, one JSON object per line.
+
+    :returns: The number of entries written.
+    """
+    count = 0
+    for entry in entries:
+        file.write(json.dumps(entry) + "\n")
+        count += 1
+    return count
+
+
+def read_jsonl(file: IO[str]) -> Iterator[dict]:
+    """Generate the entries of a file written by write_jsonl(), skipping
+    blank lines.
+    """
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
@@ -1,23 +1,36 @@
 from .braid_models import (
     BraidDerivationModel,
+    BraidIdBlockModel,
     BraidInvalidationAction,
     BraidInvalidationModel,
+    BraidLineageClosureModel,
     BraidModelBase,
     BraidRecordModel,
+    BraidTagKeyModel,
     BraidTagsModel,
+    BraidUriPrefixModel,
     BraidUrisModel,
     InvalidationActionParamsType,
     InvalidationActionType,
+    split_uri,
 )
+from .interning import BraidInterner, interner_for
 
 __all__ = (
     "BraidInvalidationAction",
     "BraidDerivationModel",
+    "BraidIdBlockModel",
+    "BraidInterner",
     "BraidInvalidationModel",
+    "BraidLineageClosureModel",
     "BraidModelBase",
     "BraidRecordModel",
+    "BraidTagKeyModel",
     "BraidTagsModel",
+    "BraidUriPrefixModel",
     "BraidUrisModel",
     "InvalidationActionParamsType",
     "InvalidationActionType",
+    "interner_for",
+    "split_uri",
 )
@@ -1,12 +1,14 @@
 import uuid
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID
 
+from sqlalchemy import select
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlmodel import JSON, Column
 from sqlmodel import Enum as SqlmodelEnum
-from sqlmodel import Field, Relationship, SQLModel
+from sqlmodel import Field, Index, Relationship, SQLModel
 
 # InvalidationActionParamsType = Dict[str, Union[str, int, float, bool]]
 InvalidationActionParamsType = Dict[str, Any]
@@ -20,7 +22,9 @@ timestamp_now_field = Field(default_factory=datetime_now)
 
 
 class BraidModelBase(SQLModel):
-    ...
+    class Config:
+        # Hybrid properties are SQLAlchemy attributes, not pydantic fields
+        keep_untouched = (hybrid_property,)
 
 
 class BraidDerivationModel(BraidModelBase, table=True):
@@ -28,8 +32,13 @@ class BraidDerivationModel(BraidModelBase, table=True):
     record_id: Optional[int] = Field(
         default=None, primary_key=True, foreign_key="records.record_id"
     )
+    # Lookups by record_id use the primary key index, which leads with
+    # record_id, so only derivation needs its own index
     derivation: Optional[int] = Field(
-        default=None, primary_key=True, foreign_key="records.record_id"
+        default=None,
+        primary_key=True,
+        foreign_key="records.record_id",
+        index=True,
     )
     time: datetime = timestamp_now_field
 
@@ -72,19 +81,74 @@ class BraidInvalidationAction(BraidModelBase, table=True):
     )
 
 
+def split_uri(uri: str) -> Tuple[str, str]:
+    """Split a URI into the prefix stored in the uri_prefixes table, up to
+    and including its last "/", and the remaining suffix.
+    """
+    split_at = uri.rfind("/") + 1
+    return uri[:split_at], uri[split_at:]
+
+
+class BraidUriPrefixModel(BraidModelBase, table=True):
+    """The distinct prefixes of URIs, such as the directories files are in,
+    each stored once and referred to by id from the uris table.
+    """
+
+    __tablename__: str = "uri_prefixes"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # The unique index also serves lookups of a range of prefixes
+    prefix: str = Field(unique=True)
+
+
 class BraidUrisModel(BraidModelBase, table=True):
+    """A URI of a record, stored as the id of its prefix (see split_uri())
+    and the rest of the URI. It may be created with a uri argument in place
+    of prefix_id and suffix, and the full URI read back from the uri
+    property, which may also be used in queries. A prefix not yet in the DB
+    is added when the model is flushed.
+    """
+
     __tablename__: str = "uris"
+    __table_args__ = (
+        Index("ix_uris_prefix_id_suffix", "prefix_id", "suffix"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     record_id: int = Field(foreign_key="records.record_id", index=True)
-    uri: str
+    prefix_id: Optional[int] = Field(
+        default=None, foreign_key="uri_prefixes.id"
+    )
+    suffix: str
     record: "BraidRecordModel" = Relationship(back_populates="uris")
+    prefix_entry: BraidUriPrefixModel = Relationship(
+        sa_relationship_kwargs={"lazy": "joined"}
+    )
+
+    def __init__(self, **data: Any):
+        uri = data.pop("uri", None)
+        if uri is not None:
+            prefix, data["suffix"] = split_uri(uri)
+            data["prefix_entry"] = BraidUriPrefixModel(prefix=prefix)
+        super().__init__(**data)
+
+    @hybrid_property
+    def uri(self) -> str:
+        return self.prefix_entry.prefix + self.suffix
+
+    @uri.expression  # type: ignore[no-redef]
+    def uri(cls):
+        prefix = (
+            select(BraidUriPrefixModel.prefix)
+            .where(BraidUriPrefixModel.id == cls.prefix_id)
+            .scalar_subquery()
+        )
+        return prefix + cls.suffix
 
 
 class BraidRecordModel(BraidModelBase, table=True):
     __tablename__: str = "records"
     record_id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
-    time: datetime = timestamp_now_field
+    name: str = Field(index=True)
+    time: datetime = Field(default_factory=datetime_now, index=True)
     invalidation_id: Optional[UUID] = Field(
         default=None, foreign_key="invalidations.id"
     )
@@ -127,11 +191,83 @@ class BraidRecordModel(BraidModelBase, table=True):
     """
 
 
+class BraidIdBlockModel(BraidModelBase, table=True):
+    """Tracks the next id available for reservation in blocks by clients
+    allocating their own ids, keyed by the name of the table the ids are for.
+    """
+
+    __tablename__: str = "id_blocks"
+    name: str = Field(primary_key=True)
+    next_id: int
+
+
+class BraidLineageClosureModel(BraidModelBase, table=True):
+    """The transitive closure of the derivations: one row for each pair of
+    records where descendant is derived, directly or indirectly, from
+    ancestor, with the length of the shortest derivation path between them.
+    Only maintained by BraidDBs created with lineage_closure=True.
+    """
+
+    __tablename__: str = "lineage_closure"
+    ancestor: int = Field(primary_key=True, foreign_key="records.record_id")
+    # Lookups by ancestor use the primary key index
+    descendant: int = Field(
+        primary_key=True, foreign_key="records.record_id", index=True
+    )
+    depth: int
+
+
+class BraidTagKeyModel(BraidModelBase, table=True):
+    """The distinct keys of tags, each stored once and referred to by id from
+    the tags table.
+    """
+
+    __tablename__: str = "tag_keys"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(unique=True)
+
+
 class BraidTagsModel(BraidModelBase, table=True):
+    """A tag of a record. It may be created with a key argument in place of
+    key_id, and the key read back from the key property, which may also be
+    used in queries. A key not yet in the DB is added when the model is
+    flushed.
+    """
+
     __tablename__: str = "tags"
+    __table_args__ = (
+        Index("ix_tags_key_value", "key_id", "value"),
+        Index("ix_tags_key_value_int", "key_id", "value_int"),
+        Index("ix_tags_key_value_real", "key_id", "value_real"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    record_id: int = Field(foreign_key="records.record_id")
-    key: str
+    record_id: int = Field(foreign_key="records.record_id", index=True)
+    key_id: Optional[int] = Field(default=None, foreign_key="tag_keys.id")
     value: str
     tag_type: int
+    # Copies of value for INTEGER and FLOAT tags so numeric comparisons can
+    # be performed (using an index) in the DB. Cf BraidTagType
+    value_int: Optional[int] = None
+    value_real: Optional[float] = None
     record: BraidRecordModel = Relationship(back_populates="tags")
+    key_entry: BraidTagKeyModel = Relationship(
+        sa_relationship_kwargs={"lazy": "joined"}
+    )
+
+    def __init__(self, **data: Any):
+        key = data.pop("key", None)
+        if key is not None:
+            data["key_entry"] = BraidTagKeyModel(key=key)
+        super().__init__(**data)
+
+    @hybrid_property
+    def key(self) -> str:
+        return self.key_entry.key
+
+    @key.expression  # type: ignore[no-redef]
+    def key(cls):
+        return (
+            select(BraidTagKeyModel.key)
+            .where(BraidTagKeyModel.id == cls.key_id)
+            .scalar_subquery()
+        )
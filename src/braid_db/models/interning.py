@@ -0,0 +1,204 @@
+# INTERNING
+# Tag keys and URI prefixes are stored once, in the tag_keys and
+# uri_prefixes tables, and referred to by id
+
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event, insert, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from .braid_models import (
+    BraidTagKeyModel,
+    BraidTagsModel,
+    BraidUriPrefixModel,
+    BraidUrisModel,
+)
+
+# The most values bound into a single IN (...) clause
+_IN_LIST_CHUNK_SIZE = 500
+
+# For each model referring to an interned value: the relationship holding
+# the entry, the column of the entry holding the value and the entry model
+_REFERENCES = {
+    BraidTagsModel: ("key_entry", BraidTagKeyModel.__table__.c.key),
+    BraidUrisModel: ("prefix_entry", BraidUriPrefixModel.__table__.c.prefix),
+}
+_ENTRY_MODELS = {
+    BraidTagKeyModel.__tablename__: BraidTagKeyModel,
+    BraidUriPrefixModel.__tablename__: BraidUriPrefixModel,
+}
+
+
+class BraidInterner:
+    """Looks up and adds the interned values of one DB, remembering the ids
+    of those known to be committed. Entries are never removed from the
+    tables, so these stay valid. There is one for each engine, given by
+    interner_for(), and it is not typically instantiated directly.
+    """
+
+    def __init__(self):
+        # For each table, the ids of the values known to be committed
+        self._committed: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def intern_values(
+        self, session: Session, column, values: Iterable[str]
+    ) -> Dict[str, int]:
+        """Get the ids of values in the tag_keys or uri_prefixes table,
+        adding the values which are not present. Ids already known to be
+        committed are not looked up again.
+
+        :param session: The session to look up and add values on. Values
+            added are only remembered once this session commits.
+
+        :param column: The column holding the values: BraidTagKeyModel.key
+            or BraidUriPrefixModel.prefix.
+
+        :param values: The values to look up.
+
+        :returns: A dict from each of the values to its id.
+        """
+        table = column.table
+        with self._lock:
+            committed = self._committed.setdefault(table.name, {})
+        pending = self._pending(session).setdefault(table.name, {})
+        ids: Dict[str, int] = {}
+        missing: List[str] = []
+        for value in dict.fromkeys(values):
+            id_ = committed.get(value, pending.get(value))
+            if id_ is None:
+                missing.append(value)
+            else:
+                ids[value] = id_
+        if not missing:
+            return ids
+
+        # Values added by this session are pending, so any others found were
+        # committed
+        found = _select_ids(session, column, missing)
+        with self._lock:
+            committed.update(found)
+        ids.update(found)
+        new = [value for value in missing if value not in found]
+        if new:
+            session.execute(
+                _insert_ignoring_conflicts(session, column),
+                [{column.name: value} for value in new],
+            )
+            added = _select_ids(session, column, new)
+            pending.update(added)
+            ids.update(added)
+        return ids
+
+    def _pending(self, session: Session) -> Dict[str, Dict[str, int]]:
+        if "braid_interned" not in session.info:
+            event.listen(session, "after_commit", self._commit_pending)
+            event.listen(
+                session, "after_transaction_end", self._discard_pending
+            )
+            session.info["braid_interned"] = {}
+        return session.info["braid_interned"]
+
+    def _commit_pending(self, session: Session) -> None:
+        pending = session.info.get("braid_interned", {})
+        with self._lock:
+            for table_name, ids in pending.items():
+                self._committed.setdefault(table_name, {}).update(ids)
+        session.info["braid_interned"] = {}
+
+    def _discard_pending(self, session: Session, transaction) -> None:
+        # Values still pending when the outermost transaction ends were
+        # added by a transaction which was rolled back
+        if transaction.parent is None:
+            session.info["braid_interned"] = {}
+
+    def resolve_interned(self, session: Session) -> None:
+        """Replace the new tag key and URI prefix entries of models about to
+        be inserted with the entries already in the DB, adding those which
+        are missing, so that each value is only stored once. Called before
+        each session on the engine of this interner flushes.
+        """
+        refs: Dict[Any, List[Tuple[Any, str, Any]]] = {}
+        for model in list(session.new):
+            reference = _REFERENCES.get(type(model))
+            if reference is None:
+                continue
+            attr, column = reference
+            entry = inspect(model).dict.get(attr)
+            if entry is None or inspect(entry).persistent:
+                continue
+            refs.setdefault(column, []).append((model, attr, entry))
+
+        for column, column_refs in refs.items():
+            ids = self.intern_values(
+                session,
+                column,
+                [getattr(entry, column.name) for _, _, entry in column_refs],
+            )
+            entry_model = _ENTRY_MODELS[column.table.name]
+            for model, attr, entry in column_refs:
+                if entry in session:
+                    session.expunge(entry)
+                value = getattr(entry, column.name)
+                persistent = entry_model(
+                    **{"id": ids[value], column.name: value}
+                )
+                make_transient_to_detached(persistent)
+                setattr(model, attr, session.merge(persistent, load=False))
+
+
+# The interner of each engine, dropped along with the engine
+_interners: "WeakKeyDictionary[Engine, BraidInterner]" = WeakKeyDictionary()
+_interners_lock = threading.Lock()
+
+
+def interner_for(engine: Engine) -> BraidInterner:
+    """Get the BraidInterner shared by all sessions on an engine, creating it
+    the first time it is asked for.
+    """
+    with _interners_lock:
+        interner = _interners.get(engine)
+        if interner is None:
+            interner = _interners[engine] = BraidInterner()
+        return interner
+
+
+@event.listens_for(Session, "before_flush")
+def _resolve_interned(session: Session, flush_context, instances) -> None:
+    # Every session, however it was created, stores each tag key and URI
+    # prefix once. Sessions without new tags or URIs are left alone.
+    if any(type(model) in _REFERENCES for model in session.new):
+        interner_for(session.get_bind().engine).resolve_interned(session)
+
+
+def _select_ids(session: Session, column, values: List[str]) -> Dict[str, int]:
+    table = column.table
+    ids: Dict[str, int] = {}
+    for start in range(0, len(values), _IN_LIST_CHUNK_SIZE):
+        end = start + _IN_LIST_CHUNK_SIZE
+        chunk = values[start:end]
+        rows = session.execute(
+            select(column, table.c.id).where(column.in_(chunk))
+        )
+        ids.update((value, id_) for value, id_ in rows)
+    return ids
+
+
+def _insert_ignoring_conflicts(session: Session, column):
+    """Internal helper building an insert into the table of column which
+    skips values added concurrently by another session, where the dialect
+    supports it.
+    """
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(column.table)
+    return dialect_insert(column.table).on_conflict_do_nothing(
+        index_elements=[column]
+    )
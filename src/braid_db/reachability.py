@@ -0,0 +1,229 @@
+# REACHABILITY
+# An interval labeling of the derivation graph answering "is derived from"
+
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+# An interval of numbers, inclusive at both ends
+Interval = Tuple[int, int]
+
+# The count of numbers reserved for each record, so that records derived
+# from it later can be numbered within its interval
+_SPACING = 2**32
+
+
+class BraidReachabilityIndex:
+    """Interval labels over the derivation graph, answering whether one
+    record is reachable from another with a binary search over a short list,
+    without touching the DB.
+
+    Each record is numbered in the post-order of a depth-first spanning
+    forest of the graph, followed by a range of numbers reserved for it. A
+    record's label is a sorted list of disjoint intervals of these numbers
+    covering exactly the records reachable from it: its spanning tree
+    subtree, plus the labels of its other derivations, merged. For the
+    tree-shaped lineages typical of provenance, most labels are a single
+    interval.
+
+    New records and derivations are added incrementally with add_record()
+    and add_derivation(). A new record derived from an indexed one is
+    numbered from the first half of that record's reserved range and takes
+    the rest of the first half as its own reserved range. As these numbers
+    are already covered by the labels of every ancestor, nothing else
+    changes. Otherwise, a new derivation merges the label of the derived
+    record into the labels of the record it derives from and that record's
+    ancestors, stopping at ancestors whose labels already cover it.
+    """
+
+    def __init__(self):
+        self._post: Dict[int, int] = {}
+        self._labels: Dict[int, List[Interval]] = {}
+        self._parents: Dict[int, List[int]] = {}
+        self._free: Dict[int, Interval] = {}
+        self._next_post = 0
+
+    def __len__(self) -> int:
+        return len(self._post)
+
+    def __contains__(self, record_id: int) -> bool:
+        return record_id in self._post
+
+    @property
+    def interval_count(self) -> int:
+        """The total number of intervals in all labels."""
+        return sum(len(label) for label in self._labels.values())
+
+    def build(
+        self, record_ids: Iterable[int], edges: Iterable[Tuple[int, int]]
+    ) -> None:
+        """Replace the contents of the index with a graph.
+
+        :param record_ids: The ids of all records, including those without
+            derivations.
+
+        :param edges: The (record_id, derivation) pairs of the graph.
+        """
+        children: Dict[int, List[int]] = {}
+        self._parents = {}
+        for record_id in record_ids:
+            children.setdefault(record_id, [])
+        for record_id, derivation in edges:
+            children.setdefault(record_id, []).append(derivation)
+            children.setdefault(derivation, [])
+            self._parents.setdefault(derivation, []).append(record_id)
+
+        # Iterative depth-first search from the records with no parents
+        # first, numbering records as they are finished
+        self._post = {}
+        self._labels = {}
+        self._free = {}
+        self._next_post = 0
+        low: Dict[int, int] = {}
+        roots = [r for r in children if r not in self._parents]
+        roots.extend(r for r in children if r in self._parents)
+        for root in roots:
+            if root in low:
+                continue
+            low[root] = self._next_post
+            stack = [(root, iter(children[root]))]
+            while stack:
+                record_id, remaining = stack[-1]
+                for child in remaining:
+                    if child not in low:
+                        low[child] = self._next_post
+                        stack.append((child, iter(children[child])))
+                        break
+                else:
+                    stack.pop()
+                    self._allocate(record_id, low[record_id])
+
+        # In post-order, each record's derivations are finished before it,
+        # except where a derivation closes a cycle. Those are added as
+        # though new, once all other labels are complete.
+        cycle_edges = []
+        for record_id in sorted(self._post, key=self._post.__getitem__):
+            label = self._labels[record_id]
+            for child in children[record_id]:
+                if self._post[child] < self._post[record_id]:
+                    label = _merge(label, self._labels[child])
+                else:
+                    cycle_edges.append((record_id, child))
+            self._labels[record_id] = label
+        for record_id, derivation in cycle_edges:
+            self._propagate(record_id, self._labels[derivation])
+
+    def add_record(self, record_id: int) -> None:
+        """Add a record with no derivations. Records already in the index are
+        left as they are.
+        """
+        if record_id not in self._post:
+            self._allocate(record_id, self._next_post)
+
+    def _allocate(self, record_id: int, low: int) -> None:
+        """Internal method numbering a record after all records numbered so
+        far and reserving the following numbers for it. Its label starts at
+        low, the first number of its spanning tree subtree.
+        """
+        post = self._next_post
+        self._next_post += _SPACING
+        self._post[record_id] = post
+        self._free[record_id] = (post + 1, self._next_post - 1)
+        self._labels[record_id] = [(low, self._next_post - 1)]
+
+    def add_derivation(self, record_id: int, derivation: int) -> None:
+        """Add a derivation from record_id to derivation, adding either
+        record if it is not yet in the index.
+        """
+        self.add_record(record_id)
+        if derivation not in self._post and record_id in self._free:
+            low, high = self._free.pop(record_id)
+            middle = low + (high - low) // 2
+            self._post[derivation] = low
+            self._labels[derivation] = [(low, middle)]
+            if low < middle:
+                self._free[derivation] = (low + 1, middle)
+            if middle < high:
+                self._free[record_id] = (middle + 1, high)
+            self._parents[derivation] = [record_id]
+            return
+        self.add_record(derivation)
+        parents = self._parents.setdefault(derivation, [])
+        if record_id in parents:
+            return
+        parents.append(record_id)
+        self._propagate(record_id, self._labels[derivation])
+
+    def _propagate(self, record_id: int, label: List[Interval]) -> None:
+        """Internal method merging a label into the label of a record and
+        of all its ancestors which do not already cover it.
+        """
+        pending = [record_id]
+        while pending:
+            current = pending.pop()
+            current_label = self._labels[current]
+            if _covers(current_label, label):
+                continue
+            self._labels[current] = _merge(current_label, label)
+            pending.extend(self._parents.get(current, []))
+
+    def reaches(self, record_id: int, other_id: int) -> bool:
+        """Whether other_id is record_id or is derived, directly or
+        indirectly, from record_id. Records not in the index reach only
+        themselves.
+        """
+        if record_id == other_id:
+            return True
+        label = self._labels.get(record_id)
+        post = self._post.get(other_id)
+        if label is None or post is None:
+            return False
+        return _contains(label, post)
+
+    def is_derived_from(self, record_id: int, ancestor_id: int) -> bool:
+        """Whether record_id is derived, directly or indirectly, from
+        ancestor_id. A record is derived from itself only if it is part of a
+        cycle of derivations.
+        """
+        if record_id != ancestor_id:
+            return self.reaches(ancestor_id, record_id)
+        return any(
+            self.reaches(record_id, parent)
+            for parent in self._parents.get(record_id, [])
+        )
+
+
+def _contains(label: List[Interval], post: int) -> bool:
+    i = bisect_right(label, (post, float("inf"))) - 1
+    return i >= 0 and label[i][1] >= post
+
+
+def _covers(label: List[Interval], other: List[Interval]) -> bool:
+    """Whether every interval of other lies within an interval of label."""
+    for low, high in other:
+        i = bisect_right(label, (low, float("inf"))) - 1
+        if i < 0 or label[i][1] < high:
+            return False
+    return True
+
+
+def _merge(label: List[Interval], other: List[Interval]) -> List[Interval]:
+    """Internal helper merging two labels into one, joining intervals which
+    overlap or are adjacent.
+    """
+    if len(other) > len(label):
+        label, other = other, label
+    merged = list(label)
+    for low, high in other:
+        # Insert each interval of the shorter label at its place in the
+        # longer one, absorbing the neighbours it overlaps or touches
+        i = bisect_right(merged, (low, float("inf")))
+        if i > 0 and merged[i - 1][1] + 1 >= low:
+            i -= 1
+            low = merged[i][0]
+            high = max(high, merged[i][1])
+        j = i
+        while j < len(merged) and merged[j][0] <= high + 1:
+            high = max(high, merged[j][1])
+            j += 1
+        merged[i:j] = [(low, high)]
+    return merged
@@ -0,0 +1,136 @@
+# RECORD CACHE
+# A process-local cache of record models looked up by id
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from .models import BraidRecordModel
+
+_Entry = Tuple[BraidRecordModel, Optional[float]]
+
+
+class BraidRecordCache:
+    """Bounded least-recently-used cache of BraidRecordModels keyed by record
+    id, used by BraidDB.get_record_model_by_id() when the BraidDB is created
+    with a record_cache_size.
+
+    Only the columns of the records table (name, time, invalidation and
+    invalidation action ids) are cached. Relationships such as uris and tags
+    are still loaded from the DB when accessed, though BraidRecord evicts a
+    record when tags or derivations are added to it. Entries are copies
+    which are never associated with a session, so changes made to a model
+    returned from the cache do not affect the cache.
+
+    The cache only sees changes made through the BraidDB which owns it.
+    Other processes writing to the same DB, for instance invalidating a
+    cached record, are only noticed once the entry expires, if the cache has
+    a ttl.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        """Create an empty cache.
+
+        :param max_size: The most records held. Once full, the least recently
+            used record is dropped to make room for a new one.
+
+        :param ttl: If provided, the number of seconds a record is served
+            from the cache after it was looked up in the DB. After that, it is
+            looked up again, picking up changes made by other processes.
+        """
+        if max_size < 1:
+            raise ValueError(f"max_size must be positive, not {max_size}")
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f"ttl must be positive, not {ttl}")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Each record with the time.monotonic() time it expires at, if any
+        self._models: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, record_id: int) -> Optional[BraidRecordModel]:
+        """Look up a record, counting a hit or a miss.
+
+        :param record_id: The id of the record.
+
+        :returns: A new detached copy of the cached record model, or None if
+            the record is not cached or its entry has expired.
+        """
+        with self._lock:
+            entry = self._models.get(record_id)
+            if entry is not None and entry[1] is not None:
+                if time.monotonic() >= entry[1]:
+                    del self._models[record_id]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            model = entry[0]
+            self.hits += 1
+            self._models.move_to_end(record_id)
+        return _detached_copy(model)
+
+    def put(self, model: BraidRecordModel) -> None:
+        """Add or replace the entry for a record.
+
+        :param model: The record model to cache a copy of. It must have been
+            written to the DB.
+        """
+        if model.record_id is None:
+            return
+        copy = _detached_copy(model)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._models[model.record_id] = (copy, expires)
+            self._models.move_to_end(model.record_id)
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+
+    def evict(self, record_id: Optional[int]) -> None:
+        """Drop the entry for a record, if any.
+
+        :param record_id: The id of the record.
+        """
+        with self._lock:
+            self._models.pop(record_id, None)
+
+    def clear(self) -> None:
+        """Drop all entries. The hit and miss counts are kept."""
+        with self._lock:
+            self._models.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hits, misses, current size and max_size of the cache.
+        Expired entries not yet looked up again are included in the size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._models),
+                "max_size": self.max_size,
+            }
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+
+def _detached_copy(model: BraidRecordModel) -> BraidRecordModel:
+    """Internal helper copying the column values of a record model into a new
+    model in the detached state, as if it had been loaded by a session which
+    has since been closed. This allows it to be merged into a session without
+    loading it from the DB.
+    """
+    values = {
+        attr.key: getattr(model, attr.key)
+        for attr in inspect(BraidRecordModel).column_attrs
+    }
+    copy = BraidRecordModel(**values)
+    make_transient_to_detached(copy)
+    return copy
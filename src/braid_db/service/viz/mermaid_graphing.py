@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Set
+from typing import Any, Dict, List, Set
 from uuid import UUID
 
 from braid_db import BraidDB, BraidRecord
@@ -34,8 +34,12 @@ def quote_str(s: Any) -> str:
     return '"' + str(s) + '"'
 
 
+def node_name_for_record_id(record_id: int) -> str:
+    return f"record{record_id}"
+
+
 def node_name_for_record(record: BraidRecord) -> str:
-    return f"record{record.record_id}"
+    return node_name_for_record_id(record.record_id)
 
 
 def node_name_for_invalidation_action(
@@ -132,52 +136,52 @@ def to_mermaid(root_record_id: int, DB: BraidDB) -> str:
     graph_def = "graph TD\n"
     session = DB.get_session()
 
-    record = DB.get_record_model_by_id(root_record_id, session=session)
-    to_visit = [record]
+    # Visit the records connected to the root one level at a time, so that
+    # the records of a level and their derivations are loaded with a few
+    # queries rather than several for each record
+    to_visit = [root_record_id]
     while len(to_visit) > 0:
-        record = to_visit.pop()
-        rec_node_name = node_name_for_record(record)
-        graph_def += record_to_mermaid_shape(record) + "\n"
-        visited.add(record.record_id)
-
-        if record.invalidation_action is not None:
-            graph_def += (
-                invalidation_action_to_mermaid_shape(
+        visited.update(to_visit)
+        records = DB.get_record_models_by_ids(to_visit, session=session)
+        edges = DB.get_derivation_edges(to_visit, session=session)
+        derivatives: Dict[int, List[int]] = {}
+        for from_id, derivative_id in edges:
+            derivatives.setdefault(from_id, []).append(derivative_id)
+        for record in records:
+            rec_node_name = node_name_for_record(record)
+            graph_def += record_to_mermaid_shape(record) + "\n"
+
+            if record.invalidation_action is not None:
+                graph_def += (
+                    invalidation_action_to_mermaid_shape(
+                        record.invalidation_action
+                    )
+                    + "\n"
+                )
+                action_node_name = node_name_for_invalidation_action(
                     record.invalidation_action
                 )
-                + "\n"
-            )
-            action_node_name = node_name_for_invalidation_action(
-                record.invalidation_action
-            )
-            graph_def += f"{action_node_name} -.-> {rec_node_name}\n"
+                graph_def += f"{action_node_name} -.-> {rec_node_name}\n"
 
-        if record.invalidation is not None:
-            graph_def += (
-                invalidation_to_mermaid_shape(record.invalidation) + "\n"
-            )
-            invalidation_node_name = node_name_for_invalidation(
-                record.invalidation
-            )
-            graph_def += (
-                f"{invalidation_node_name} -.-o|Invalidates| {rec_node_name}\n"
-            )
+            if record.invalidation is not None:
+                graph_def += (
+                    invalidation_to_mermaid_shape(record.invalidation) + "\n"
+                )
+                invalidation_node_name = node_name_for_invalidation(
+                    record.invalidation
+                )
+                graph_def += (
+                    f"{invalidation_node_name} -.-o|Invalidates| "
+                    f"{rec_node_name}\n"
+                )
+
+            for derivative_id in derivatives.get(record.record_id, []):
+                deriv_node_name = node_name_for_record_id(derivative_id)
+                graph_def += f"{rec_node_name}-->{deriv_node_name}\n"
 
-        derivatives = DB.get_derivations(record.record_id, session)
-
-        for derivative in derivatives:
-            deriv_node_name = node_name_for_record(derivative)
-            graph_def += f"{rec_node_name}-->{deriv_node_name}\n"
-            if (
-                derivative.record_id not in visited
-                and derivative not in to_visit
-            ):
-                to_visit.append(derivative)
-
-        predecessors = DB.get_predecessors(record.record_id, session)
-        for pred in predecessors:
-            if pred.record_id not in visited and pred not in to_visit:
-                to_visit.append(pred)
+        to_visit = sorted(
+            {record_id for edge in edges for record_id in edge} - visited
+        )
     session.close()
     return graph_def
 
@@ -0,0 +1,86 @@
+# TOOLS DB EXPORT
+# Write the contents of a DB to files for analysis or transfer
+
+import argparse
+from pathlib import Path
+from typing import Dict
+
+from braid_db import BraidDB
+
+
+def export_parquet(
+    db: BraidDB, output: Path, chunk_size: int
+) -> Dict[str, int]:
+    """Write each exported table of the DB to <table>.parquet in the output
+    directory, one batch of rows at a time.
+
+    :returns: A dict from table name to the number of rows written.
+    """
+    import pyarrow.parquet as pq
+
+    from braid_db.arrow_export import EXPORT_TABLES, schema
+
+    output.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for table in EXPORT_TABLES:
+        counts[table] = 0
+        with pq.ParquetWriter(output / f"{table}.parquet", schema(table)) as w:
+            for batch in db.arrow_batches(table, chunk_size):
+                w.write_batch(batch)
+                counts[table] += batch.num_rows
+    return counts
+
+
+def export_jsonl(db: BraidDB, output: Path, chunk_size: int) -> Dict[str, int]:
+    """Write the invalidations and records of the DB, with their URIs, tags
+    and derivations, to a JSON Lines file which db-import can load.
+
+    :returns: A dict with the number of entries written.
+    """
+    from braid_db.jsonl_transfer import export_entries, write_jsonl
+
+    with open(output, "w") as fp:
+        return {"entries": write_jsonl(export_entries(db, chunk_size), fp)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the contents of a Braid DB."
+    )
+    parser.add_argument("-v", action="store_true", help="Be verbose")
+    parser.add_argument(
+        "--format",
+        choices=["parquet", "jsonl"],
+        default="parquet",
+        help="The output format: parquet writes a directory with one file "
+        "per table, jsonl writes one file with one line per record",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="The number of rows read from the DB at a time "
+        "(default 100000 for parquet, 1000 records for jsonl)",
+    )
+    parser.add_argument("db", action="store", help="specify DB file")
+    parser.add_argument(
+        "output", action="store", help="output directory or file"
+    )
+    args = parser.parse_args()
+    argvars = vars(args)
+
+    db = BraidDB(argvars["db"])
+    output = Path(argvars["output"])
+    chunk_size = argvars["chunk_size"]
+    if argvars["format"] == "jsonl":
+        counts = export_jsonl(db, output, chunk_size or 1000)
+    else:
+        counts = export_parquet(db, output, chunk_size or 100000)
+
+    if argvars["v"]:
+        for name, count in counts.items():
+            print(f"db-export: {name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# TOOLS DB IMPORT
+# Add the contents of a JSONL export to a DB
+
+import argparse
+
+from braid_db import BraidDB
+from braid_db.jsonl_transfer import import_entries, read_jsonl
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import a JSONL file written by db-export into a Braid "
+        "DB, which need not be empty. Records are given new ids."
+    )
+    parser.add_argument("-v", action="store_true", help="Be verbose")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="The number of entries added in each transaction",
+    )
+    parser.add_argument("db", action="store", help="specify DB file")
+    parser.add_argument("input", action="store", help="JSONL file")
+    args = parser.parse_args()
+    argvars = vars(args)
+
+    db = BraidDB(argvars["db"])
+    db.upgrade()
+    with open(argvars["input"]) as fp:
+        counts = import_entries(db, read_jsonl(fp), argvars["chunk_size"])
+
+    if argvars["v"]:
+        for name, count in counts.items():
+            print(f"db-import: {name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# TOOLS DB REBUILD CLOSURE
+# Fill the lineage_closure table of an existing DB from its derivations
+
+import argparse
+
+from braid_db import BraidDB
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the lineage closure table of a Braid DB."
+    )
+    parser.add_argument("-v", action="store_true", help="Be verbose")
+    parser.add_argument("db", action="store", help="specify DB file")
+    args = parser.parse_args()
+    argvars = vars(args)
+
+    db_file = argvars["db"]
+
+    db = BraidDB(db_file, lineage_closure=True)
+    db.upgrade()
+    rows = db.rebuild_lineage_closure()
+
+    if argvars["v"]:
+        print(f"db-rebuild-closure: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# TOOLS DB UPGRADE
+# Bring an existing DB up to date with the current schema
+
+import argparse
+
+from braid_db import BraidDB
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upgrade an existing Braid DB to the current schema."
+    )
+    parser.add_argument("-v", action="store_true", help="Be verbose")
+    parser.add_argument(
+        "--search-index",
+        action="store_true",
+        help="Also create the full-text search index",
+    )
+    parser.add_argument("db", action="store", help="specify DB file")
+    args = parser.parse_args()
+    argvars = vars(args)
+
+    db_file = argvars["db"]
+
+    db = BraidDB(db_file)
+    created = db.upgrade()
+    if argvars["search_index"] and db.create_search_index():
+        created.append("record_search")
+
+    if argvars["v"]:
+        for name in created:
+            print(f"db-upgrade: created {name}")
+
+
+if __name__ == "__main__":
+    main()
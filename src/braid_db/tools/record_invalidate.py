@@ -5,6 +5,11 @@ from braid_db import BraidDB, BraidRecord
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Report what would be invalidated without changing the DB",
+    )
     parser.add_argument("db_file", type=str, nargs=1)
     parser.add_argument("cause", type=str, nargs=1)
     parser.add_argument("record_ids", type=int, nargs="*")
@@ -16,9 +21,18 @@ def main():
     session = db.get_session()
     for record_id in args.record_ids:
         rec = BraidRecord.by_record_id(db, record_id, session=session)
+        if args.dry_run:
+            print(
+                f"Impact of invalidating record id {record_id} ({rec.name}):"
+            )
+            print(rec.invalidation_impact(session=session))
+            continue
         print(f"Invalidating record id {record_id} with name {rec.name}")
         rec.invalidate(cause=cause, session=session)
-    session.commit()
+    if not args.dry_run:
+        session.commit()
+    for result in db.invalidation_action_results():
+        print(result)
 
 
 if __name__ == "__main__":